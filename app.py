@@ -18,6 +18,79 @@ def get_base64_of_image(file_path):
         st.error(f"Error encoding image: {e}")
         return None
 
+# Follow an SOS alert's server-sent events, yielding each status snapshot until all messages are final
+def follow_sos_status(events_url, timeout=120):
+    import json
+    deadline = time.time() + timeout
+    with requests.get(f"{API_BASE_URL}{events_url}", stream=True, timeout=(5, 30)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data:"):
+                snapshot = json.loads(line[len("data:"):])
+                yield snapshot
+                if snapshot["done"]:
+                    return
+            if time.time() > deadline:
+                return
+
+# Stream Janani's answer into a chat bubble token by token and return the full text
+def ask_janani(question):
+    import json
+    placeholder = st.empty()
+    avatar = "https://img.icons8.com/color/48/000000/chatbot.png"
+    answer = ""
+    try:
+        with requests.post(f"{API_BASE_URL}/chat/stream", json={"question": question}, stream=True, timeout=(5, 120)) as response:
+            if response.status_code == 503:
+                return "Janani is answering a lot of questions right now. Please try again in a few seconds."
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "queued":
+                        placeholder.markdown(
+                            f'<div class="janani-message assistant"><img src="{avatar}" alt="Avatar">'
+                            f'<div class="janani-message-content"><p>Janani is busy, you are number '
+                            f'{data["position"]} in line…</p></div></div>',
+                            unsafe_allow_html=True
+                        )
+                    elif event == "token":
+                        answer += data["content"]
+                        placeholder.markdown(
+                            f'<div class="janani-message assistant"><img src="{avatar}" alt="Avatar">'
+                            f'<div class="janani-message-content"><p>{answer}▌</p></div></div>',
+                            unsafe_allow_html=True
+                        )
+                    elif event == "done":
+                        answer = data["answer"]
+                    elif event == "error":
+                        answer = data["error"]
+    except requests.exceptions.RequestException as e:
+        answer = f"Sorry, I couldn’t process your request: {str(e)}"
+    return answer or "Sorry, I couldn’t process your request."
+
+SOS_STATUS_ICONS = {"delivered": "✅", "read": "✅", "undelivered": "❌", "failed": "❌", "canceled": "❌", "send_failed": "❌"}
+
+# SOS result card with the delivery status of each contact, redrawn in place as it changes
+def render_sos_card(placeholder, title, text, messages):
+    statuses = "".join(
+        f"<li>{message['contact']}: {SOS_STATUS_ICONS.get(message['status'], '⏳')} {message['status']}</li>"
+        for message in messages
+    )
+    placeholder.markdown(f"""
+        <div class="result-card">
+            <img src="https://img.icons8.com/ios-filled/50/F06292/siren.png" alt="SOS Icon">
+            <div>
+                <h4>{title}</h4>
+                <p>{text}</p>
+                <ul>{statuses}</ul>
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
 # Streamlit page configuration
 st.set_page_config(page_title="HerHealth", page_icon="assets/gynae_genius.png", layout="wide")
 
@@ -907,12 +980,16 @@ with st.container():
         if st.button("SEND SOS ALERT", key="sos_button"):
             if latitude is not None and longitude is not None:
                 try:
+                    # Repeated presses within two minutes reuse the key, so contacts get one alert, not a flood
+                    if time.time() - st.session_state.get("sos_key_time", 0) > 120:
+                        st.session_state["sos_key"] = base64.urlsafe_b64encode(os.urandom(12)).decode()
+                    st.session_state["sos_key_time"] = time.time()
                     with st.spinner("Sending alert..."):
                         response = requests.post(f"{API_BASE_URL}/sos", json={
                             "latitude": latitude,
                             "longitude": longitude,
                             "emergency_contacts": ["+917075735181"]
-                        })
+                        }, headers={"Idempotency-Key": st.session_state["sos_key"]})
                         response.raise_for_status()
                         result = response.json()
                         if result.get("simulated", False):
@@ -925,23 +1002,34 @@ with st.container():
                                     </div>
                                 </div>
                             """, unsafe_allow_html=True)
-                        elif result.get("all_delivered", False):
-                            st.markdown(f"""
-                                <div class="result-card">
-                                    <img src="https://img.icons8.com/ios-filled/50/F06292/siren.png" alt="SOS Icon">
-                                    <div>
-                                        <h4>SOS Alert Sent</h4>
-                                        <p>Alert sent and delivered successfully!</p>
-                                    </div>
-                                </div>
-                            """, unsafe_allow_html=True)
+                        elif result.get("alert_id"):
+                            # The backend has only queued the alert; the card follows each contact's delivery live
+                            if result.get("duplicate"):
+                                title = "SOS Already in Progress"
+                                text = "You pressed SOS a moment ago, so your contacts won't get a second alert. This is the status of the first one."
+                            else:
+                                title = "SOS Alert Queued"
+                                text = "Your alert is queued and is being sent to your emergency contacts."
+                            card = st.empty()
+                            render_sos_card(card, title, text, result.get("sent_messages", []))
+                            if result.get("events_url"):
+                                try:
+                                    for snapshot in follow_sos_status(result["events_url"]):
+                                        if snapshot["all_delivered"]:
+                                            title, text = "SOS Alert Delivered", "All your emergency contacts have received your alert."
+                                        elif snapshot["done"]:
+                                            title = "SOS Alert Not Delivered to Everyone"
+                                            text = "Some contacts could not be reached. Please call them or local emergency services directly."
+                                        render_sos_card(card, title, text, snapshot["messages"])
+                                except requests.exceptions.RequestException as e:
+                                    st.markdown(f"Could not follow delivery status: {e}")
                         else:
                             st.markdown(f"""
                                 <div class="result-card">
                                     <img src="https://img.icons8.com/ios-filled/50/FF5252/error.png" alt="Error Icon">
                                     <div>
-                                        <h4>Delivery Failed</h4>
-                                        <p>Alert sent but not delivered to all contacts. Check logs for details.</p>
+                                        <h4>Sending Failed</h4>
+                                        <p>Alert could not be sent. Check logs for details.</p>
                                     </div>
                                 </div>
                             """, unsafe_allow_html=True)
@@ -1031,6 +1119,7 @@ with st.container():
 
         # Quick replies
         st.markdown('<div class="quick-replies">', unsafe_allow_html=True)
+        # Answers to these are pre-warmed by the backend (janani.QUICK_REPLIES); keep the two lists in sync
         quick_replies = [
             "What are common pregnancy symptoms?",
             "What foods should I avoid during pregnancy?",
@@ -1042,14 +1131,7 @@ with st.container():
             with cols[i]:
                 if st.button(reply, key=f"quick_reply_{i}"):
                     st.session_state.messages.append({"role": "human", "content": reply})
-                    with st.spinner("Janani is thinking..."):
-                        try:
-                            response = requests.post(f"{API_BASE_URL}/chat", json={"question": reply})
-                            response.raise_for_status()
-                            answer = response.json().get("answer", "Sorry, I couldn’t process your request.")
-                        except requests.exceptions.RequestException as e:
-                            answer = f"Sorry, I couldn’t process your request: {str(e)}"
-                        st.session_state.messages.append({"role": "assistant", "content": answer})
+                    st.session_state.messages.append({"role": "assistant", "content": ask_janani(reply)})
                     st.rerun()
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -1062,14 +1144,7 @@ with st.container():
             )
             if question:
                 st.session_state.messages.append({"role": "human", "content": question})
-                with st.spinner("Janani is thinking..."):
-                    try:
-                        response = requests.post(f"{API_BASE_URL}/chat", json={"question": question})
-                        response.raise_for_status()
-                        answer = response.json().get("answer", "Sorry, I couldn’t process your request.")
-                    except requests.exceptions.RequestException as e:
-                        answer = f"Sorry, I couldn’t process your request: {str(e)}"
-                    st.session_state.messages.append({"role": "assistant", "content": answer})
+                st.session_state.messages.append({"role": "assistant", "content": ask_janani(question)})
                 st.rerun()
         with col2:
             if st.button("Clear Chat", key="clear_chat"):
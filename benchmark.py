@@ -0,0 +1,385 @@
+import argparse
+import asyncio
+import gc
+import importlib.metadata
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Benchmark the model path, not the result cache or the reload watcher; set these to override
+BENCH_ENV_DEFAULTS = {
+    "HERHEALTH_CACHE_ENABLED": "0",
+    "HERHEALTH_MODEL_WATCH_INTERVAL": "0",
+}
+for _key, _value in BENCH_ENV_DEFAULTS.items():
+    os.environ.setdefault(_key, _value)
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+# A result is a regression when it is this much worse than the baseline (0.10 = 10%)
+REGRESSION_THRESHOLD = float(os.getenv("HERHEALTH_BENCH_THRESHOLD", 0.10))
+GROUPS = ("import", "init", "single", "batch", "api", "metrics")
+PACKAGES = ["numpy", "pandas", "scikit-learn", "fastapi", "starlette", "pydantic", "httpx", "uvicorn"]
+
+# Child-process snippets: each prints its measurement in seconds (or "null" if it can't run)
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+INIT_SNIPPET = """
+import time, model_store, {module} as m
+if model_store.current_version(m.MODEL_NAME, model_store.dataset_hash(m.csv_path)) is None:
+    print("null")
+else:
+    t = time.perf_counter(); m.{initialize}(); print(time.perf_counter() - t)
+"""
+MODELS = {
+    "risk": ("risk_management", "initialize_risk_model", "Maternal_Health_Risk_Data_Set.csv"),
+    "fetal": ("fetus_health", "initialize_fetal_model", "fetal_health.csv"),
+}
+
+
+UNIT_SCALES = {"ms": 1e3, "us": 1e6}
+
+
+def summarize(samples, unit_scale=1000.0):
+    # Latency samples in seconds -> summary in milliseconds (or whatever unit_scale gives)
+    values = np.sort(np.asarray(samples) * unit_scale)
+    return {
+        "n": len(values),
+        "mean": float(values.mean()),
+        "min": float(values[0]),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values[-1]),
+    }
+
+
+def latency_result(samples, round_medians=None, unit="ms"):
+    # The headline value is the best round's median: background load only ever adds time,
+    # so it is the most repeatable number on a shared machine
+    stats = summarize(samples, UNIT_SCALES[unit])
+    value = min(round_medians) * UNIT_SCALES[unit] if round_medians else stats["p50"]
+    return {"value": value, "unit": unit, "better": "lower", "stats": stats}
+
+
+def time_calls(fn, args_list, warmup, rounds=1):
+    """Time fn(*args) once per args, `rounds` times over; returns (all samples, median of each round)."""
+    for args in args_list[:warmup]:
+        fn(*args)
+    samples, round_medians = [], []
+    for _ in range(rounds):
+        # GC is held off while timing, as timeit does
+        gc.collect()
+        gc.disable()
+        try:
+            round_samples = []
+            for args in args_list[warmup:]:
+                start = time.perf_counter()
+                fn(*args)
+                round_samples.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+        samples.extend(round_samples)
+        round_medians.append(statistics.median(round_samples))
+    return samples, round_medians
+
+
+def run_snippet(code):
+    out = subprocess.run([sys.executable, "-c", code], cwd=script_dir, capture_output=True, text=True, check=True)
+    value = out.stdout.strip().splitlines()[-1]
+    return None if value == "null" else float(value)
+
+
+def dataset_rows(model, n_rows, seed=0):
+    """Rows from the bundled dataset in the model's feature order, sampled reproducibly."""
+    import pandas as pd
+
+    module = importlib.import_module(MODELS[model][0])
+    columns = module.selected_features if model == "risk" else module.important_features
+    data = pd.read_csv(os.path.join(script_dir, "data", MODELS[model][2]), usecols=columns)[columns]
+    rng = np.random.default_rng(seed)
+    return data.to_numpy(dtype=np.float64)[rng.integers(0, len(data), n_rows)]
+
+
+def load_models():
+    import fetus_health
+    import risk_management
+
+    fetus_health.initialize_fetal_model()
+    risk_management.initialize_risk_model()
+    return {"fetal": fetus_health.model_version, "risk": risk_management.model_version}
+
+
+def bench_import(repeat):
+    run_snippet(IMPORT_SNIPPET)  # warm the OS file cache
+    samples = [run_snippet(IMPORT_SNIPPET) for _ in range(repeat)]
+    return {"import_main": latency_result(samples, samples)}
+
+
+def bench_init(repeat):
+    results = {}
+    for name, (module, initialize, _) in MODELS.items():
+        samples = [run_snippet(INIT_SNIPPET.format(module=module, initialize=initialize)) for _ in range(repeat)]
+        if None in samples:
+            logger.warning(f"Skipping {name} model init: no current stored version, run train_models.py first")
+            continue
+        results[f"init.{name}"] = latency_result(samples, samples)
+    return results
+
+
+def bench_single(iterations, rounds):
+    import fetus_health
+    import risk_management
+
+    warmup = max(10, iterations // 10)
+    risk_rows = dataset_rows("risk", iterations + warmup)
+    fetal_rows = dataset_rows("fetal", iterations + warmup)
+    return {
+        "predict_risk.single": latency_result(
+            *time_calls(risk_management.predict_risk, [tuple(row) for row in risk_rows], warmup, rounds)
+        ),
+        "predict_fetal_health.single": latency_result(
+            *time_calls(fetus_health.predict_fetal_health, [(row,) for row in fetal_rows], warmup, rounds)
+        ),
+    }
+
+
+def bench_batch(batch_sizes, rows_per_size, rounds):
+    import fetus_health
+    import risk_management
+
+    results = {}
+    for name, predict_batch in (("predict_risk_batch", risk_management.predict_risk_batch),
+                                ("predict_fetal_health_batch", fetus_health.predict_fetal_health_batch)):
+        rows = dataset_rows("risk" if "risk" in name else "fetal", max(batch_sizes))
+        for size in batch_sizes:
+            repeats = max(5, min(500, rows_per_size // size))
+            samples, round_medians = time_calls(predict_batch, [(rows[:size],)] * (repeats + 2), 2, rounds)
+            results[f"{name}.{size}"] = {
+                "value": size / min(round_medians),
+                "unit": "rows/s",
+                "better": "higher",
+                "stats": {**summarize(samples), "batch_size": size},
+            }
+    return results
+
+
+async def _bench_api(requests_per_route, rounds):
+    import httpx
+    import main
+
+    risk_rows = dataset_rows("risk", requests_per_route, seed=1)
+    fetal_rows = dataset_rows("fetal", requests_per_route, seed=1)
+    payloads = {
+        "/predict_risk": [dict(zip(main.HEALTH_DATA_FIELDS, row)) for row in risk_rows],
+        "/predict_fetal_health": [dict(zip(main.FETAL_DATA_FIELDS, row)) for row in fetal_rows],
+    }
+    results = {}
+    # Runs the app's real startup (background model initialization) and waits until it is ready
+    async with main.app.router.lifespan_context(main.app):
+        started = time.perf_counter()
+        while not main.initializer.ready():
+            if any(state["state"] == "failed" for state in main.initializer.states.values()):
+                raise RuntimeError(f"Model initialization failed: {main.initializer.status()}")
+            await asyncio.sleep(0.05)
+        results["api.time_to_ready"] = latency_result([time.perf_counter() - started])
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            calls = {"/test": [None] * requests_per_route, **payloads}
+            for route, bodies in calls.items():
+                samples, round_medians = [], []
+                for round_index in range(rounds):
+                    round_samples = []
+                    # The first requests of the first round warm up the route and aren't counted
+                    warmup = 10 if round_index == 0 else 0
+                    for i, body in enumerate(bodies[:warmup] + bodies):
+                        start = time.perf_counter()
+                        if body is None:
+                            response = await client.get(route)
+                        else:
+                            response = await client.post(route, json=body)
+                        elapsed = time.perf_counter() - start
+                        response.raise_for_status()
+                        if i >= warmup:
+                            round_samples.append(elapsed)
+                    samples.extend(round_samples)
+                    round_medians.append(statistics.median(round_samples))
+                results[f"api{route.replace('/', '.')}"] = latency_result(samples, round_medians)
+    return results
+
+
+async def _per_call(app, scope, n):
+    # Mean seconds per call over n back-to-back calls of an ASGI app
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / n
+
+
+async def _bench_metrics(calls, rounds):
+    import main
+    import metrics
+
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    instrumented = metrics.MetricsMiddleware(endpoint)
+    scope = {"type": "http", "method": "GET", "path": "/test", "app": main.app, "headers": []}
+    bare_rounds, instrumented_rounds = [], []
+    for _ in range(rounds):
+        bare_rounds.append([await _per_call(endpoint, scope, calls) for _ in range(20)])
+        instrumented_rounds.append([await _per_call(instrumented, scope, calls) for _ in range(20)])
+
+    def stage_loop(n):
+        start = time.perf_counter()
+        for _ in range(n):
+            with metrics.stage("benchmark"):
+                pass
+        return (time.perf_counter() - start) / n
+
+    stage_rounds = [[stage_loop(calls) for _ in range(20)] for _ in range(rounds)]
+    # Overhead = instrumented minus bare, per round, so both see the same machine conditions
+    overhead = [statistics.median(i) - statistics.median(b) for i, b in zip(instrumented_rounds, bare_rounds)]
+    return {
+        "metrics.middleware_overhead": latency_result(overhead, overhead, "us"),
+        "metrics.stage_overhead": latency_result(
+            [x for r in stage_rounds for x in r], [statistics.median(r) for r in stage_rounds], "us"
+        ),
+    }
+
+
+def bench_metrics(calls, rounds):
+    """Per-request cost of the /metrics instrumentation: the middleware and one stage() timer."""
+    return asyncio.run(_bench_metrics(calls, rounds))
+
+
+def bench_api(requests_per_route, rounds):
+    return asyncio.run(_bench_api(requests_per_route, rounds))
+
+
+def environment(model_versions):
+    def package_version(name):
+        try:
+            return importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            return None
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=script_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "packages": {name: package_version(name) for name in PACKAGES},
+        "model_versions": model_versions,
+        "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("HERHEALTH_")},
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print each benchmark against the baseline; return the names that regressed beyond `threshold`."""
+    for key in ("python", "cpu_count", "machine", "packages"):
+        if results["environment"].get(key) != baseline["environment"].get(key):
+            print(f"note: {key} differs from the baseline: "
+                  f"{baseline['environment'].get(key)} -> {results['environment'].get(key)}")
+
+    regressions = []
+    print(f"{'benchmark':<36} {'baseline':>12} {'current':>12} {'unit':>7} {'change':>8}")
+    for name, result in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            print(f"{name:<36} {'-':>12} {result['value']:>12.4g} {result['unit']:>7}      new")
+            continue
+        change = result["value"] / base["value"] - 1
+        # Positive `worse` means slower (or less throughput) than the baseline
+        worse = change if result["better"] == "lower" else -change
+        status = ""
+        if worse > threshold:
+            status = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<36} {base['value']:>12.4g} {result['value']:>12.4g} {result['unit']:>7} {change:>+8.1%}{status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HerHealth prediction and API hot paths.")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS), help="Benchmark groups to run")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results JSON")
+    parser.add_argument("--baseline", help="Results JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Allowed slowdown against the baseline before failing (0.10 = 10%%)")
+    parser.add_argument("--iterations", type=int, default=2000, help="Timed single-row predictions per model")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--requests", type=int, default=300, help="Timed requests per API route")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="Rounds of single-row, batch and API timings; the best round's median is reported")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes for import and init timings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    benchmarks = {}
+    model_versions = None
+    if "import" in args.only:
+        benchmarks.update(bench_import(args.repeat))
+    if "init" in args.only:
+        benchmarks.update(bench_init(args.repeat))
+    if "single" in args.only or "batch" in args.only:
+        model_versions = load_models()
+        if "single" in args.only:
+            benchmarks.update(bench_single(args.iterations, args.rounds))
+        if "batch" in args.only:
+            benchmarks.update(bench_batch(args.batch_sizes, 20000, args.rounds))
+    if "metrics" in args.only:
+        benchmarks.update(bench_metrics(1000, args.rounds))
+    if "api" in args.only:
+        benchmarks.update(bench_api(args.requests, args.rounds))
+
+    if model_versions is None and "api" in args.only:
+        import fetus_health
+        import risk_management
+        model_versions = {"fetal": fetus_health.model_version, "risk": risk_management.model_version}
+    results = {"environment": environment(model_versions), "benchmarks": benchmarks}
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        for name, result in benchmarks.items():
+            print(f"{name:<36} {result['value']:>12.4g} {result['unit']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import asyncio
+import csv
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+# Rows parsed and scored together; together with MAX_LINE_BYTES this bounds memory per upload
+CHUNK_ROWS = int(os.getenv("HERHEALTH_BULK_CHUNK_ROWS", 2048))
+MAX_LINE_BYTES = int(os.getenv("HERHEALTH_BULK_MAX_LINE_BYTES", 1 << 20))
+# Largest upload, and largest backlog of unread results kept on disk
+MAX_BYTES = int(os.getenv("HERHEALTH_BULK_MAX_BYTES", 256 << 20))
+
+FORMATS = ("csv", "ndjson")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def check_size(content_length):
+    # Uploads that declare their length are turned away before anything is read
+    if content_length is not None and content_length.isdigit() and int(content_length) > MAX_BYTES:
+        raise UploadTooLarge(f"Upload is {content_length} bytes, the maximum is {MAX_BYTES}")
+
+
+def detect_format(content_type, requested=None):
+    fmt = (requested or "").lower() or ("csv" if "csv" in (content_type or "").lower() else "ndjson")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported upload format '{fmt}', expected one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+async def iter_lines(byte_stream):
+    buffer = b""
+    received = 0
+    async for block in byte_stream:
+        # Chunked uploads carry no length up front, so they are counted as they arrive
+        received += len(block)
+        if received > MAX_BYTES:
+            raise UploadTooLarge(f"Upload is larger than {MAX_BYTES} bytes")
+        buffer += block
+        if b"\n" in block:
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                yield line.decode("utf-8", errors="replace").rstrip("\r")
+        if len(buffer) > MAX_LINE_BYTES:
+            raise ValueError(f"Line longer than {MAX_LINE_BYTES} bytes")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace").rstrip("\r")
+
+
+async def _data_lines(lines):
+    async for line in lines:
+        if line.strip():
+            yield line
+
+
+def _column_index(names, columns, aliases):
+    positions = {name.strip(): i for i, name in enumerate(names)}
+    index = []
+    for column in columns:
+        candidates = [column] + [alias for alias, target in aliases.items() if target == column]
+        found = [positions[c] for c in candidates if c in positions]
+        if not found:
+            raise ValueError(f"Missing column: {column}")
+        index.append(found[0])
+    return index
+
+
+def _to_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Non-finite value: {value}")
+    return number
+
+
+async def open_upload(byte_stream, fmt, columns, aliases=None):
+    """Start parsing an uploaded CSV or NDJSON body.
+
+    Returns an async iterator of (first_row, samples, errors) chunks: `samples` is
+    a (rows, len(columns)) array in `columns` order and `errors` holds a parse
+    error message or None per row (failed rows are NaN in `samples`). A CSV
+    header is read and checked before returning, so a bad header can still be
+    reported as a normal error response.
+    """
+    aliases = aliases or {}
+    lines = _data_lines(iter_lines(byte_stream))
+
+    if fmt == "csv":
+        try:
+            header = await lines.__anext__()
+        except StopAsyncIteration:
+            raise ValueError("Upload is empty")
+        index = _column_index(next(csv.reader([header])), columns, aliases)
+        width = max(index) + 1
+
+        def parse(line):
+            fields = next(csv.reader([line]))
+            if len(fields) < width:
+                raise ValueError(f"Expected at least {width} fields, got {len(fields)}")
+            return [_to_float(fields[i]) for i in index]
+    else:
+        keys = {column: [column] + [alias for alias, target in aliases.items() if target == column] for column in columns}
+
+        def parse(line):
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Expected a JSON object")
+            values = []
+            for column in columns:
+                key = next((k for k in keys[column] if k in record), None)
+                if key is None:
+                    raise ValueError(f"Missing field: {column}")
+                values.append(_to_float(record[key]))
+            return values
+
+    return _row_chunks(lines, parse, len(columns))
+
+
+async def _row_chunks(lines, parse, width):
+    first_row = 0
+    samples = np.empty((CHUNK_ROWS, width))
+    errors = []
+    async for line in lines:
+        try:
+            samples[len(errors)] = parse(line)
+            errors.append(None)
+        except (ValueError, TypeError) as e:
+            samples[len(errors)] = np.nan
+            errors.append(f"Row could not be parsed: {e}")
+        if len(errors) == CHUNK_ROWS:
+            yield first_row, samples.copy(), errors
+            first_row += len(errors)
+            errors = []
+    if errors:
+        yield first_row, samples[:len(errors)].copy(), errors
+
+
+async def spooled(results, read_size=1 << 20):
+    """Relay `results` (an async iterator of str) through a temporary file.
+
+    The upload is consumed and scored by a separate task, so a client that only
+    starts reading once it has sent the whole body cannot stall the upload
+    behind a full response buffer. Memory stays flat; the backlog goes to disk,
+    up to MAX_BYTES unread bytes. Past that, scoring stops and the stream ends
+    with UploadTooLarge once the spooled results have been sent.
+    """
+    spool = tempfile.TemporaryFile()
+    written = 0
+    position = 0
+    finished = False
+    ready = asyncio.Event()
+
+    async def produce():
+        nonlocal written, finished
+        try:
+            async for text in results:
+                data = text.encode("utf-8")
+                if written + len(data) - position > MAX_BYTES:
+                    raise UploadTooLarge(f"More than {MAX_BYTES} bytes of results are waiting to be read")
+                spool.seek(written)
+                spool.write(data)
+                written += len(data)
+                ready.set()
+        finally:
+            finished = True
+            ready.set()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            if position < written:
+                spool.seek(position)
+                data = spool.read(min(read_size, written - position))
+                position += len(data)
+                yield data
+            elif finished:
+                break
+            else:
+                ready.clear()
+                await ready.wait()
+        await producer
+    finally:
+        producer.cancel()
+        spool.close()
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    # StreamingResponse watches for disconnects by reading `receive`, which would swallow
+    # request body messages that are still being uploaded. The body iterator here reads
+    # the request itself (and sees the disconnect), so only stream the response.
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
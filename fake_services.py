@@ -0,0 +1,308 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# Stand-ins for the Twilio REST API and an Ollama server, for load tests with no network.
+# Point the backend at them with TWILIO_API_BASE_URL and OLLAMA_HOST.
+FAKE_LATENCY_MS = float(os.getenv("HERHEALTH_FAKE_LATENCY_MS", 50))
+FAKE_JITTER_MS = float(os.getenv("HERHEALTH_FAKE_JITTER_MS", 10))
+FAKE_ERROR_RATE = float(os.getenv("HERHEALTH_FAKE_ERROR_RATE", 0.0))
+# Statuses a message reports on successive fetches; the last one sticks
+TWILIO_STATUSES = os.getenv("HERHEALTH_FAKE_TWILIO_STATUSES", "queued,sent,delivered").split(",")
+# Share of messages that follow TWILIO_FAILED_STATUSES instead
+TWILIO_UNDELIVERED_RATE = float(os.getenv("HERHEALTH_FAKE_TWILIO_UNDELIVERED_RATE", 0.0))
+TWILIO_FAILED_STATUSES = ["queued", "sent", "undelivered"]
+# Delay between streamed tokens
+OLLAMA_TOKEN_MS = float(os.getenv("HERHEALTH_FAKE_OLLAMA_TOKEN_MS", 20))
+# Time to load the model when it isn't loaded; it stays loaded for the call's keep_alive (default 5 minutes)
+OLLAMA_LOAD_MS = float(os.getenv("HERHEALTH_FAKE_OLLAMA_LOAD_MS", 0))
+
+OLLAMA_ANSWER = (
+    "During pregnancy, eat a balanced diet with plenty of fruit, vegetables, whole grains and protein, "
+    "take folic acid and iron as advised, stay hydrated, rest well, and keep every antenatal appointment. "
+    "Contact your doctor straight away if you notice bleeding, severe headaches or reduced fetal movement."
+)
+
+
+class Behaviour:
+    """Latency and failure injection for one fake service."""
+
+    def __init__(self, latency_ms=FAKE_LATENCY_MS, jitter_ms=FAKE_JITTER_MS, error_rate=FAKE_ERROR_RATE, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+
+    async def delay(self):
+        latency = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        await asyncio.sleep(latency / 1000)
+
+    def should_fail(self):
+        self.requests += 1
+        failed = self.rng.random() < self.error_rate
+        self.failures += failed
+        return failed
+
+    def stats(self):
+        return {"requests": self.requests, "failures": self.failures}
+
+
+def _rfc2822_now():
+    return format_datetime(datetime.now(timezone.utc), usegmt=True)
+
+
+def _auth_token(request):
+    # Twilio clients authenticate with HTTP basic auth: account SID and auth token
+    import base64
+
+    credentials = request.headers.get("authorization", "").partition(" ")[2]
+    return base64.b64decode(credentials).decode().partition(":")[2] if credentials else ""
+
+
+def twilio_app(behaviour=None, statuses=TWILIO_STATUSES, undelivered_rate=TWILIO_UNDELIVERED_RATE):
+    """The parts of the Twilio Messages API the backend uses: send a message and fetch its status.
+
+    A message created with a StatusCallback URL also posts its later statuses
+    there, one every behaviour delay.
+    """
+    behaviour = behaviour or Behaviour()
+    app = FastAPI()
+    app.state.behaviour = behaviour
+    app.state.messages = {}
+
+    def message_json(account_sid, message):
+        sequence = message["statuses"]
+        return {
+            "sid": message["sid"],
+            "account_sid": account_sid,
+            "to": message["to"],
+            "from": message["from"],
+            "body": message["body"],
+            "status": sequence[min(message["fetches"], len(sequence) - 1)],
+            "num_segments": "1",
+            "direction": "outbound-api",
+            "date_created": message["date_created"],
+            "date_updated": _rfc2822_now(),
+            "uri": f"/2010-04-01/Accounts/{account_sid}/Messages/{message['sid']}.json",
+        }
+
+    callbacks = set()
+
+    async def send_callbacks(url, auth_token, message):
+        # Every later status is posted as Twilio would, signed with the account's auth token
+        import httpx
+        from twilio.request_validator import RequestValidator
+
+        validator = RequestValidator(auth_token)
+        async with httpx.AsyncClient(timeout=10) as client:
+            for status in message["statuses"][1:]:
+                await behaviour.delay()
+                params = {"MessageSid": message["sid"], "MessageStatus": status, "To": message["to"] or ""}
+                if status == "undelivered":
+                    params["ErrorCode"] = "30003"
+                headers = {"X-Twilio-Signature": validator.compute_signature(url, params)}
+                try:
+                    await client.post(url, data=params, headers=headers)
+                except httpx.HTTPError as e:
+                    logger.warning(f"Status callback to {url} failed: {e}")
+
+    def error_response():
+        return JSONResponse(
+            {"code": 20500, "message": "Injected failure from the fake Twilio API", "more_info": "", "status": 500},
+            status_code=500,
+        )
+
+    @app.post("/2010-04-01/Accounts/{account_sid}/Messages.json")
+    async def create_message(account_sid: str, request: Request):
+        # Twilio clients post form-encoded fields
+        form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+        await behaviour.delay()
+        if behaviour.should_fail():
+            return error_response()
+        undelivered = behaviour.rng.random() < undelivered_rate
+        message = {
+            "sid": "SM" + uuid.uuid4().hex,
+            "to": form.get("To"),
+            "from": form.get("From"),
+            "body": form.get("Body"),
+            "statuses": TWILIO_FAILED_STATUSES if undelivered else list(statuses),
+            "fetches": 0,
+            "date_created": _rfc2822_now(),
+        }
+        app.state.messages[message["sid"]] = message
+        if form.get("StatusCallback"):
+            task = asyncio.create_task(send_callbacks(form["StatusCallback"], _auth_token(request), message))
+            callbacks.add(task)
+            task.add_done_callback(callbacks.discard)
+        return JSONResponse(message_json(account_sid, message), status_code=201)
+
+    @app.get("/2010-04-01/Accounts/{account_sid}/Messages/{sid}.json")
+    async def fetch_message(account_sid: str, sid: str):
+        await behaviour.delay()
+        if behaviour.should_fail():
+            return error_response()
+        message = app.state.messages.get(sid)
+        if message is None:
+            return JSONResponse({"code": 20404, "message": "Not found", "more_info": "", "status": 404}, status_code=404)
+        message["fetches"] += 1
+        return message_json(account_sid, message)
+
+    return app
+
+
+def _keep_alive_seconds(value):
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    match = re.fullmatch(r"(-?[\d.]+)(ms|s|m|h)?", value)
+    seconds = float(match.group(1)) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[match.group(2) or "s"]
+    return float("inf") if seconds < 0 else seconds
+
+
+def ollama_app(behaviour=None, token_ms=OLLAMA_TOKEN_MS, answer=OLLAMA_ANSWER, load_ms=OLLAMA_LOAD_MS):
+    """Ollama's /api/chat and /api/generate, streaming or not; the answer is always `answer`.
+
+    A call that finds the model unloaded first waits `load_ms` and reports it
+    as `load_duration`; the model then stays loaded for the call's keep_alive.
+    The behaviour's latency is the time to the first token, then each word
+    follows after `token_ms`. `num_predict` cuts the answer short.
+    """
+    behaviour = behaviour or Behaviour()
+    app = FastAPI()
+    app.state.behaviour = behaviour
+    app.state.loaded_until = 0.0
+    tokens = [word + " " for word in answer.split(" ")]
+    tokens[-1] = tokens[-1].rstrip()
+
+    def chunk(model, content, field, done, load=0.0, count=0):
+        body = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+        body.update({"message": {"role": "assistant", "content": content}} if field == "message" else {"response": content})
+        if done:
+            body.update(done_reason="stop", eval_count=count, load_duration=int(load * 1e9))
+        return body
+
+    async def respond(request, field):
+        body = await request.json()
+        model = body.get("model", "mistral")
+        started = time.perf_counter()
+        load = 0.0
+        if time.monotonic() >= app.state.loaded_until:
+            load = load_ms / 1000
+            await asyncio.sleep(load)
+        app.state.loaded_until = time.monotonic() + _keep_alive_seconds(body.get("keep_alive"))
+        await behaviour.delay()
+        if behaviour.should_fail():
+            return JSONResponse({"error": "Injected failure from the fake Ollama server"}, status_code=500)
+        answer_tokens = tokens[:(body.get("options") or {}).get("num_predict") or len(tokens)]
+
+        if not body.get("stream", True):
+            await asyncio.sleep(token_ms * (len(answer_tokens) - 1) / 1000)
+            reply = chunk(model, "".join(answer_tokens), field, True, load, len(answer_tokens))
+            reply["total_duration"] = int((time.perf_counter() - started) * 1e9)
+            return reply
+
+        async def stream():
+            for i, token in enumerate(answer_tokens):
+                if i:
+                    await asyncio.sleep(token_ms / 1000)
+                yield json.dumps(chunk(model, token, field, False)) + "\n"
+            yield json.dumps(chunk(model, "", field, True, load, len(answer_tokens))) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        return await respond(request, "message")
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await respond(request, "response")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "mistral:latest", "model": "mistral:latest"}]}
+
+    return app
+
+
+class FakeServer:
+    """Run an ASGI app with uvicorn on a background thread of this process."""
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        import uvicorn
+
+        self.app = app
+        self.host = host
+        if port == 0:
+            with socket.socket() as sock:
+                sock.bind((host, 0))
+                port = sock.getsockname()[1]
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False))
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self, timeout=10):
+        self._thread = threading.Thread(target=self.server.run, name=f"fake-server-{self.port}", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"Fake server on port {self.port} failed to start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def start_fakes(twilio_behaviour=None, ollama_behaviour=None, statuses=TWILIO_STATUSES,
+                undelivered_rate=TWILIO_UNDELIVERED_RATE, token_ms=OLLAMA_TOKEN_MS, load_ms=OLLAMA_LOAD_MS):
+    """Start fake Twilio and Ollama servers; returns them plus the env vars that point the backend at them."""
+    twilio = FakeServer(twilio_app(twilio_behaviour, statuses, undelivered_rate))
+    ollama = FakeServer(ollama_app(ollama_behaviour, token_ms, load_ms=load_ms))
+    twilio.start()
+    ollama.start()
+    env = {
+        "TWILIO_ACCOUNT_SID": "AC" + "0" * 32,
+        "TWILIO_AUTH_TOKEN": "fake-token",
+        "TWILIO_PHONE_NUMBER": "+15005550006",
+        "TWILIO_API_BASE_URL": twilio.url,
+        "OLLAMA_HOST": ollama.url,
+    }
+    return twilio, ollama, env
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    twilio, ollama, env = start_fakes()
+    print("Fake services running; start the backend with:")
+    print(" ".join(f"{key}={value}" for key, value in env.items()) + " python main.py")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        twilio.stop()
+        ollama.stop()
@@ -1,32 +1,47 @@
 import numpy as np
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
+import logging
 import os
+from collections import namedtuple
+
+import forest_engine
+import metrics
+import model_store
+
+logger = logging.getLogger(__name__)
 
 # Get the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # Construct the path to the CSV file relative to the script's directory
 csv_path = os.path.join(script_dir, "data", "fetal_health.csv")
 
-# Global variables
+MODEL_NAME = "fetal"
+
+# Everything needed to serve one model version. Replaced as a whole on reload, so a
+# prediction that picked up a bundle finishes on it even if a new one is swapped in.
+FetalModel = namedtuple("FetalModel", ["version", "scaler", "forest", "compiled"])
+
+# Global variables (model, scaler, compiled_model and model_version mirror active_model)
+active_model = None
 model = None
 scaler = None
+compiled_model = None
+model_version = None
 important_features = [
     'baseline value', 'accelerations', 'uterine_contractions',
     'prolongued_decelerations', 'mean_value_of_short_term_variability',
     'histogram_mean', 'histogram_variance'
 ]
 
-def initialize_fetal_model():
-    global model, scaler
-    try:
-        fetal_health_df = pd.read_csv(csv_path)
-        fetal_health_df.drop_duplicates(inplace=True)
-    except FileNotFoundError:
-        print("Error: Fetal health dataset not found.")
-        return False
+def train_fetal_model():
+    # Training-only dependencies are imported here so serving never pays for them
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.metrics import accuracy_score
+
+    fetal_health_df = pd.read_csv(csv_path)
+    fetal_health_df.drop_duplicates(inplace=True)
     
     features = fetal_health_df[important_features]
     target = fetal_health_df['fetal_health']
@@ -38,20 +53,118 @@ def initialize_fetal_model():
     
     model = RandomForestClassifier(n_estimators=100, random_state=42)
     model.fit(X_train_scaled, y_train)
+
+    metrics = {
+        "test_accuracy": float(accuracy_score(y_test, model.predict(scaler.transform(X_test)))),
+        "n_train": len(X_train),
+        "n_test": len(X_test),
+    }
+    return {"scaler": scaler, "forest": model}, metrics
+
+def _build_model(version, artifacts):
+    compiled, forest = forest_engine.load_for_serving(MODEL_NAME, version, artifacts)
+    return FetalModel(version, forest_engine.for_arrays(artifacts["scaler"]), forest, compiled)
+
+def load_fetal_model(version=None):
+    """Load a stored version (LATEST by default) without activating it."""
+    # In shared mode the sklearn forest is only loaded if no compiled copy has been published
+    skip = ("forest",) if forest_engine.SHARED_MODELS else ()
+    artifacts, manifest = model_store.load_artifacts(MODEL_NAME, version, skip)
+    return _build_model(manifest["version"], artifacts)
+
+def activate_fetal_model(bundle):
+    global active_model, model, scaler, compiled_model, model_version
+    active_model = bundle
+    model, scaler, compiled_model, model_version = bundle.forest, bundle.scaler, bundle.compiled, bundle.version
+
+def warm_up_fetal_model(bundle):
+    # Touch both engines (and any memory-mapped pages) before the bundle takes traffic
+    samples = np.tile([130, 0.003, 0.004, 0.0, 1.3, 137, 18], (forest_engine.COMPILED_MAX_ROWS + 1, 1))
+    predict_fetal_health_batch(samples[:1], bundle)
+    predict_fetal_health_batch(samples, bundle)
+
+def initialize_fetal_model(force_retrain=False):
+    try:
+        data_hash = model_store.dataset_hash(csv_path)
+    except FileNotFoundError:
+        print("Error: Fetal health dataset not found.")
+        return False
+
+    skip = ("forest",) if forest_engine.SHARED_MODELS else ()
+    loaded = None if force_retrain else model_store.load_if_current(MODEL_NAME, data_hash, skip)
+    if loaded is not None:
+        artifacts, manifest = loaded
+        version = manifest["version"]
+        logger.info(f"Loaded fetal model version {version}")
+    else:
+        artifacts, metrics = train_fetal_model()
+        version = model_store.save_artifacts(MODEL_NAME, artifacts, {
+            "dataset_hash": data_hash,
+            "features": important_features,
+            "classes": [int(c) for c in artifacts["forest"].classes_],
+            "metrics": metrics,
+        })
+    activate_fetal_model(_build_model(version, artifacts))
     return True
 
-def predict_fetal_health(features):
-    global model, scaler
-    if model is None or scaler is None:
+def prepare_fetal_model():
+    # Run at startup in a child process: makes sure a current version is stored (training one if
+    # needed) and returns it for the server to load
+    version = model_store.current_version(MODEL_NAME, model_store.dataset_hash(csv_path))
+    if version is None:
+        initialize_fetal_model(force_retrain=True)
+        version = model_version
+    return version
+
+def update_fetal_model(cases_path, mode="grow", n_trees=None, random_state=None):
+    """Fold newly labeled cases (a CSV with the training columns) into the latest version, saved as a new one."""
+    import pandas as pd
+    import incremental
+
+    artifacts, manifest = model_store.load_artifacts(MODEL_NAME)
+    forest, report = incremental.update_model(
+        artifacts["forest"], artifacts["scaler"], pd.read_csv(cases_path),
+        model_store.case_store_path(MODEL_NAME), csv_path, important_features, "fetal_health",
+        lambda labels: labels.to_numpy(dtype=np.float64), n_trees=n_trees or incremental.UPDATE_TREES, mode=mode, random_state=random_state,
+    )
+    version = model_store.save_artifacts(MODEL_NAME, {**artifacts, "forest": forest}, {
+        # Still built from the bundled dataset, so startup keeps it instead of retraining
+        "dataset_hash": manifest["dataset_hash"],
+        "features": important_features,
+        "classes": manifest["classes"],
+        "metrics": manifest.get("metrics", {}),
+        "parent_version": manifest["version"],
+        # Passed back as --random-state, reproduces this update
+        "random_state": report["random_state"],
+        "update": report,
+    })
+    return version, report
+
+health_status = {1: "Normal", 2: "Suspect", 3: "Pathological"}
+
+def predict_fetal_health(features, bundle=None):
+    bundle = bundle or active_model
+    if bundle is None:
         raise ValueError("Fetal model not initialized. Call initialize_fetal_model() first.")
     input_data = np.array(features).reshape(1, -1)
-    input_scaled = scaler.transform(input_data)
-    prediction = model.predict(input_scaled)[0]
-    health_status = {1: "Normal", 2: "Suspect", 3: "Pathological"}
+    prediction = forest_engine.predict(input_data, bundle.compiled, bundle.forest, bundle.scaler)[0]
     return health_status.get(prediction, "Unknown")
 
+def predict_fetal_health_batch(samples, bundle=None):
+    # samples: (n, 7) array in important_features order; one model call for the whole batch
+    bundle = bundle or active_model
+    if bundle is None:
+        raise ValueError("Fetal model not initialized. Call initialize_fetal_model() first.")
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, len(important_features))
+    if len(samples) == 0:
+        return []
+    predictions = forest_engine.predict(samples, bundle.compiled, bundle.forest, bundle.scaler)
+    with metrics.stage("label_decoding"):
+        return [health_status.get(prediction, "Unknown") for prediction in predictions]
+
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
+    import pandas as pd
     import seaborn as sns
     from sklearn.model_selection import StratifiedKFold
     from sklearn.metrics import roc_curve, auc    
@@ -0,0 +1,305 @@
+import copy
+import os
+import warnings
+
+import numpy as np
+
+import metrics
+import model_store
+
+# "auto" scores small batches with the compiled forest and large ones with sklearn,
+# "compiled" and "sklearn" force one engine. Both give identical predictions.
+ENGINE = os.getenv("HERHEALTH_INFERENCE_ENGINE", "auto")
+# Above this many rows sklearn's C traversal overtakes the NumPy one
+COMPILED_MAX_ROWS = int(os.getenv("HERHEALTH_COMPILED_MAX_ROWS", 256))
+
+# Map compiled forests read-only from the model store instead of loading the sklearn
+# forests, so all workers on a host share one copy of the tree arrays
+SHARED_MODELS = os.getenv("HERHEALTH_SHARED_MODELS", "").lower() in ("1", "true", "yes")
+COMPILED_GROUP = "compiled"
+ARRAY_FIELDS = ("feature", "threshold", "children", "value", "roots", "is_leaf", "classes")
+
+# (tree, row) pairs traversed together; keeps the working arrays cache-sized
+CHUNK_ELEMENTS = 1 << 16
+# Below this many pairs, pruning finished traversals costs more than it saves
+SMALL_BATCH_ELEMENTS = 4096
+
+_SIGN_BIT = np.int64(-2 ** 63)
+
+
+def _to_ordered(x):
+    # Map float64 values onto int64 so that integer order matches float order
+    bits = x.view(np.int64)
+    return np.where(bits < 0, -(bits & np.int64(2 ** 63 - 1)), bits)
+
+
+def _from_ordered(o):
+    bits = np.where(o < 0, (-o) | _SIGN_BIT, o)
+    return bits.view(np.float64)
+
+
+def _fold_thresholds(scaler, feature, thresholds, n_features):
+    """Return raw-space thresholds r with `x <= r` iff float32(scaler(x)) <= threshold.
+
+    Trees compare the float32-cast scaled value against a float64 threshold. Both
+    the scaler and the cast are monotonic, so the set of raw values going left is
+    a half-line; its end point is found by bisecting over float64 bit patterns,
+    calling the scaler itself so the result is exact rather than approximate.
+    """
+    def transform_column(f, column, method="transform"):
+        X = np.zeros((len(column), n_features))
+        X[:, f] = column
+        return getattr(scaler, method)(X)[:, f]
+
+    def goes_left(f, candidates, t):
+        return transform_column(f, candidates).astype(np.float32).astype(np.float64) <= t
+
+    raw = np.empty_like(thresholds)
+    for f in np.unique(feature):
+        mask = feature == f
+        t = thresholds[mask]
+        guess = transform_column(f, t, "inverse_transform")
+
+        # Bracket the boundary: lo always goes left, hi never does
+        step = np.abs(guess) * 1e-6 + 1e-9
+        lo, hi = guess - step, guess + step
+        for _ in range(64):
+            bad_lo = ~goes_left(f, lo, t)
+            bad_hi = goes_left(f, hi, t)
+            if not (bad_lo.any() or bad_hi.any()):
+                break
+            step = step * 4
+            lo = np.where(bad_lo, guess - step, lo)
+            hi = np.where(bad_hi, guess + step, hi)
+        # Splits no finite value can reach (or escape) become -inf (or +inf)
+        folded = np.where(goes_left(f, lo, t), np.where(goes_left(f, hi, t), np.inf, np.nan), -np.inf)
+
+        pending = np.isnan(folded)
+        lo_o, hi_o, t = _to_ordered(lo[pending]), _to_ordered(hi[pending]), t[pending]
+        while (hi_o - lo_o > 1).any():
+            mid_o = lo_o // 2 + hi_o // 2 + (lo_o % 2 + hi_o % 2) // 2
+            left = goes_left(f, _from_ordered(mid_o), t)
+            lo_o = np.where(left, mid_o, lo_o)
+            hi_o = np.where(left, hi_o, mid_o)
+        folded[pending] = _from_ordered(lo_o)
+        raw[mask] = folded
+    return raw
+
+
+class CompiledForest:
+    """A fitted RandomForestClassifier flattened into contiguous node arrays.
+
+    Every tree is laid out back to back: `feature`/`threshold` describe each
+    node's split and `children[2 * node + go_right]` is the next node. Leaves
+    point back at themselves, so all (tree, row) pairs can be stepped together
+    for `max_depth` steps. The input scaler is folded into `threshold`, so raw
+    feature values are scored directly.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, classes, n_features, is_leaf=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.n_features = int(n_features)
+        if is_leaf is None:
+            is_leaf = children[0::2] == np.arange(len(feature), dtype=children.dtype)
+        self.is_leaf = is_leaf
+
+    def to_arrays(self):
+        arrays = {field: getattr(self, "classes_" if field == "classes" else field) for field in ARRAY_FIELDS}
+        return arrays, {"max_depth": self.max_depth, "n_features": self.n_features}
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        return cls(max_depth=meta["max_depth"], n_features=meta["n_features"], **arrays)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _leaves(self, X):
+        # With X flattened row-major, a node's input for a row is X[row * n_features + feature]
+        m = X.shape[0]
+        X = X.ravel()
+        rows = np.tile(np.arange(0, m * self.n_features, self.n_features, dtype=np.int32), self.n_trees)
+        nodes = np.repeat(self.roots, m)
+        # Small batches just run to max_depth; larger ones drop finished pairs as they go
+        if len(nodes) <= SMALL_BATCH_ELEMENTS:
+            for _ in range(self.max_depth):
+                go_right = X.take(self.feature.take(nodes) + rows) > self.threshold.take(nodes)
+                nodes = self.children.take(nodes * 2 + go_right)
+            return nodes.reshape(self.n_trees, m)
+
+        leaves = np.empty_like(nodes)
+        positions = np.arange(len(nodes), dtype=np.int32)
+        for depth in range(self.max_depth):
+            go_right = X.take(self.feature.take(nodes) + rows) > self.threshold.take(nodes)
+            nodes = self.children.take(nodes * 2 + go_right)
+            if depth % 2 == 1:
+                done = self.is_leaf.take(nodes)
+                if done.any():
+                    leaves[positions[done]] = nodes[done]
+                    active = ~done
+                    nodes, positions, rows = nodes[active], positions[active], rows[active]
+                    if not len(nodes):
+                        break
+        leaves[positions] = nodes
+        return leaves.reshape(self.n_trees, m)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but the model expects {self.n_features}")
+        if not np.isfinite(X).all():
+            raise ValueError("Input contains NaN or infinity.")
+
+        X = np.ascontiguousarray(X)
+        proba = np.empty((X.shape[0], self.value.shape[1]))
+        chunk = max(1, CHUNK_ELEMENTS // self.n_trees)
+        for start in range(0, X.shape[0], chunk):
+            leaves = self._leaves(X[start:start + chunk])
+            # Summing over the tree axis accumulates tree by tree, in the same
+            # order as sklearn, so the averaged probabilities match exactly
+            proba[start:start + chunk] = self.value.take(leaves, axis=0).sum(axis=0)
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def _sklearn_normalizes_leaf_values():
+    # Before scikit-learn 1.4 tree_.value held class counts that predict_proba normalized
+    import sklearn
+    major, minor = (int(part) for part in sklearn.__version__.split(".")[:2])
+    return (major, minor) < (1, 4)
+
+
+def compile_forest(forest, scaler=None):
+    """Flatten a fitted RandomForestClassifier, optionally folding its input scaler into the thresholds."""
+    if forest.n_outputs_ != 1:
+        raise ValueError("Only single-output forests can be compiled")
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        is_leaf = tree.children_left == -1
+        node_ids = np.arange(n_nodes)
+
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        left = np.where(is_leaf, node_ids, tree.children_left) + offset
+        right = np.where(is_leaf, node_ids, tree.children_right) + offset
+        children.append(np.stack([left, right], axis=1).ravel())
+
+        value = tree.value[:, 0, :forest.n_classes_].astype(np.float64)
+        if _sklearn_normalizes_leaf_values():
+            normalizer = value.sum(axis=1)[:, None]
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+        values.append(value)
+
+        roots.append(offset)
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+
+    feature = np.concatenate(features).astype(np.int32)
+    threshold = np.concatenate(thresholds).astype(np.float64)
+    split = np.isfinite(threshold)
+    with warnings.catch_warnings():
+        # Scalers fitted on DataFrames warn about the bare arrays used while folding
+        warnings.simplefilter("ignore", UserWarning)
+        threshold[split] = _fold_thresholds(
+            scaler if scaler is not None else _IdentityScaler(),
+            feature[split], threshold[split], forest.n_features_in_,
+        )
+
+    return CompiledForest(
+        feature=feature,
+        threshold=threshold,
+        children=np.concatenate(children).astype(np.int32),
+        value=np.concatenate(values),
+        roots=np.asarray(roots, dtype=np.int32),
+        max_depth=max_depth,
+        classes=np.asarray(forest.classes_),
+        n_features=forest.n_features_in_,
+    )
+
+
+def publish(name, version, compiled):
+    """Store `compiled` next to model version `version` so other workers can map it."""
+    model_store.save_arrays(name, version, COMPILED_GROUP, *compiled.to_arrays())
+
+
+def load_shared(name, version, mmap=True):
+    """Load (by default memory-map) the compiled forest published for `version`, or None if there is none yet."""
+    loaded = model_store.load_arrays(name, version, COMPILED_GROUP, mmap_mode="r" if mmap else None)
+    return None if loaded is None else CompiledForest.from_arrays(*loaded)
+
+
+def load_for_serving(name, version, artifacts):
+    """Return (compiled, forest) for a stored model version; forest is None in shared mode.
+
+    `artifacts` may lack the forest (shared mode skips it); it is only loaded
+    when no compiled copy has been published for the version yet. A published
+    copy is reused either way, so only the first process to load a version
+    pays for compiling it.
+    """
+    compiled = load_shared(name, version, mmap=SHARED_MODELS)
+    forest = artifacts.get("forest")
+    if compiled is None:
+        if forest is None:
+            forest = model_store.load_artifacts(name, version)[0]["forest"]
+        compiled = compile_forest(forest, artifacts["scaler"])
+        publish(name, version, compiled)
+    return compiled, None if SHARED_MODELS else for_arrays(forest)
+
+
+def predict(X, compiled=None, forest=None, scaler=None):
+    """Predict class labels for raw (unscaled) rows with whichever engine suits the batch."""
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    if compiled is not None and (
+        forest is None or ENGINE == "compiled" or (ENGINE == "auto" and X.shape[0] <= COMPILED_MAX_ROWS)
+    ):
+        # The scaler is folded into the compiled thresholds, so there is no separate scaling stage
+        with metrics.stage("forest_inference"):
+            return compiled.predict(X)
+    if forest is None:
+        raise ValueError("No model available for prediction")
+    if scaler is not None:
+        with metrics.stage("scaling"):
+            X = scaler.transform(X)
+    with metrics.stage("forest_inference"):
+        return forest.predict(X)
+
+
+def for_arrays(estimator):
+    """Return `estimator` ready to take plain arrays in its training column order.
+
+    Estimators fitted on a DataFrame warn on every bare array, and catch_warnings
+    isn't thread-safe, so serving uses a shallow copy without the column names.
+    """
+    if getattr(estimator, "feature_names_in_", None) is None:
+        return estimator
+    estimator = copy.copy(estimator)
+    del estimator.feature_names_in_
+    return estimator
+
+
+class _IdentityScaler:
+    # Without a scaler the float32 cast is still folded into the thresholds
+    def transform(self, X):
+        return X
+
+    def inverse_transform(self, X):
+        return X
@@ -0,0 +1,149 @@
+import collections
+import copy
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+UPDATE_MODES = ("grow", "replace")
+# Trees trained per update
+UPDATE_TREES = int(os.getenv("HERHEALTH_UPDATE_TREES", 50))
+# New trees are fitted on at most this many of the most recent labeled cases...
+UPDATE_WINDOW = int(os.getenv("HERHEALTH_UPDATE_WINDOW", 5000))
+# ...plus a sample of the original training data this large relative to them, so they keep every class
+REPLAY_RATIO = float(os.getenv("HERHEALTH_UPDATE_REPLAY_RATIO", 1.0))
+HOLDOUT_FRACTION = 0.2
+CSV_CHUNK_ROWS = 100000
+
+
+def append_cases(store_path, cases):
+    """Append labeled rows (a DataFrame) to a model's case store, creating it with a header."""
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    cases.to_csv(store_path, mode="a", header=not os.path.exists(store_path), index=False)
+
+
+def recent_cases(store_path, n_rows, columns):
+    # Keeps only the last n_rows in memory however long the store has grown
+    import pandas as pd
+
+    if n_rows <= 0 or not os.path.exists(store_path):
+        return pd.DataFrame(columns=columns)
+    tail = collections.deque()
+    kept = 0
+    for chunk in pd.read_csv(store_path, usecols=columns, chunksize=CSV_CHUNK_ROWS):
+        tail.append(chunk)
+        kept += len(chunk)
+        while kept - len(tail[0]) >= n_rows:
+            kept -= len(tail.popleft())
+    if not tail:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(tail, ignore_index=True).tail(n_rows)
+
+
+def sample_csv(csv_path, n_rows, columns, random_state=42):
+    # Uniform sample of n_rows from a CSV of any size, read in chunks
+    import pandas as pd
+
+    if n_rows <= 0:
+        return pd.DataFrame(columns=columns)
+    rng = np.random.default_rng(random_state)
+    sample = None
+    for chunk in pd.read_csv(csv_path, usecols=columns, chunksize=CSV_CHUNK_ROWS):
+        # Random keys per row; keeping the n smallest over all chunks is a uniform sample
+        chunk = chunk.assign(_key=rng.random(len(chunk)))
+        sample = chunk if sample is None else pd.concat([sample, chunk])
+        sample = sample.nsmallest(n_rows, "_key")
+    return sample.drop(columns="_key").reset_index(drop=True)
+
+
+def split_holdout(n_rows, y, fraction=HOLDOUT_FRACTION, random_state=42):
+    from sklearn.model_selection import train_test_split
+
+    indices = np.arange(n_rows)
+    if n_rows * fraction < 1:
+        return indices, indices[:0]
+    _, counts = np.unique(y, return_counts=True)
+    # Stratify when every class can appear on both sides of the split
+    stratify = y if counts.min() >= 2 and n_rows * fraction >= len(counts) else None
+    return train_test_split(indices, test_size=fraction, stratify=stratify, random_state=random_state)
+
+
+def update_forest(forest, X, y, n_trees, mode="grow", random_state=None):
+    """Return a copy of `forest` with `n_trees` new trees fitted on (X, y).
+
+    "grow" appends them; "replace" drops the same number of the oldest trees,
+    keeping the forest size constant. The new trees use the forest's own
+    hyperparameters. `forest` itself is left untouched, so it can keep serving.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    if mode not in UPDATE_MODES:
+        raise ValueError(f"Unknown update mode '{mode}', expected one of: {', '.join(UPDATE_MODES)}")
+    params = {**forest.get_params(), "n_estimators": n_trees, "warm_start": False, "random_state": random_state}
+    new_trees = RandomForestClassifier(**params).fit(X, y)
+    if not np.array_equal(new_trees.classes_, forest.classes_):
+        raise ValueError(
+            f"Update data covers classes {list(new_trees.classes_)}, but the model predicts {list(forest.classes_)}"
+        )
+
+    updated = copy.copy(forest)
+    kept = forest.estimators_[n_trees:] if mode == "replace" else forest.estimators_
+    updated.estimators_ = list(kept) + list(new_trees.estimators_)
+    updated.n_estimators = len(updated.estimators_)
+    return updated
+
+
+def update_model(forest, scaler, new_cases, store_path, base_csv, columns, target, encode,
+                 n_trees=UPDATE_TREES, mode="grow", window=UPDATE_WINDOW, replay_ratio=REPLAY_RATIO,
+                 random_state=None):
+    """Fold newly labeled cases (a DataFrame of `columns` + `target`) into a fitted forest.
+
+    A held-out share of the new cases is kept aside for evaluation; the rest
+    are appended to the case store together with it, and new trees are fitted
+    on the most recent `window` cases plus a replay sample of `base_csv`.
+    `encode` maps raw target values to the forest's labels. `random_state`
+    seeds the holdout split, the replay sample and the new trees; without one a
+    seed is drawn. Returns (updated_forest, report) with the held-out accuracy
+    before and after and the seed used, so the update can be reproduced.
+    """
+    import pandas as pd
+
+    started = time.perf_counter()
+    if random_state is None:
+        random_state = int(np.random.default_rng().integers(2 ** 31))
+    new_cases = new_cases[columns + [target]].dropna()
+    if new_cases.empty:
+        raise ValueError("No complete labeled rows to update with")
+    y_new = encode(new_cases[target])
+    train_idx, holdout_idx = split_holdout(len(new_cases), y_new, random_state=random_state)
+
+    recent = recent_cases(store_path, max(0, window - len(train_idx)), columns + [target])
+    recent = pd.concat([recent, new_cases.iloc[train_idx]], ignore_index=True)
+    replay = sample_csv(base_csv, int(len(recent) * replay_ratio), columns + [target], random_state=random_state)
+    training = pd.concat([recent, replay], ignore_index=True)
+    X_train = scaler.transform(training[columns].astype(np.float64))
+    updated = update_forest(forest, X_train, encode(training[target]), n_trees, mode, random_state)
+
+    report = {
+        "mode": mode,
+        "new_cases": len(new_cases),
+        "holdout_cases": len(holdout_idx),
+        "training_rows": len(training),
+        "replay_rows": len(replay),
+        "trees_added": n_trees,
+        "n_estimators": updated.n_estimators,
+        "random_state": random_state,
+    }
+    if len(holdout_idx):
+        X_holdout = scaler.transform(new_cases.iloc[holdout_idx][columns].astype(np.float64))
+        y_holdout = y_new[holdout_idx]
+        report["holdout_accuracy_before"] = float(np.mean(forest.predict(X_holdout) == y_holdout))
+        report["holdout_accuracy_after"] = float(np.mean(updated.predict(X_holdout) == y_holdout))
+        report["holdout_accuracy_change"] = report["holdout_accuracy_after"] - report["holdout_accuracy_before"]
+
+    append_cases(store_path, new_cases)
+    report["update_seconds"] = time.perf_counter() - started
+    return updated, report
@@ -0,0 +1,132 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import multiprocessing
+import os
+import time
+
+import server_timing
+
+logger = logging.getLogger(__name__)
+
+# "thread", "process", or "inline" (score on the event loop, the old behaviour)
+EXECUTOR_TYPE = os.getenv("HERHEALTH_INFERENCE_EXECUTOR", "thread").lower()
+EXECUTOR_WORKERS = int(os.getenv("HERHEALTH_INFERENCE_WORKERS", min(4, os.cpu_count() or 1)))
+# Calls allowed to wait for a free worker before new ones are turned away
+EXECUTOR_QUEUE_DEPTH = int(os.getenv("HERHEALTH_INFERENCE_QUEUE_DEPTH", 256))
+
+EXECUTOR_TYPES = ("thread", "process", "inline")
+
+
+class ExecutorBusy(RuntimeError):
+    pass
+
+
+def _timed_call(fn, args):
+    # Runs in the worker; the start time is what splits queue wait from run time
+    started = time.time()
+    result = fn(*args)
+    return started, time.time(), result
+
+
+class InferenceExecutor:
+    """Runs CPU-bound prediction calls off the event loop and records queue-wait metrics.
+
+    Functions sent to a process pool must be importable module-level functions;
+    `initializer` runs once in each worker process (e.g. to load the models).
+    """
+
+    def __init__(self, kind=EXECUTOR_TYPE, workers=EXECUTOR_WORKERS, queue_depth=EXECUTOR_QUEUE_DEPTH,
+                 initializer=None, initargs=()):
+        if kind not in EXECUTOR_TYPES:
+            raise ValueError(f"Unknown inference executor '{kind}', expected one of: {', '.join(EXECUTOR_TYPES)}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_depth = queue_depth
+        self.initializer = initializer
+        self.initargs = initargs
+        self._pool = None
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.run_time_total = 0.0
+
+    def _get_pool(self):
+        # Created on first use so importing the API starts no threads or processes
+        if self._pool is None:
+            if self.kind == "thread":
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="inference")
+            elif self.kind == "process":
+                # Spawned rather than forked, like model_init: the server already runs an event loop,
+                # threads and open SQLite handles, and the initializer loads the models by version anyway
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer, initargs=self.initargs,
+                )
+        return self._pool
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.workers + self.queue_depth:
+            self.rejected += 1
+            raise ExecutorBusy(f"Inference queue is full ({self.in_flight} calls in flight)")
+
+        self.submitted += 1
+        self.in_flight += 1
+        submitted_at = time.time()
+        try:
+            if self.kind == "inline":
+                started, finished, result = _timed_call(fn, args)
+            else:
+                call = functools.partial(_timed_call, fn, args)
+                if self.kind == "thread":
+                    # Keep request-scoped context variables visible inside the worker thread
+                    call = functools.partial(contextvars.copy_context().run, call)
+                started, finished, result = await asyncio.get_running_loop().run_in_executor(self._get_pool(), call)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        wait = max(0.0, started - submitted_at)
+        self.completed += 1
+        self.queue_wait_total += wait
+        self.queue_wait_max = max(self.queue_wait_max, wait)
+        self.run_time_total += finished - started
+        server_timing.record("inference_queue", wait)
+        return result
+
+    def restart(self, initargs=()):
+        # Process workers hold their own copy of the models, so after a model swap they are
+        # replaced; calls already queued on the old pool still finish there
+        self.initargs = initargs
+        if self.kind == "process" and self._pool is not None:
+            old_pool, self._pool = self._pool, None
+            old_pool.shutdown(wait=False)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "type": self.kind,
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_wait_ms_mean": self.queue_wait_total / self.completed * 1000 if self.completed else 0.0,
+            "queue_wait_ms_max": self.queue_wait_max * 1000,
+            "run_time_ms_mean": self.run_time_total / self.completed * 1000 if self.completed else 0.0,
+        }
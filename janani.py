@@ -0,0 +1,477 @@
+import asyncio
+import collections
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+
+import metrics
+import prediction_cache
+
+logger = logging.getLogger(__name__)
+
+# The Ollama model answering Janani Bot; the server address comes from OLLAMA_HOST
+OLLAMA_MODEL = os.getenv("HERHEALTH_OLLAMA_MODEL", "mistral")
+# Janani's persona goes first in every call, word for word, so Ollama can reuse the prompt prefix it has evaluated
+SYSTEM_PROMPT = (
+    "You are Janani, a maternal health assistant. Answer questions about pregnancy, childbirth and "
+    "maternal and fetal health clearly and kindly."
+)
+
+
+def _keep_alive(value):
+    # Seconds (negative keeps the model loaded until Ollama stops) or a duration such as "30m"
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+# How long Ollama keeps the model loaded after each call; sent on every call, as Ollama's default is 5 minutes
+OLLAMA_KEEP_ALIVE = _keep_alive(os.getenv("HERHEALTH_OLLAMA_KEEP_ALIVE", "-1"))
+# Load the model at startup, so the first question after a restart doesn't wait for it
+WARMUP_ENABLED = os.getenv("HERHEALTH_OLLAMA_WARMUP", "1").lower() in ("1", "true", "yes")
+# A call that spent longer than this loading the model counts as a cold start
+COLD_LOAD_SECONDS = 0.5
+
+CHAT_CACHE_ENABLED = os.getenv("HERHEALTH_CHAT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+CHAT_CACHE_SIZE = int(os.getenv("HERHEALTH_CHAT_CACHE_SIZE", 512))
+CHAT_CACHE_TTL = float(os.getenv("HERHEALTH_CHAT_CACHE_TTL", 24 * 3600))
+# Quick replies are answered at startup and again on this schedule, so clicks never wait for the model
+PREWARM_ENABLED = os.getenv("HERHEALTH_CHAT_PREWARM", "1").lower() in ("1", "true", "yes")
+PREWARM_INTERVAL = float(os.getenv("HERHEALTH_CHAT_PREWARM_INTERVAL", 6 * 3600))
+# The Janani Bot page's quick-reply buttons; keep in sync with `quick_replies` in app.py
+QUICK_REPLIES = (
+    "What are common pregnancy symptoms?",
+    "What foods should I avoid during pregnancy?",
+    "How can I manage stress during pregnancy?",
+    "What are the signs of labor?",
+)
+# More questions to keep warm, separated by "|"; the hit rates in /cache_stats show which ones are worth it
+PREWARM_QUESTIONS = QUICK_REPLIES + tuple(
+    question.strip() for question in os.getenv("HERHEALTH_CHAT_PREWARM_EXTRA", "").split("|") if question.strip()
+)
+# Answers Ollama writes at once (match OLLAMA_NUM_PARALLEL); more questions wait in line, up to the depth
+CHAT_CONCURRENCY = int(os.getenv("HERHEALTH_CHAT_CONCURRENCY", 1))
+CHAT_QUEUE_DEPTH = int(os.getenv("HERHEALTH_CHAT_QUEUE_DEPTH", 16))
+QUEUE_POSITION_INTERVAL = 0.5
+# Seconds a turned-away client is told to wait, about one answer's generation time
+CHAT_RETRY_AFTER = int(os.getenv("HERHEALTH_CHAT_RETRY_AFTER", 5))
+# Distinct questions whose hit rates are tracked
+QUESTION_STATS_SIZE = 1000
+
+_client = None
+
+
+def client():
+    # One async client (and connection pool) for the process, created on first use
+    global _client
+    if _client is None:
+        import ollama
+
+        _client = ollama.AsyncClient()
+    return _client
+
+
+def messages(question):
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": question}]
+
+
+def normalize_question(question):
+    # Case, spacing, full-width characters and trailing punctuation don't change the answer
+    question = unicodedata.normalize("NFKC", question).casefold()
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ")
+
+
+# A new model or prompt makes every cached answer stale
+_PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:12]
+
+
+class AnswerCache:
+    """Answers keyed by model, system prompt and normalized question, with per-question hit counts."""
+
+    def __init__(self, max_size=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL, enabled=CHAT_CACHE_ENABLED):
+        self.enabled = enabled
+        self.local = prediction_cache.LRUCache(max_size, ttl)
+        self.questions = collections.OrderedDict()
+
+    def key(self, question):
+        return f"{OLLAMA_MODEL}|{_PROMPT_HASH}|{normalize_question(question)}"
+
+    def _count(self, question, hit):
+        normalized = normalize_question(question)
+        counts = self.questions.pop(normalized, None) or [0, 0]
+        counts[0] += 1
+        counts[1] += hit
+        self.questions[normalized] = counts
+        while len(self.questions) > QUESTION_STATS_SIZE:
+            self.questions.popitem(last=False)
+
+    def lookup(self, question):
+        if not self.enabled:
+            return None
+        value = self.local.get(self.key(question))
+        hit = isinstance(value, str)
+        self._count(question, hit)
+        return value if hit else None
+
+    def store(self, question, answer):
+        if self.enabled and answer:
+            self.local.set(self.key(question), answer)
+
+    def stats(self, top=20):
+        busiest = sorted(self.questions.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        return {
+            "enabled": self.enabled,
+            **self.local.stats(),
+            "questions": [
+                {"question": question, "lookups": lookups, "hits": hits, "hit_rate": hits / lookups}
+                for question, (lookups, hits) in busiest
+            ],
+        }
+
+
+answer_cache = AnswerCache()
+
+
+FIRST_TOKEN_SECONDS = metrics.Histogram(
+    "herhealth_chat_first_token_seconds",
+    "Time to Janani Bot's first token, by whether Ollama had to load the model (cold) or not (warm).",
+    ["start"],
+)
+model_loads = 0
+
+
+def _loaded(response):
+    """Seconds Ollama spent loading the model for this call; a long load is counted as a cold start."""
+    global model_loads
+    load = (response.get("load_duration") or 0) / 1e9
+    if load > COLD_LOAD_SECONDS:
+        model_loads += 1
+        logger.info(f"Ollama loaded model '{OLLAMA_MODEL}' in {load:.2f}s")
+    return load
+
+
+async def _generate(question):
+    with metrics.stage("ollama_generation"):
+        response = await client().chat(model=OLLAMA_MODEL, messages=messages(question), keep_alive=OLLAMA_KEEP_ALIVE)
+    _loaded(response)
+    return response["message"]["content"]
+
+
+class ChatBusy(RuntimeError):
+    pass
+
+
+class GenerationGate:
+    """Lets at most `limit` generations run against Ollama at once; the rest wait in FIFO order.
+
+    A waiter's place in line is its `position` (1 is next). At most
+    `queue_depth` may wait, so under overload new questions are turned away
+    quickly instead of piling up behind minutes of generation.
+    """
+
+    def __init__(self, limit=CHAT_CONCURRENCY, queue_depth=CHAT_QUEUE_DEPTH):
+        self.limit = max(1, limit)
+        self.queue_depth = queue_depth
+        self.active = 0
+        self._waiting = collections.deque()
+        self.started = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    @property
+    def full(self):
+        return len(self._waiting) >= self.queue_depth
+
+    def position(self, waiter):
+        try:
+            return self._waiting.index(waiter) + 1
+        except ValueError:
+            return 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, on_wait=None):
+        # `on_wait` gets the waiter future when the caller has to queue, to ask for its position
+        queued_at = time.perf_counter()
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiting.append(waiter)
+            if on_wait is not None:
+                on_wait(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # Handed a slot just as we were cancelled; pass it on
+                    self._release()
+                raise
+        wait = time.perf_counter() - queued_at
+        self.started += 1
+        self.queue_wait_total += wait
+        self.queue_wait_max = max(self.queue_wait_max, wait)
+        metrics.observe_stage("chat_queue", wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        # The slot goes straight to the next waiter, so `active` only drops when nobody waits
+        while self._waiting:
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue_depth": self.queue_depth,
+            "active": self.active,
+            "queued": len(self._waiting),
+            "started": self.started,
+            "rejected": self.rejected,
+            "queue_wait_avg_ms": self.queue_wait_total / self.started * 1000 if self.started else 0.0,
+            "queue_wait_max_ms": self.queue_wait_max * 1000,
+        }
+
+
+gate = GenerationGate()
+
+
+class Flight:
+    """One generation of an answer, followed by every request asking the same question meanwhile.
+
+    The generation runs in its own task, so it carries on (and gets cached)
+    when the request that started it goes away. It is only cancelled when
+    every follower left before it got out of the queue.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.parts = []
+        self.started = False
+        self.done = False
+        self.error = None
+        self.waiter = None
+        self.task = None
+        self.followers = 0
+        self._changed = asyncio.Event()
+
+    @classmethod
+    def completed(cls, answer):
+        flight = cls()
+        flight.parts.append(answer)
+        flight.started = flight.done = True
+        return flight
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def _bump(self):
+        # Wake everyone waiting on the old event; later waits use a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def push(self, content):
+        self.parts.append(content)
+        self._bump()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._bump()
+
+    async def follow(self):
+        """Yield ("queued", position) while waiting for a slot, then ("token", content) from the start."""
+        self.followers += 1
+        try:
+            index = 0
+            last_position = None
+            while True:
+                while index < len(self.parts):
+                    yield "token", self.parts[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                changed = self._changed.wait()
+                if self.started or self.waiter is None:
+                    await changed
+                    continue
+                position = gate.position(self.waiter)
+                if position != last_position:
+                    last_position = position
+                    yield "queued", position
+                # Positions only move when a generation ends, so checking twice a second is plenty
+                try:
+                    await asyncio.wait_for(changed, QUEUE_POSITION_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.followers -= 1
+            if self.followers == 0 and not self.started and self.task is not None:
+                if _flights.get(self.key) is self:
+                    del _flights[self.key]
+                self.task.cancel()
+
+
+# Generations in progress by cache key, so identical questions share one
+_flights = {}
+coalesced = 0
+
+
+async def _stream_generation(question):
+    started = time.perf_counter()
+    first_token = None
+    load = 0.0
+    stream = await client().chat(model=OLLAMA_MODEL, messages=messages(question), stream=True, keep_alive=OLLAMA_KEEP_ALIVE)
+    async for part in stream:
+        content = part["message"]["content"]
+        if first_token is None and content:
+            first_token = time.perf_counter() - started
+            metrics.observe_stage("ollama_first_token", first_token)
+        if content:
+            yield content
+        if part["done"]:
+            load = _loaded(part)
+    metrics.observe_stage("ollama_generation", time.perf_counter() - started)
+    # The load time only comes with the last chunk, so the first token is labelled afterwards
+    if first_token is not None:
+        FIRST_TOKEN_SECONDS.observe(first_token, "cold" if load > COLD_LOAD_SECONDS else "warm")
+
+
+async def _fly(flight, question):
+    try:
+        async with gate.slot(on_wait=lambda waiter: setattr(flight, "waiter", waiter)):
+            flight.started = True
+            flight._bump()
+            async for content in _stream_generation(question):
+                flight.push(content)
+        answer_cache.store(question, flight.text)
+        flight.finish()
+    except asyncio.CancelledError as e:
+        flight.finish(e)
+        raise
+    except Exception as e:
+        flight.finish(e)
+    finally:
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+
+
+def open_answer(question):
+    """The Flight answering `question`: cached, joined from an identical question in progress, or new.
+
+    Raises ChatBusy when a new generation would have to queue behind a full line.
+    """
+    global coalesced
+    cached = answer_cache.lookup(question)
+    if cached is not None:
+        return Flight.completed(cached)
+    key = answer_cache.key(question)
+    flight = _flights.get(key)
+    if flight is not None:
+        coalesced += 1
+        return flight
+    if gate.active >= gate.limit and gate.full:
+        gate.rejected += 1
+        raise ChatBusy(f"Janani Bot is busy, {len(gate._waiting)} questions are already waiting")
+    flight = Flight(key)
+    _flights[key] = flight
+    flight.task = asyncio.create_task(_fly(flight, question))
+    return flight
+
+
+async def answer(question):
+    """The whole answer in one piece, from the cache when it has it."""
+    flight = open_answer(question)
+    async for _ in flight.follow():
+        pass
+    return flight.text
+
+
+async def prewarm(questions=PREWARM_QUESTIONS):
+    """Generate fresh answers to `questions` and cache them; returns how many were stored."""
+    warmed = 0
+    for question in questions:
+        try:
+            # Queues like any other question, so pre-warming never adds to the load on Ollama
+            async with gate.slot():
+                answer_cache.store(question, await _generate(question))
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Could not pre-warm the answer to '{question}': {e}")
+            break
+    if warmed:
+        logger.info(f"Pre-warmed {warmed} Janani Bot answers")
+    return warmed
+
+
+def stats():
+    return {
+        "model": {
+            "name": OLLAMA_MODEL,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "warm_up_ms": warm_up_seconds * 1000 if warm_up_seconds is not None else None,
+            "cold_loads": model_loads,
+        },
+        "gate": gate.stats(),
+        "in_flight": len(_flights),
+        "coalesced": coalesced,
+    }
+
+
+warm_up_seconds = None
+
+
+async def warm_up():
+    """Load the model, pinned for OLLAMA_KEEP_ALIVE, and have Ollama evaluate the system prompt once."""
+    global warm_up_seconds
+    started = time.perf_counter()
+    try:
+        async with gate.slot():
+            response = await client().chat(
+                model=OLLAMA_MODEL, messages=messages("Hello"), keep_alive=OLLAMA_KEEP_ALIVE, options={"num_predict": 1}
+            )
+    except Exception as e:
+        logger.warning(f"Could not warm up Ollama model '{OLLAMA_MODEL}': {e}")
+        return False
+    warm_up_seconds = time.perf_counter() - started
+    logger.info(f"Warmed up Ollama model '{OLLAMA_MODEL}' in {warm_up_seconds:.2f}s "
+                f"(loading took {_loaded(response):.2f}s, keep_alive={OLLAMA_KEEP_ALIVE})")
+    return True
+
+
+async def keep_warm():
+    # Runs from startup: load the model first, then keep the quick replies' answers cached
+    if WARMUP_ENABLED:
+        await warm_up()
+    if PREWARM_ENABLED and answer_cache.enabled:
+        await prewarm_loop()
+
+
+async def prewarm_loop(interval=PREWARM_INTERVAL, questions=PREWARM_QUESTIONS):
+    # Runs from startup; with the interval shorter than the TTL, quick replies never expire
+    while True:
+        await prewarm(questions)
+        await asyncio.sleep(interval)
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import fake_services
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Relative share of each endpoint in the generated traffic; override with --mix
+DEFAULT_MIX = {
+    "test": 10,
+    "predict_risk": 35,
+    "predict_fetal_health": 30,
+    "predict_risk_batch": 4,
+    "predict_fetal_health_bulk": 4,
+    "chat": 10,
+    "sos": 2,
+    "ready": 5,
+}
+QUESTIONS = [
+    "What should I eat during pregnancy?",
+    "Is it safe to exercise in the third trimester?",
+    "What are the warning signs of preeclampsia?",
+    "How much weight should I gain during pregnancy?",
+    "How can I manage morning sickness?",
+]
+# A step counts as saturated when it completes less than this share of the offered rate...
+SATURATION_THROUGHPUT = 0.9
+# ...or more than this share of its requests fail, or its p99 latency exceeds the SLO
+SATURATION_ERROR_RATE = 0.01
+SLO_P99_MS = float(os.getenv("HERHEALTH_LOAD_SLO_P99_MS", 1000))
+
+
+def _dataset(name, columns):
+    import pandas as pd
+
+    return pd.read_csv(os.path.join(script_dir, "data", name), usecols=columns)[columns].to_numpy(dtype=np.float64)
+
+
+class RequestFactory:
+    """Builds (method, path, kwargs) for each endpoint from the bundled datasets, reproducibly."""
+
+    def __init__(self, seed=0, batch_rows=100, contacts=2):
+        import fetus_health
+        import main
+        import risk_management
+
+        self.rng = random.Random(seed)
+        self.batch_rows = batch_rows
+        self.contacts = contacts
+        self.risk_fields = main.HEALTH_DATA_FIELDS
+        self.fetal_fields = main.FETAL_DATA_FIELDS
+        self.risk_rows = _dataset("Maternal_Health_Risk_Data_Set.csv", risk_management.selected_features)
+        self.fetal_rows = _dataset("fetal_health.csv", fetus_health.important_features)
+
+    def _rows(self, rows, n):
+        start = self.rng.randrange(len(rows))
+        return np.take(rows, range(start, start + n), axis=0, mode="wrap")
+
+    def build(self, endpoint):
+        if endpoint == "test":
+            return "GET", "/test", {}
+        if endpoint == "ready":
+            return "GET", "/ready", {}
+        if endpoint == "predict_risk":
+            return "POST", "/predict_risk", {"json": dict(zip(self.risk_fields, self._rows(self.risk_rows, 1)[0]))}
+        if endpoint == "predict_fetal_health":
+            row = self._rows(self.fetal_rows, 1)[0]
+            return "POST", "/predict_fetal_health", {"json": dict(zip(self.fetal_fields, row))}
+        if endpoint == "predict_risk_batch":
+            rows = self._rows(self.risk_rows, self.batch_rows)
+            return "POST", "/predict_risk/batch", {"json": {"records": [dict(zip(self.risk_fields, row)) for row in rows]}}
+        if endpoint == "predict_fetal_health_bulk":
+            rows = self._rows(self.fetal_rows, self.batch_rows)
+            lines = [",".join(self.fetal_fields)] + [",".join(repr(float(x)) for x in row) for row in rows]
+            return "POST", "/predict_fetal_health/bulk?format=csv", {
+                "content": "\n".join(lines) + "\n", "headers": {"Content-Type": "text/csv"},
+            }
+        if endpoint == "chat":
+            return "POST", "/chat", {"json": {"question": self.rng.choice(QUESTIONS)}}
+        if endpoint == "sos":
+            return "POST", "/sos", {"json": {
+                "latitude": round(self.rng.uniform(8, 35), 5),
+                "longitude": round(self.rng.uniform(68, 97), 5),
+                # A different user each time, so the per-contact rate limit doesn't throttle the test
+                "emergency_contacts": [f"+1555{self.rng.randrange(10 ** 7):07d}" for _ in range(self.contacts)],
+            }}
+        raise ValueError(f"Unknown endpoint '{endpoint}', expected one of: {', '.join(DEFAULT_MIX)}")
+
+
+def summarize_step(records, duration, offered_rate, slo_p99_ms=SLO_P99_MS):
+    """Per-endpoint (and total) throughput, latency percentiles in ms and error rates for one step."""
+    by_endpoint = {}
+    for endpoint, status, latency, error in records:
+        by_endpoint.setdefault(endpoint, []).append((status, latency, error))
+    by_endpoint["total"] = [(status, latency, error) for _, status, latency, error in records]
+
+    endpoints = {}
+    for endpoint, rows in by_endpoint.items():
+        if not rows:
+            continue
+        latencies = np.array([latency for _, latency, _ in rows]) * 1000
+        failed = [row for row in rows if row[2] is not None or row[0] >= 400]
+        statuses = {}
+        for status, _, error in rows:
+            key = str(status) if error is None else error
+            statuses[key] = statuses.get(key, 0) + 1
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "throughput": (len(rows) - len(failed)) / duration,
+            "error_rate": len(failed) / len(rows),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "statuses": statuses,
+        }
+    total = endpoints.get("total", {"requests": 0, "throughput": 0.0, "error_rate": 0.0})
+    saturated = (
+        total["requests"] == 0
+        or total["throughput"] < SATURATION_THROUGHPUT * offered_rate
+        or total["error_rate"] > SATURATION_ERROR_RATE
+        or total["p99_ms"] > slo_p99_ms
+    )
+    return {"offered_rate": offered_rate, "duration": duration, "saturated": saturated, "endpoints": endpoints}
+
+
+async def run_step(client, factory, mix, rate, duration, arrivals="poisson", timeout=30.0, seed=0,
+                   slo_p99_ms=SLO_P99_MS):
+    """Send requests at `rate` per second for `duration` seconds, whether or not earlier ones finished.
+
+    Latency is measured from each request's scheduled start, so time spent
+    queued behind a saturated server (or this client) counts against it.
+    """
+    rng = random.Random(seed)
+    endpoints, weights = zip(*mix.items())
+    records = []
+
+    async def send(endpoint, scheduled):
+        method, path, kwargs = factory.build(endpoint)
+        try:
+            response = await client.request(method, path, timeout=timeout, **kwargs)
+            await response.aread()
+            records.append((endpoint, response.status_code, time.perf_counter() - scheduled, None))
+        except Exception as e:
+            records.append((endpoint, 0, time.perf_counter() - scheduled, type(e).__name__))
+
+    tasks = []
+    start = time.perf_counter()
+    scheduled = start
+    while scheduled < start + duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = rng.choices(endpoints, weights)[0]
+        tasks.append(asyncio.create_task(send(endpoint, scheduled)))
+        scheduled += rng.expovariate(rate) if arrivals == "poisson" else 1 / rate
+    # Requests still running when the step ends count towards it
+    await asyncio.gather(*tasks)
+    return summarize_step(records, duration, rate, slo_p99_ms)
+
+
+def start_backend(env, port, log_path=None, ready_timeout=300):
+    """Start `uvicorn main:app` in a child process with `env` added and wait until /ready answers 200."""
+    import httpx
+
+    log = open(log_path, "a") if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=script_dir, env={**os.environ, **env}, stdout=log, stderr=log,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode} before becoming ready")
+        try:
+            if httpx.get(f"{url}/ready", timeout=1).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Backend was not ready after {ready_timeout}s")
+
+
+def print_step(step):
+    print(f"\n{step['offered_rate']:g} req/s offered for {step['duration']:g}s"
+          f"{'  (SATURATED)' if step['saturated'] else ''}")
+    print(f"  {'endpoint':<28} {'requests':>8} {'ok/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in step["endpoints"].items():
+        print(f"  {endpoint:<28} {stats['requests']:>8} {stats['throughput']:>8.1f} {stats['error_rate']:>7.1%} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        endpoint, _, weight = part.partition("=")
+        mix[endpoint.strip()] = float(weight or 1)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    return mix
+
+
+async def run(args):
+    import httpx
+
+    fakes = []
+    backend = None
+    target = args.target
+    try:
+        if target is None:
+            twilio_behaviour = fake_services.Behaviour(args.fake_latency_ms, args.fake_jitter_ms, args.twilio_error_rate, seed=1)
+            ollama_behaviour = fake_services.Behaviour(args.ollama_latency_ms, args.fake_jitter_ms, args.ollama_error_rate, seed=2)
+            twilio, ollama, env = fake_services.start_fakes(
+                twilio_behaviour, ollama_behaviour, args.twilio_statuses.split(","), args.twilio_undelivered_rate,
+                args.ollama_token_ms, args.ollama_load_ms,
+            )
+            fakes = [twilio, ollama]
+            # The fake Twilio reports delivery back to the backend as real Twilio would
+            env["HERHEALTH_SOS_CALLBACK_URL"] = f"http://127.0.0.1:{args.port}/sos/status_callback"
+            # A fresh outbox, so the run doesn't resume alerts left over from an earlier one
+            env["HERHEALTH_SOS_OUTBOX_PATH"] = os.path.join(tempfile.mkdtemp(prefix="herhealth-load-"), "sos_outbox.sqlite")
+            print(f"Fake Twilio at {twilio.url}, fake Ollama at {ollama.url}; starting the backend...")
+            backend, target = start_backend(env, args.port, args.backend_log)
+
+        factory = RequestFactory(args.seed, args.batch_rows, args.contacts)
+        limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+        steps = []
+        async with httpx.AsyncClient(base_url=target, limits=limits) as client:
+            # One untimed request per endpoint pays for lazy imports and first-call setup
+            for endpoint in args.mix:
+                method, path, kwargs = factory.build(endpoint)
+                await client.request(method, path, timeout=args.timeout, **kwargs)
+            for i, rate in enumerate(args.rates):
+                step = await run_step(client, factory, args.mix, rate, args.duration, args.arrivals, args.timeout,
+                                      args.seed + i, args.slo_p99_ms)
+                print_step(step)
+                steps.append(step)
+                if step["saturated"] and args.stop_at_saturation:
+                    break
+
+        sustained = [step["offered_rate"] for step in steps if not step["saturated"]]
+        print(f"\nHighest unsaturated rate: {max(sustained):g} req/s" if sustained
+              else "\nSaturated at every rate tried")
+        if "sos" in args.mix:
+            # Alerts are sent after /sos answers; give the outbox a moment to drain, then report end to end
+            await asyncio.sleep(args.sos_drain)
+            async with httpx.AsyncClient(base_url=target) as client:
+                sos = (await client.get("/sos_stats", timeout=args.timeout)).json()
+            print(f"SOS outbox: {sos['outbox']}, retries {sos['retries']}, duplicates {sos['duplicates']}")
+            for outcome in ("accepted", "delivered"):
+                print(f"  SOS to {outcome}: {sos[f'{outcome}_latency']}")
+        if fakes:
+            print(f"Fake Twilio: {fakes[0].app.state.behaviour.stats()}, fake Ollama: {fakes[1].app.state.behaviour.stats()}")
+        return {"target": target, "mix": args.mix, "arrivals": args.arrivals, "steps": steps}
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait(timeout=10)
+        for fake in fakes:
+            fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Open-loop load test of the HerHealth backend, with fake Twilio and Ollama servers."
+    )
+    parser.add_argument("--target", help="URL of a running backend; by default one is started against the fakes")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the backend started by this command")
+    parser.add_argument("--backend-log", help="Append the started backend's output to this file")
+    parser.add_argument("--rates", type=float, nargs="+", default=[10, 25, 50, 100],
+                        help="Requests per second, one step each")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per step")
+    parser.add_argument("--arrivals", choices=["poisson", "constant"], default="poisson")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Endpoint weights, e.g. predict_risk=5,chat=1 (endpoints: %s)" % ", ".join(DEFAULT_MIX))
+    parser.add_argument("--slo-p99-ms", type=float, default=SLO_P99_MS,
+                        help="A step whose overall p99 latency exceeds this counts as saturated")
+    parser.add_argument("--stop-at-saturation", action="store_true", help="Skip the remaining rates once one saturates")
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--batch-rows", type=int, default=100, help="Rows per batch and bulk request")
+    parser.add_argument("--contacts", type=int, default=2, help="Emergency contacts per SOS request")
+    parser.add_argument("--sos-drain", type=float, default=5,
+                        help="Seconds to wait after the last step before reading the SOS outbox stats")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the per-step results as JSON")
+    fakes = parser.add_argument_group("fake services")
+    fakes.add_argument("--fake-latency-ms", type=float, default=fake_services.FAKE_LATENCY_MS,
+                       help="Fake Twilio response time")
+    fakes.add_argument("--fake-jitter-ms", type=float, default=fake_services.FAKE_JITTER_MS)
+    fakes.add_argument("--twilio-error-rate", type=float, default=fake_services.FAKE_ERROR_RATE)
+    fakes.add_argument("--twilio-statuses", default=",".join(fake_services.TWILIO_STATUSES),
+                       help="Statuses a message reports on successive fetches")
+    fakes.add_argument("--twilio-undelivered-rate", type=float, default=fake_services.TWILIO_UNDELIVERED_RATE)
+    fakes.add_argument("--ollama-latency-ms", type=float, default=fake_services.FAKE_LATENCY_MS,
+                       help="Fake Ollama time to first token")
+    fakes.add_argument("--ollama-token-ms", type=float, default=fake_services.OLLAMA_TOKEN_MS)
+    fakes.add_argument("--ollama-load-ms", type=float, default=fake_services.OLLAMA_LOAD_MS,
+                       help="Fake Ollama model load time, paid when the model isn't loaded")
+    fakes.add_argument("--ollama-error-rate", type=float, default=fake_services.FAKE_ERROR_RATE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
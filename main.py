@@ -1,46 +1,271 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
-import uvicorn
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+import asyncio
+import importlib
+import hmac
+import json
 import logging
 import os
-import requests
-from twilio.rest import Client
-import ollama
-from dotenv import load_dotenv
+import sys
+
+import numpy as np
 
-from fetus_health import predict_fetal_health, initialize_fetal_model
-from risk_management import predict_risk, initialize_risk_model  
+import bulk_upload
+import fetus_health
+import inference_executor
+import janani
+import metrics
+import micro_batch
+import model_init
+import model_reload
+import prediction_cache
+import profiler
+import risk_management
+import server_timing
+import sos_alerts
+from fetus_health import predict_fetal_health_batch, initialize_fetal_model
+from risk_management import predict_risk_batch, initialize_risk_model  
 
-# Load environment variables from .env file
-logger = logging.getLogger(__name__)  # Move logger setup before load_dotenv
+logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-logger.info(f"Current working directory: {os.getcwd()}")
-logger.info(f"Looking for .env file in: {os.path.abspath('.env')}")
-if not os.path.exists(".env"):
-    logger.error(".env file not found in the current directory!")
-else:
-    logger.info(".env file found, attempting to load...")
+# Per-phase startup timings in milliseconds, in the order the phases ran
+startup_timings = {"import_main": (time.perf_counter() - _import_started) * 1000}
+_env_loaded = False
+
+@contextmanager
+def _timed_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = (time.perf_counter() - start) * 1000
+
+def _lazy_import(module_name):
+    # Heavy client libraries are only imported by the endpoint that needs them
+    module = sys.modules.get(module_name)
+    if module is None:
+        with _timed_phase(f"import_{module_name}"):
+            module = importlib.import_module(module_name)
+    return module
+
+def _lazy_models_enabled():
+    return os.getenv("HERHEALTH_LAZY_MODELS", "").lower() in ("1", "true", "yes")
+
+def load_environment():
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    # Load environment variables from .env file
+    logger.info(f"Current working directory: {os.getcwd()}")
+    logger.info(f"Looking for .env file in: {os.path.abspath('.env')}")
+    if not os.path.exists(".env"):
+        logger.error(".env file not found in the current directory!")
+    else:
+        logger.info(".env file found, attempting to load...")
+
+    _lazy_import("dotenv").load_dotenv()
+
+    # Log the loaded environment variables
+    logger.info(f"TWILIO_ACCOUNT_SID after load_dotenv: {'Set' if os.getenv('TWILIO_ACCOUNT_SID') else 'Not set'}")
+    logger.info(f"TWILIO_AUTH_TOKEN after load_dotenv: {'Set' if os.getenv('TWILIO_AUTH_TOKEN') else 'Not set'}")
+    logger.info(f"TWILIO_PHONE_NUMBER after load_dotenv: {'Set' if os.getenv('TWILIO_PHONE_NUMBER') else 'Not set'}")
+
+# Synchronous loading for processes that serve predictions outside the event loop (process-pool workers)
+def ensure_fetal_model():
+    if fetus_health.active_model is None:
+        with _timed_phase("fetal_model"):
+            if not initialize_fetal_model():
+                logger.error("Failed to initialize fetal health model.")
+                return
+        logger.info("Fetal health model initialized.")
+
+def ensure_risk_model():
+    if risk_management.active_model is None:
+        with _timed_phase("risk_model"):
+            initialize_risk_model()
+        logger.info("Risk model initialized.")
+
+# Results are cached per model version, so a reloaded model never serves stale predictions
+risk_cache = prediction_cache.PredictionCache("risk")
+fetal_cache = prediction_cache.PredictionCache("fetal")
+
+def _init_inference_worker(fetal_version=None, risk_version=None):
+    # Process-pool workers load their own copy of the models, at the versions the server has active
+    if fetal_version is None:
+        ensure_fetal_model()
+    elif fetus_health.model_version != fetal_version:
+        fetus_health.activate_fetal_model(fetus_health.load_fetal_model(fetal_version))
+    if risk_version is None:
+        ensure_risk_model()
+    elif risk_management.model_version != risk_version:
+        risk_management.activate_risk_model(risk_management.load_risk_model(risk_version))
+
+# Forest evaluation runs here instead of blocking the event loop
+inference = inference_executor.InferenceExecutor(initializer=_init_inference_worker)
+
+async def _score_risk_rows(samples):
+    risk_levels, recommendations = await inference.run(predict_risk_batch, samples)
+    return list(zip(risk_levels, recommendations))
+
+async def _score_fetal_rows(samples):
+    return await inference.run(predict_fetal_health_batch, samples)
+
+# Concurrent single-row requests that miss the cache are scored together
+risk_batcher = micro_batch.MicroBatcher("risk", _score_risk_rows)
+fetal_batcher = micro_batch.MicroBatcher("fetal", _score_fetal_rows)
+
+# Models start in background processes so the server accepts requests (and answers /test) right away
+initializer = model_init.ModelInitializer(timings=startup_timings)
+initializer.register(
+    fetus_health.MODEL_NAME, fetus_health.prepare_fetal_model, fetus_health.load_fetal_model,
+    fetus_health.activate_fetal_model,
+)
+initializer.register(
+    risk_management.MODEL_NAME, risk_management.prepare_risk_model, risk_management.load_risk_model,
+    risk_management.activate_risk_model,
+)
+
+# New model versions are loaded, warmed up and swapped in without a restart
+reloader = model_reload.ModelReloader()
+reloader.register(
+    fetus_health.MODEL_NAME, fetus_health.load_fetal_model, fetus_health.warm_up_fetal_model,
+    fetus_health.activate_fetal_model, lambda: fetus_health.model_version,
+)
+reloader.register(
+    risk_management.MODEL_NAME, risk_management.load_risk_model, risk_management.warm_up_risk_model,
+    risk_management.activate_risk_model, lambda: risk_management.model_version,
+)
+reloader.add_listener(lambda name, bundle: inference.restart((fetus_health.model_version, risk_management.model_version)))
+reloader.add_listener(lambda name, bundle: initializer.mark_ready(name, reloader.models[name][3]()))
+_watch_task = None
+_prewarm_task = None
+
+async def cached_prediction(cache, batcher, model_version, features):
+    result = cache.lookup(model_version, features)
+    if result is None:
+        result = await batcher.submit(features)
+        cache.store(model_version, features, result)
+    return result
+
+class ModelVersionHeaders:
+    # Reports the active model versions on every response, streaming ones included
+    def __init__(self, app):
+        self.app = app
 
-load_dotenv()
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
 
-# Log the loaded environment variables
-logger.info(f"TWILIO_ACCOUNT_SID after load_dotenv: {'Set' if os.getenv('TWILIO_ACCOUNT_SID') else 'Not set'}")
-logger.info(f"TWILIO_AUTH_TOKEN after load_dotenv: {'Set' if os.getenv('TWILIO_AUTH_TOKEN') else 'Not set'}")
-logger.info(f"TWILIO_PHONE_NUMBER after load_dotenv: {'Set' if os.getenv('TWILIO_PHONE_NUMBER') else 'Not set'}")
+        async def send_with_versions(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-risk-model-version", str(risk_management.model_version).encode()))
+                headers.append((b"x-fetal-model-version", str(fetus_health.model_version).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_versions)
+
+# SOS alerts go through a durable outbox and one pooled Twilio client
+sos_sender = sos_alerts.SOSSender()
+# Longest a long-poll may hold a request, and the idle gap between SSE keepalives
+SOS_MAX_WAIT = 30
+SOS_EVENTS_KEEPALIVE = 15
+
+# Operators can profile a live worker through /admin/profile
+profiling = profiler.Profiler()
 
 app = FastAPI()
+app.add_middleware(profiler.ProfilingMiddleware, profiler=profiling)
+app.add_middleware(ModelVersionHeaders)
+if server_timing.SERVER_TIMING_ENABLED:
+    app.add_middleware(server_timing.ServerTimingMiddleware)
+if metrics.METRICS_ENABLED:
+    # Added last so it is outermost and times the whole request
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Read from the live objects whenever /metrics is scraped
+metrics.Gauge(
+    "herhealth_model_info", "Active model version, always 1.", ["model", "version"],
+    function=lambda: {
+        (name, str(version)): 1
+        for name, version in ((risk_management.MODEL_NAME, risk_management.model_version),
+                              (fetus_health.MODEL_NAME, fetus_health.model_version))
+        if version is not None
+    },
+)
+metrics.Gauge(
+    "herhealth_model_ready", "1 once a model has finished initializing.", ["model"],
+    function=lambda: {(name,): int(state["state"] == "ready") for name, state in initializer.states.items()},
+)
+metrics.Gauge(
+    "herhealth_prediction_cache_entries", "Entries in the in-process prediction cache.", ["cache"],
+    function=lambda: {(cache.name,): cache.local.stats()["size"] for cache in (risk_cache, fetal_cache)},
+)
+metrics.Counter(
+    "herhealth_prediction_cache_lookups_total", "Prediction cache lookups by tier and result.",
+    ["cache", "tier", "result"],
+    function=lambda: {
+        (cache.name, tier, result): stats[result]
+        for cache in (risk_cache, fetal_cache)
+        for tier, stats in (("local", cache.local.stats()), ("shared", cache.shared.stats() if cache.shared else None))
+        if stats is not None
+        for result in ("hits", "misses")
+    },
+)
+metrics.Counter(
+    "herhealth_chat_cache_lookups_total", "Janani Bot answer cache lookups by result.", ["result"],
+    function=lambda: {(result,): janani.answer_cache.local.stats()[result] for result in ("hits", "misses")},
+)
+metrics.Gauge(
+    "herhealth_chat_generations", "Janani Bot answers being generated or waiting for Ollama.", ["state"],
+    function=lambda: {("active",): janani.gate.active, ("queued",): janani.gate.stats()["queued"]},
+)
+metrics.Counter(
+    "herhealth_chat_requests_total", "Janani Bot questions that joined an identical one in progress or were turned away.",
+    ["result"],
+    function=lambda: {("coalesced",): janani.coalesced, ("rejected",): janani.gate.rejected},
+)
+metrics.Gauge(
+    "herhealth_inference_queued", "Inference calls waiting for a free worker.", [],
+    function=lambda: {(): inference.stats()["queued"]},
+)
 
 @app.on_event("startup")
 async def startup_event():
-    logger.info("Initializing models...")
-    if not initialize_fetal_model():
-        logger.error("Failed to initialize fetal health model.")
+    with _timed_phase("load_environment"):
+        load_environment()
+    if _lazy_models_enabled():
+        logger.info("Lazy model loading enabled, models will be initialized on first use.")
     else:
-        logger.info("Fetal health model initialized.")
-    initialize_risk_model()
-    logger.info("Risk model initialized.")
+        logger.info("Initializing models in the background...")
+        initializer.start()
+    logger.info("Startup timings (ms): " + ", ".join(f"{k}={v:.1f}" for k, v in startup_timings.items()))
+    # Also resumes alerts a previous process stored but didn't finish sending
+    sos_sender.start()
+    global _watch_task, _prewarm_task
+    if model_reload.WATCH_INTERVAL > 0:
+        _watch_task = asyncio.create_task(reloader.watch())
+    _prewarm_task = asyncio.create_task(janani.keep_warm())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (_watch_task, _prewarm_task):
+        if task is not None:
+            task.cancel()
+    initializer.shutdown()
+    inference.shutdown()
+    await sos_sender.close()
+    await janani.close()
 
 class SOSRequest(BaseModel):
     latitude: float
@@ -58,6 +283,11 @@ class HealthData(BaseModel):
     body_temp: float
     heart_rate: float
 
+class HealthDataBatch(BaseModel):
+    # Records are checked one by one in the handler, so a malformed row is reported instead of failing the batch
+    records: Optional[List[Any]] = None
+    columns: Optional[Dict[str, List[float]]] = None
+
 class FetalHealthData(BaseModel):
     baseline_value: float
     accelerations: float
@@ -67,56 +297,121 @@ class FetalHealthData(BaseModel):
     histogram_mean: float
     histogram_variance: float
 
+# (field, min, max, error) checked in order; shared by the single-row and batch endpoints
+HEALTH_DATA_BOUNDS = [
+    ("age", 10, 100, "Age must be between 10 and 100"),
+    ("systolic_bp", 70, 200, "Systolic BP must be between 70 and 200"),
+    ("diastolic_bp", 40, 120, "Diastolic BP must be between 40 and 120"),
+    ("bs", 3.0, 20.0, "Blood Sugar must be between 3.0 and 20.0"),
+    ("body_temp", 95.0, 105.0, "Body temperature must be between 95.0°F and 105.0°F"),
+    ("heart_rate", 40, 180, "Heart rate must be between 40 and 180 bpm"),
+]
+HEALTH_DATA_FIELDS = [field for field, _, _, _ in HEALTH_DATA_BOUNDS]
+MAX_BATCH_ROWS = int(os.getenv("HERHEALTH_MAX_BATCH_ROWS", 10000))
+
 def validate_health_data(data: HealthData):
-    if not (10 <= data.age <= 100): raise ValueError("Age must be between 10 and 100")
-    if not (70 <= data.systolic_bp <= 200): raise ValueError("Systolic BP must be between 70 and 200")
-    if not (40 <= data.diastolic_bp <= 120): raise ValueError("Diastolic BP must be between 40 and 120")
-    if not (3.0 <= data.bs <= 20.0): raise ValueError("Blood Sugar must be between 3.0 and 20.0")
-    if not (95.0 <= data.body_temp <= 105.0): raise ValueError("Body temperature must be between 95.0°F and 105.0°F")
-    if not (40 <= data.heart_rate <= 180): raise ValueError("Heart rate must be between 40 and 180 bpm")
+    for field, low, high, error in HEALTH_DATA_BOUNDS:
+        if not (low <= getattr(data, field) <= high): raise ValueError(error)
+
+def validate_health_batch(samples):
+    # Returns one error message (or None) per row, reporting the first failed bound like validate_health_data
+    lows = np.array([low for _, low, _, _ in HEALTH_DATA_BOUNDS])
+    highs = np.array([high for _, _, high, _ in HEALTH_DATA_BOUNDS])
+    failed = ~((samples >= lows) & (samples <= highs))
+    first_failed = failed.argmax(axis=1)
+    errors = [None] * len(samples)
+    for row in np.flatnonzero(failed.any(axis=1)):
+        errors[row] = HEALTH_DATA_BOUNDS[first_failed[row]][3]
+    return errors
+
+def _parse_health_record(record):
+    # A HealthData row as a list of floats, or the reason it isn't one
+    try:
+        data = HealthData.model_validate(record)
+    except ValidationError as e:
+        reasons = "; ".join(
+            f"{'.'.join(map(str, error['loc']))}: {error['msg']}" if error["loc"] else error["msg"] for error in e.errors()
+        )
+        return None, f"Invalid record: {reasons}"
+    return [getattr(data, field) for field in HEALTH_DATA_FIELDS], None
+
+def health_batch_to_array(batch: HealthDataBatch):
+    """Returns the rows as an array plus a parse error (or None) per row; rows that failed are NaN."""
+    if (batch.records is None) == (batch.columns is None):
+        raise ValueError("Provide exactly one of 'records' or 'columns'")
+    if batch.records is not None:
+        samples = np.full((len(batch.records), len(HEALTH_DATA_FIELDS)), np.nan)
+        errors = []
+        for i, record in enumerate(batch.records):
+            row, error = _parse_health_record(record)
+            if row is not None:
+                samples[i] = row
+            errors.append(error)
+        return samples, errors
+    missing = [field for field in HEALTH_DATA_FIELDS if field not in batch.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    lengths = {len(batch.columns[field]) for field in HEALTH_DATA_FIELDS}
+    if len(lengths) > 1:
+        raise ValueError("All columns must have the same length")
+    samples = np.array([batch.columns[field] for field in HEALTH_DATA_FIELDS], dtype=np.float64).T.reshape(-1, len(HEALTH_DATA_FIELDS))
+    return samples, [None] * len(samples)
+
+# FetalHealthData fields in the same order as fetus_health.important_features (the CSV column names)
+FETAL_DATA_FIELDS = [
+    "baseline_value", "accelerations", "uterine_contractions", "prolongued_decelerations",
+    "mean_value_of_short_term_variability", "histogram_mean", "histogram_variance",
+]
+FETAL_DATA_BOUNDS = [
+    ("baseline_value", 100, 200, "Baseline value must be between 100 and 200"),
+    ("accelerations", 0, 1, "Accelerations must be between 0 and 1"),
+    ("uterine_contractions", 0, 1, "Uterine contractions must be between 0 and 1"),
+    ("prolongued_decelerations", 0, 1, "Prolongued decelerations must be between 0 and 1"),
+]
 
 def validate_fetal_data(data: FetalHealthData):
-    if not (100 <= data.baseline_value <= 200): raise ValueError("Baseline value must be between 100 and 200")
-    if not (0 <= data.accelerations <= 1): raise ValueError("Accelerations must be between 0 and 1")
-    if not (0 <= data.uterine_contractions <= 1): raise ValueError("Uterine contractions must be between 0 and 1")
-    if not (0 <= data.prolongued_decelerations <= 1): raise ValueError("Prolongued decelerations must be between 0 and 1")
+    for field, low, high, error in FETAL_DATA_BOUNDS:
+        if not (low <= getattr(data, field) <= high): raise ValueError(error)
+
+def validate_fetal_batch(samples):
+    columns = [FETAL_DATA_FIELDS.index(field) for field, _, _, _ in FETAL_DATA_BOUNDS]
+    lows = np.array([low for _, low, _, _ in FETAL_DATA_BOUNDS])
+    highs = np.array([high for _, _, high, _ in FETAL_DATA_BOUNDS])
+    values = samples[:, columns]
+    failed = ~((values >= lows) & (values <= highs))
+    first_failed = failed.argmax(axis=1)
+    errors = [None] * len(samples)
+    for row in np.flatnonzero(failed.any(axis=1)):
+        errors[row] = FETAL_DATA_BOUNDS[first_failed[row]][3]
+    return errors
 
 @app.post("/sos")
-async def send_sos(request: SOSRequest):
+async def send_sos(request: SOSRequest, idempotency_key: Optional[str] = Header(None)):
+    # Everything before the handler ran: reading the body and pydantic parsing
+    server_timing.record_since_start("parsing")
     logger.info(f"Received SOS request: {request}")
     try:
-        account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-        auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-        from_number = os.getenv("TWILIO_PHONE_NUMBER")
-        
+        account_sid, auth_token, from_number = sos_alerts.credentials()
+
         logger.info(f"TWILIO_ACCOUNT_SID: {'Set' if account_sid else 'Not set'}")
         logger.info(f"TWILIO_AUTH_TOKEN: {'Set' if auth_token else 'Not set'}")
         logger.info(f"TWILIO_PHONE_NUMBER: {'Set' if from_number else 'Not set'}")
 
         if account_sid and auth_token and from_number:
-            client = Client(account_sid, auth_token)
-            sent_messages = []
-            for contact in request.emergency_contacts:
-                maps_link = f"https://www.google.com/maps?q={request.latitude},{request.longitude}"
-                message_body = f"EMERGENCY ALERT: Help needed at Latitude: {request.latitude}, Longitude: {request.longitude}! View location: {maps_link}"
-                try:
-                    message = client.messages.create(body=message_body, from_=from_number, to=contact)
-                    logger.info(f"Alert queued for {contact}, SID: {message.sid}")
-                    import time
-                    time.sleep(5)
-                    updated_message = client.messages(message.sid).fetch()
-                    status = updated_message.status
-                    logger.info(f"Message status for {contact}: {status}")
-                    sent_messages.append({"contact": contact, "sid": message.sid, "status": status})
-                except Exception as e:
-                    logger.error(f"Failed to send alert to {contact}: {str(e)}")
-                    sent_messages.append({"contact": contact, "error": str(e)})
-            all_delivered = all(msg.get("status") == "delivered" for msg in sent_messages if "status" in msg)
+            # Returns once the alert is safely in the outbox; the dispatcher sends it straight away
+            alert, created = await sos_sender.submit(
+                request.emergency_contacts, request.latitude, request.longitude, idempotency_key
+            )
+            snapshot = alert.snapshot()
             return {
-                "message": "SOS alert processed",
-                "sent_messages": sent_messages,
+                "message": "SOS alert processed" if created else "SOS alert already in progress",
+                "alert_id": alert.alert_id,
+                "duplicate": not created,
+                "sent_messages": snapshot["messages"],
                 "simulated": False,
-                "all_delivered": all_delivered
+                "all_delivered": snapshot["all_delivered"],
+                # Live delivery status, pushed as it changes
+                "events_url": f"/sos/events?alert_id={alert.alert_id}",
             }
         else:
             logger.info("Twilio credentials not found, simulating message")
@@ -127,52 +422,312 @@ async def send_sos(request: SOSRequest):
         logger.error(f"Failed to process SOS request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to send SOS alert: {str(e)}")
 
+@app.post("/sos/status_callback")
+async def sos_status_callback(request: Request, x_twilio_signature: Optional[str] = Header(None)):
+    # Twilio posts form fields; parsed here so the endpoint needs no multipart dependency
+    params = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+    # The signature covers the URL Twilio was given, which may differ from ours behind a proxy
+    url = sos_sender.callback_url or str(request.url)
+    try:
+        await sos_sender.handle_callback(params, url, x_twilio_signature)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    return Response(status_code=204)
+
+async def _get_alert(alert_id):
+    alert = await sos_sender.get_alert(alert_id)
+    if alert is None:
+        raise HTTPException(status_code=404, detail=f"Unknown alert '{alert_id}'")
+    # Callbacks may have reached another worker
+    await sos_sender.refresh(alert)
+    return alert
+
+@app.get("/sos/status")
+async def sos_status(alert_id: str, version: Optional[int] = None, wait: float = 0):
+    # Long-poll: with the last seen version, holds the request until something changes
+    alert = await _get_alert(alert_id)
+    if version is not None and wait > 0:
+        await sos_sender.wait(alert, version, min(wait, SOS_MAX_WAIT))
+    return alert.snapshot()
+
+@app.get("/sos/events")
+async def sos_events(alert_id: str):
+    alert = await _get_alert(alert_id)
+
+    async def events():
+        # One `status` event per change, comments to keep idle connections open; ends once every message is final
+        version = None
+        while True:
+            if alert.version != version:
+                snapshot = alert.snapshot()
+                version = snapshot["version"]
+                yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+                if snapshot["done"]:
+                    return
+            else:
+                yield ": keepalive\n\n"
+            await sos_sender.wait(alert, version, SOS_EVENTS_KEEPALIVE)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/chat")
 async def chat_with_janani(request: ChatRequest):
+    server_timing.record_since_start("parsing")
     try:
-        formatted_question = f"As a maternal health assistant named Janani, please answer: {request.question}"
         try:
-            response = ollama.chat(model="mistral", messages=[{"role": "user", "content": formatted_question}])
-            return {"answer": response['message']['content']}
+            return {"answer": await janani.answer(request.question)}
+        except janani.ChatBusy:
+            raise
         except Exception as e:
             logger.error(f"Ollama error: {e}")
             return {"answer": f"Sorry, I couldn’t process your request: {str(e)}"}
+    except janani.ChatBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(janani.CHAT_RETRY_AFTER)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat request: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_with_janani_stream(request: ChatRequest):
+    server_timing.record_since_start("parsing")
+    # Turned away before the stream starts, so clients see a plain 503 when the line is full
+    try:
+        flight = janani.open_answer(request.question)
+    except janani.ChatBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(janani.CHAT_RETRY_AFTER)})
+
+    async def events():
+        # `queued` events with the place in line while waiting for Ollama, `token` events as it
+        # generates, then `done` with the full answer (or `error`)
+        try:
+            async for kind, value in flight.follow():
+                if kind == "queued":
+                    yield f"event: queued\ndata: {json.dumps({'position': value})}\n\n"
+                else:
+                    yield f"event: token\ndata: {json.dumps({'content': value})}\n\n"
+        except Exception as e:
+            logger.error(f"Ollama error: {e}")
+            error = f"Sorry, I couldn’t process your request: {str(e)}"
+            yield f"event: error\ndata: {json.dumps({'error': error})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'answer': flight.text})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/predict_risk")
 async def predict_risk_endpoint(data: HealthData):
+    server_timing.record_since_start("parsing")
     try:
-        validate_health_data(data)
-        risk_level, recommendations, _ = predict_risk(
-            data.age, data.systolic_bp, data.diastolic_bp, data.bs, data.body_temp, data.heart_rate
+        with metrics.stage("validation"):
+            validate_health_data(data)
+        initializer.require(risk_management.MODEL_NAME)
+        features = [getattr(data, field) for field in HEALTH_DATA_FIELDS]
+        risk_level, recommendations = await cached_prediction(
+            risk_cache, risk_batcher, risk_management.model_version, features
         )
         return {"risk_level": risk_level, "recommendations": recommendations}
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
+    except inference_executor.ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except model_init.ModelWarmingUp as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in risk prediction: {str(e)}")
 
+@app.post("/predict_risk/batch")
+async def predict_risk_batch_endpoint(batch: HealthDataBatch):
+    server_timing.record_since_start("parsing")
+    try:
+        if batch.records is not None and len(batch.records) > MAX_BATCH_ROWS:
+            raise ValueError(f"Batch has {len(batch.records)} rows, the maximum is {MAX_BATCH_ROWS}")
+        with metrics.stage("validation"):
+            samples, parse_errors = health_batch_to_array(batch)
+            if len(samples) > MAX_BATCH_ROWS:
+                raise ValueError(f"Batch has {len(samples)} rows, the maximum is {MAX_BATCH_ROWS}")
+            # A row that didn't parse reports that, not the bound its NaNs fail
+            errors = [parse or bound for parse, bound in zip(parse_errors, validate_health_batch(samples))]
+        valid_rows = [i for i, error in enumerate(errors) if error is None]
+        predictions = {}
+        if valid_rows:
+            initializer.require(risk_management.MODEL_NAME)
+            risk_levels, recommendations = await inference.run(predict_risk_batch, samples[valid_rows])
+            predictions = dict(zip(valid_rows, zip(risk_levels, recommendations)))
+        results = []
+        for i, error in enumerate(errors):
+            if error is None:
+                risk_level, recommendation = predictions[i]
+                results.append({"index": i, "risk_level": risk_level, "recommendations": recommendation})
+            else:
+                results.append({"index": i, "error": error})
+        return {"results": results, "count": len(results), "error_count": len(results) - len(valid_rows)}
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except inference_executor.ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except model_init.ModelWarmingUp as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error in batch risk prediction: {str(e)}")
+
 @app.post("/predict_fetal_health")
 async def predict_fetal_health_endpoint(data: FetalHealthData):
+    server_timing.record_since_start("parsing")
     try:
-        validate_fetal_data(data)
-        fetal_health_status = predict_fetal_health([
-            data.baseline_value, data.accelerations, data.uterine_contractions,
-            data.prolongued_decelerations, data.mean_value_of_short_term_variability,
-            data.histogram_mean, data.histogram_variance
-        ])
+        with metrics.stage("validation"):
+            validate_fetal_data(data)
+        initializer.require(fetus_health.MODEL_NAME)
+        features = [getattr(data, field) for field in FETAL_DATA_FIELDS]
+        fetal_health_status = await cached_prediction(
+            fetal_cache, fetal_batcher, fetus_health.model_version, features
+        )
         return {"fetal_health": fetal_health_status}
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
+    except inference_executor.ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except model_init.ModelWarmingUp as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in fetal health prediction: {str(e)}")
 
+@app.post("/predict_fetal_health/bulk")
+async def predict_fetal_health_bulk_endpoint(request: Request, format: Optional[str] = None):
+    # Body is CSV (header row, same columns as data/fetal_health.csv) or NDJSON records;
+    # results stream back as NDJSON, one line per input row, while the upload is still arriving
+    try:
+        bulk_upload.check_size(request.headers.get("content-length"))
+        fmt = bulk_upload.detect_format(request.headers.get("content-type"), format)
+        chunks = await bulk_upload.open_upload(
+            request.stream(), fmt, fetus_health.important_features,
+            aliases=dict(zip(FETAL_DATA_FIELDS, fetus_health.important_features)),
+        )
+        initializer.require(fetus_health.MODEL_NAME)
+    except bulk_upload.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except model_init.ModelWarmingUp as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error in bulk fetal health prediction: {str(e)}")
+
+    async def results():
+        try:
+            async for first_row, samples, errors in chunks:
+                with metrics.stage("validation"):
+                    bound_errors = validate_fetal_batch(samples)
+                errors = [error or bound_error for error, bound_error in zip(errors, bound_errors)]
+                valid_rows = [i for i, error in enumerate(errors) if error is None]
+                statuses = iter(await inference.run(predict_fetal_health_batch, samples[valid_rows]))
+                lines = []
+                for i, error in enumerate(errors):
+                    result = {"row": first_row + i, "error": error} if error else {"row": first_row + i, "fetal_health": next(statuses)}
+                    lines.append(json.dumps(result) + "\n")
+                yield "".join(lines)
+        except Exception as e:
+            logger.error(f"Bulk fetal health scoring failed: {e}")
+            yield json.dumps({"error": f"Error in bulk fetal health prediction: {str(e)}"}) + "\n"
+
+    return bulk_upload.DuplexStreamingResponse(bulk_upload.spooled(results()), media_type="application/x-ndjson")
+
+def check_admin_token(x_admin_token):
+    # Admin endpoints stay closed until a token is configured
+    admin_token = os.getenv("HERHEALTH_ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set HERHEALTH_ADMIN_TOKEN to enable them")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/reload")
+async def reload_models(model: Optional[str] = None, version: Optional[str] = None,
+                        x_admin_token: Optional[str] = Header(None)):
+    # Loads LATEST (or `version`) of one model, or of both when `model` is omitted
+    check_admin_token(x_admin_token)
+    if version and not model:
+        raise HTTPException(status_code=400, detail="A version can only be given together with a model")
+    try:
+        names = [model] if model else list(reloader.models)
+        return {"results": [await reloader.reload(name, version) for name in names]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        # Loading errors can name files on the server; the details go to the log only
+        logger.error(f"Reloading models failed: {e}")
+        raise HTTPException(status_code=500, detail="Error reloading models, see the server log")
+
+@app.post("/admin/profile")
+async def start_profile(mode: str = "sample", seconds: float = 30, fraction: float = 1.0,
+                        routes: Optional[str] = None, interval_ms: float = profiler.SAMPLE_INTERVAL_MS,
+                        x_admin_token: Optional[str] = Header(None)):
+    # Profiles this worker for `seconds`: "sample" takes stack samples of every thread, "cprofile"
+    # profiles `fraction` of the requests to the comma-separated `routes` (default all)
+    check_admin_token(x_admin_token)
+    try:
+        route_list = [route.strip() for route in routes.split(",") if route.strip()] if routes else []
+        session = profiling.start(mode=mode, seconds=seconds, fraction=fraction, routes=route_list,
+                                  interval_ms=interval_ms)
+        return session.status()
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/admin/profile")
+async def get_profile(x_admin_token: Optional[str] = Header(None)):
+    check_admin_token(x_admin_token)
+    return profiling.status()
+
+@app.delete("/admin/profile")
+async def stop_profile(x_admin_token: Optional[str] = Header(None)):
+    check_admin_token(x_admin_token)
+    # Joins the sampler thread and writes the profile, so it runs off the event loop
+    await asyncio.to_thread(profiling.stop)
+    return profiling.status()
+
+@app.get("/models")
+async def get_models():
+    return reloader.status()
+
+@app.get("/ready")
+async def ready():
+    # Readiness (unlike /test, the liveness check) waits for both models
+    return JSONResponse(initializer.status(), status_code=200 if initializer.ready() else 503)
+
+@app.get("/startup_timings")
+async def get_startup_timings():
+    return {"timings_ms": startup_timings}
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    return {"risk": risk_cache.stats(), "fetal": fetal_cache.stats(), "chat": janani.answer_cache.stats()}
+
+@app.get("/executor_stats")
+async def get_executor_stats():
+    return {"inference": inference.stats()}
+
+@app.get("/chat_stats")
+async def get_chat_stats():
+    return janani.stats()
+
+@app.get("/microbatch_stats")
+async def get_microbatch_stats():
+    return {"risk": risk_batcher.stats(), "fetal": fetal_batcher.stats()}
+
+@app.get("/sos_stats")
+async def get_sos_stats():
+    return await sos_sender.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/test")
 async def test():
     logger.info("Test endpoint called")
     return {"message": "Server is alive!"}
 
 if __name__ == "__main__":
+    import uvicorn
+    load_environment()
     port = int(os.getenv("PORT", 8000)) # Default to 8000 if PORT not set
     uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
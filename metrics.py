@@ -0,0 +1,221 @@
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+
+import server_timing
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("HERHEALTH_METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+# Upper bounds in seconds; from sub-millisecond cache hits to multi-second Ollama answers
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Distinct paths whose route is remembered; with no path parameters in the API this is never reached
+ROUTE_CACHE_SIZE = 1024
+UNMATCHED_ROUTE = "<unmatched>"
+
+# Every metric created, in order, for rendering
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Optional callable returning {labels: value}, read at scrape time instead of stored values
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                return [(self.name, labels, value) for labels, value in self.function().items()]
+            except Exception as e:
+                logger.error(f"Failed to collect {self.name}: {e}")
+                return []
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value, *extra in self.samples():
+            lines.append(f"{name}{_labels(self.labelnames, labels, *extra)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # Per-bucket counts; they are made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        samples = []
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", labels, cumulative, f'le="{_number(float(bound))}"'))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUESTS = Counter("herhealth_http_requests_total", "HTTP requests handled.", ["route", "method", "status"])
+IN_FLIGHT = Gauge("herhealth_http_requests_in_flight", "HTTP requests being handled.", ["route"])
+REQUEST_SECONDS = Histogram(
+    "herhealth_http_request_duration_seconds", "Time to handle an HTTP request, including streaming the body.",
+    ["route", "method"],
+)
+STAGE_SECONDS = Histogram(
+    "herhealth_stage_duration_seconds",
+    "Time spent in one stage of request handling (validation, scaling, forest_inference, "
+    "label_decoding, chat_queue, ollama_first_token, ollama_generation, twilio_send, twilio_status_fetch).",
+    ["stage"],
+)
+
+
+def observe_stage(name, seconds):
+    """Record a stage timed by hand, e.g. one that ends inside a streamed response."""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, name)
+    server_timing.record(name, seconds)
+
+
+class stage:
+    """Time a block as a request stage: `with metrics.stage("validation"): ...`.
+
+    The duration goes to the stage histogram and to the current request's
+    Server-Timing spans.
+    """
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def _route_name(scope):
+    from starlette.routing import Match
+
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", ()):
+        match, _ = route.matches(scope)
+        # PARTIAL is a path match with the wrong method, still the same route
+        if match != Match.NONE:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    # Counts, in-flight gauges and latency per route template; the route is looked up once per path
+    def __init__(self, app):
+        self.app = app
+        self._routes = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        route = self._routes.get(path)
+        if route is None:
+            route = _route_name(scope)
+            if route != UNMATCHED_ROUTE and len(self._routes) < ROUTE_CACHE_SIZE:
+                self._routes[path] = route
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc(route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route, method)
+            IN_FLIGHT.dec(route)
+            REQUESTS.inc(route, method, str(status))
@@ -0,0 +1,134 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+
+import numpy as np
+
+import server_timing
+
+logger = logging.getLogger(__name__)
+
+MICROBATCH_ENABLED = os.getenv("HERHEALTH_MICROBATCH_ENABLED", "1").lower() in ("1", "true", "yes")
+MICROBATCH_MAX_SIZE = int(os.getenv("HERHEALTH_MICROBATCH_MAX_SIZE", 64))
+# Upper bound on how long a request may wait for others to join its batch
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("HERHEALTH_MICROBATCH_MAX_WAIT_MS", 2.0))
+
+# Weight of the newest inter-arrival gap in the moving average
+_GAP_SMOOTHING = 0.2
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-row predictions into one batched forest call.
+
+    `predict_batch` takes a (rows, features) array and returns (or, if it is a
+    coroutine function, resolves to) one result per row. The collection window
+    adapts to the arrival rate: when requests are further apart than the
+    maximum wait, a request is scored on the next loop iteration (no added
+    latency); under load the window stretches to the time the batch is
+    expected to take to fill, capped at the maximum wait.
+    """
+
+    def __init__(self, name, predict_batch, max_size=MICROBATCH_MAX_SIZE,
+                 max_wait=MICROBATCH_MAX_WAIT_MS / 1000, enabled=MICROBATCH_ENABLED):
+        self.name = name
+        self.predict_batch = predict_batch
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._pending = []
+        self._flush_handle = None
+        self._last_arrival = None
+        self._gap = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.last_window = 0.0
+        self._tasks = set()
+
+    def _window(self):
+        if self._gap is None or self._gap >= self.max_wait:
+            return 0.0
+        return min(self.max_wait, self._gap * (self.max_size - len(self._pending)))
+
+    def _record_arrival(self):
+        now = time.monotonic()
+        if self._last_arrival is not None:
+            gap = now - self._last_arrival
+            self._gap = gap if self._gap is None else (1 - _GAP_SMOOTHING) * self._gap + _GAP_SMOOTHING * gap
+        self._last_arrival = now
+
+    async def submit(self, features):
+        if not self.enabled:
+            return (await self._predict(np.asarray([features], dtype=np.float64)))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._record_arrival()
+        self._pending.append((features, future, server_timing.current()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self.last_window = self._window()
+            if self.last_window > 0:
+                self._flush_handle = loop.call_later(self.last_window, self._flush)
+            else:
+                # Still lets requests that arrive in the same loop iteration share the call
+                self._flush_handle = loop.call_soon(self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+        if self._pending:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+        # Requests cancelled while waiting (client went away) don't need scoring
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        task = asyncio.ensure_future(self._score(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _predict(self, samples):
+        results = self.predict_batch(samples)
+        if inspect.isawaitable(results):
+            results = await results
+        return results
+
+    async def _score(self, batch):
+        # The batch's stages are recorded once here, then shared by every request in it
+        batch_timing = server_timing.collect()
+        try:
+            results = await self._predict(np.asarray([features for features, _, _ in batch], dtype=np.float64))
+        except Exception as e:
+            logger.error(f"{self.name} batched prediction failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, timing), result in zip(batch, results):
+            if timing is not None:
+                timing.spans.extend(batch_timing.spans)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "max_size": self.max_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "last_window_ms": self.last_window * 1000,
+            "pending": len(self._pending),
+        }
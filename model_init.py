@@ -0,0 +1,116 @@
+import asyncio
+import concurrent.futures
+import logging
+import math
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+STATES = ("pending", "loading", "ready", "failed")
+# A failed model is initialized again on the first request after this long, doubling up to the max
+RETRY_BACKOFF = float(os.getenv("HERHEALTH_MODEL_INIT_RETRY", 5))
+RETRY_BACKOFF_MAX = float(os.getenv("HERHEALTH_MODEL_INIT_RETRY_MAX", 300))
+
+
+class ModelWarmingUp(RuntimeError):
+    # retry_after: whole seconds a client should wait before trying again
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelInitializer:
+    """Bring models up in the background, each in its own process, and track readiness.
+
+    Each registered model provides `prepare()`, run in a child process to train
+    or validate the stored model and return the version to serve, plus
+    `load(version)` and `activate(bundle)`, which then load that version into
+    this process from the model store (fast, the expensive part already ran).
+    """
+
+    def __init__(self, timings=None):
+        self.models = {}
+        self.states = {}
+        self.timings = timings if timings is not None else {}
+        self._tasks = {}
+        self._pool = None
+
+    def register(self, name, prepare, load, activate):
+        self.models[name] = (prepare, load, activate)
+        self.states[name] = {
+            "state": "pending", "version": None, "error": None, "elapsed_ms": None, "attempts": 0, "retry_at": None,
+        }
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Spawned rather than forked: the server process already runs an event loop and threads
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                len(self.models), mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def start(self, names=None):
+        for name in names or self.models:
+            if name not in self._tasks:
+                self.states[name]["state"] = "loading"
+                self._tasks[name] = asyncio.create_task(self._initialize(name))
+
+    async def _initialize(self, name):
+        prepare, load, activate = self.models[name]
+        state = self.states[name]
+        state["attempts"] += 1
+        started = time.perf_counter()
+        try:
+            version = await asyncio.get_running_loop().run_in_executor(self._get_pool(), prepare)
+            bundle = await asyncio.to_thread(load, version)
+            # A hot reload that finished first already activated a newer version
+            if state["state"] != "ready":
+                activate(bundle)
+                state.update(state="ready", version=version, error=None, retry_at=None)
+                logger.info(f"{name} model version {version} ready")
+        except Exception as e:
+            delay = min(RETRY_BACKOFF * 2 ** (state["attempts"] - 1), RETRY_BACKOFF_MAX)
+            state.update(state="failed", error=str(e), retry_at=time.time() + delay)
+            logger.error(f"Failed to initialize {name} model (attempt {state['attempts']}, retrying after {delay:g}s): {e}")
+            # Lets require() start it again once the backoff has passed
+            self._tasks.pop(name, None)
+        finally:
+            state["elapsed_ms"] = (time.perf_counter() - started) * 1000
+            self.timings[f"{name}_model"] = state["elapsed_ms"]
+            # The child processes are only needed for startup
+            if self._pool is not None and all(task.done() or task is asyncio.current_task() for task in self._tasks.values()):
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def require(self, name):
+        """Raise unless `name` is ready to serve; starts initializing it if nothing has yet."""
+        state = self.states[name]
+        if state["state"] == "ready":
+            return
+        if state["state"] == "failed" and time.time() < state["retry_at"]:
+            # Still retryable, so clients get the same 503 as while loading, told to come back after the backoff
+            retry_after = max(1, math.ceil(state["retry_at"] - time.time()))
+            raise ModelWarmingUp(
+                f"The {name} model failed to initialize, retrying in {retry_after}s", retry_after=retry_after
+            )
+        self.start([name])
+        raise ModelWarmingUp(f"The {name} model is warming up, please retry shortly")
+
+    def mark_ready(self, name, version):
+        # Called when a reload activates a version, which fixes a failed or outdated state
+        self.states[name].update(state="ready", version=version, error=None, retry_at=None)
+
+    def ready(self):
+        return all(state["state"] == "ready" for state in self.states.values())
+
+    def status(self):
+        return {"ready": self.ready(), "models": self.states}
+
+    def shutdown(self):
+        for task in self._tasks.values():
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+import time
+
+import model_store
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of each model's LATEST pointer; 0 disables the watcher
+WATCH_INTERVAL = float(os.getenv("HERHEALTH_MODEL_WATCH_INTERVAL", 5))
+# Completed reloads kept for /models
+HISTORY_SIZE = 20
+
+
+class ModelReloader:
+    """Load new model versions in the background and swap them in atomically.
+
+    Each registered model provides `load(version)` returning an immutable
+    bundle, `warm_up(bundle)`, `activate(bundle)` and `current()` (the active
+    version). Loading and warm-up run on a worker thread; activation is a single
+    assignment on the event loop, so requests that already hold the old bundle
+    finish on it and every later request sees the new one.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.listeners = []
+        self.history = []
+        self.last_error = {}
+        self._seen_latest = {}
+        self._locks = {}
+
+    def register(self, name, load, warm_up, activate, current):
+        self.models[name] = (load, warm_up, activate, current)
+        self._locks[name] = asyncio.Lock()
+
+    def add_listener(self, callback):
+        # callback(name, bundle) runs right after a new bundle is activated
+        self.listeners.append(callback)
+
+    def _prepare(self, name, version):
+        load, warm_up, _, _ = self.models[name]
+        bundle = load(version)
+        warm_up(bundle)
+        return bundle
+
+    async def reload(self, name, version=None):
+        if name not in self.models:
+            raise ValueError(f"Unknown model '{name}', expected one of: {', '.join(self.models)}")
+        _, _, activate, current = self.models[name]
+        async with self._locks[name]:
+            version = version or model_store.latest_version(name)
+            if version is None:
+                raise ValueError(f"No saved versions for model '{name}'")
+            # Only a version saved under this model's directory, never a path the caller made up
+            if version not in model_store.list_versions(name):
+                raise ValueError(f"Unknown version '{version}' of model '{name}'")
+            previous = current()
+            if version == previous:
+                return {"model": name, "version": version, "reloaded": False}
+
+            started = time.perf_counter()
+            try:
+                bundle = await asyncio.to_thread(self._prepare, name, version)
+            except Exception as e:
+                # /models is public, so it only shows the kind of error
+                logger.error(f"Loading {name} model version {version} failed: {e}")
+                self.last_error[name] = f"{version}: {type(e).__name__}"
+                raise
+            activate(bundle)
+            for callback in self.listeners:
+                callback(name, bundle)
+
+            record = {
+                "model": name,
+                "version": version,
+                "previous_version": previous,
+                "reloaded": True,
+                "load_ms": (time.perf_counter() - started) * 1000,
+                "activated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            }
+            self.history = (self.history + [record])[-HISTORY_SIZE:]
+            self.last_error.pop(name, None)
+            logger.info(f"Swapped {name} model {previous} -> {version} in {record['load_ms']:.0f} ms")
+            return record
+
+    async def watch(self, interval=WATCH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            for name, (_, _, _, current) in self.models.items():
+                active = current()
+                # Models that haven't been loaded yet pick up LATEST when they are
+                if active is None:
+                    continue
+                # Only a move of LATEST triggers a reload, so a version pinned through
+                # /admin/reload stays active and a failed version isn't retried
+                latest = model_store.latest_version(name)
+                if latest is None or latest == self._seen_latest.get(name):
+                    continue
+                self._seen_latest[name] = latest
+                if latest == active:
+                    continue
+                try:
+                    await self.reload(name, latest)
+                except Exception as e:
+                    logger.error(f"Reloading {name} model version {latest} failed: {e}")
+
+    def status(self):
+        return {
+            "models": {
+                name: {
+                    "active_version": current(),
+                    "latest_version": model_store.latest_version(name),
+                    "last_error": self.last_error.get(name),
+                }
+                for name, (_, _, _, current) in self.models.items()
+            },
+            "history": self.history,
+        }
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Get the directory where the script is located
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# Trained artifacts live in models/<model name>/<version>/, with a LATEST pointer per model
+models_dir = os.getenv("HERHEALTH_MODELS_DIR", os.path.join(script_dir, "models"))
+
+MANIFEST_FILE = "manifest.json"
+LATEST_FILE = "LATEST"
+
+
+def sklearn_version():
+    # Read from package metadata: importing sklearn just for its version takes ~1.5 s
+    from importlib.metadata import version
+    return version("scikit-learn")
+
+
+def dataset_hash(csv_path):
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _model_dir(name):
+    return os.path.join(models_dir, name)
+
+
+def case_store_path(name):
+    # Labeled cases collected after training, appended to by incremental updates
+    return os.path.join(_model_dir(name), "cases.csv")
+
+
+def _write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def save_artifacts(name, artifacts, manifest):
+    """Write a new version of `name` and point LATEST at it. Returns the version id."""
+    import joblib
+    import sklearn
+
+    os.makedirs(_model_dir(name), exist_ok=True)
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{manifest['dataset_hash'][:8]}"
+    suffix = 1
+    while os.path.exists(os.path.join(_model_dir(name), version)):
+        suffix += 1
+        version = f"{version.split('.')[0]}.{suffix}"
+
+    # Build the version in a scratch directory so readers never see a half-written one
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=_model_dir(name))
+    try:
+        for key, obj in artifacts.items():
+            joblib.dump(obj, os.path.join(tmp_dir, f"{key}.joblib"))
+        manifest = dict(manifest)
+        manifest.update({
+            "name": name,
+            "version": version,
+            "artifacts": sorted(artifacts),
+            "sklearn_version": sklearn.__version__,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        })
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.rename(tmp_dir, os.path.join(_model_dir(name), version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    _write_atomic(os.path.join(_model_dir(name), LATEST_FILE), version)
+    logger.info(f"Saved {name} model version {version}")
+    return version
+
+
+def latest_version(name):
+    try:
+        with open(os.path.join(_model_dir(name), LATEST_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(name):
+    if not os.path.isdir(_model_dir(name)):
+        return []
+    return sorted(
+        entry for entry in os.listdir(_model_dir(name))
+        if os.path.isfile(os.path.join(_model_dir(name), entry, MANIFEST_FILE))
+    )
+
+
+def read_manifest(name, version):
+    with open(os.path.join(_model_dir(name), version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def load_artifacts(name, version=None, skip=()):
+    import joblib
+
+    version = version or latest_version(name)
+    if version is None:
+        raise FileNotFoundError(f"No saved versions for model '{name}' in {models_dir}")
+    manifest = read_manifest(name, version)
+    version_dir = os.path.join(_model_dir(name), version)
+    artifacts = {
+        key: joblib.load(os.path.join(version_dir, f"{key}.joblib"))
+        for key in manifest["artifacts"] if key not in skip
+    }
+    return artifacts, manifest
+
+
+def save_arrays(name, version, group, arrays, meta):
+    """Attach plain .npy arrays (plus a small JSON meta file) to an existing version under `group`/.
+
+    Arrays stored this way can be memory-mapped, so every process on the host
+    shares one copy of the pages. Concurrent writers are fine: the first
+    complete directory wins.
+    """
+    import numpy as np
+
+    version_dir = os.path.join(_model_dir(name), version)
+    target = os.path.join(version_dir, group)
+    if os.path.isdir(target):
+        return
+    tmp_dir = tempfile.mkdtemp(prefix=f".tmp-{group}-", dir=version_dir)
+    try:
+        for key, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{key}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump({"arrays": sorted(arrays), "meta": meta}, f, indent=2, sort_keys=True)
+        os.rename(tmp_dir, target)
+    except OSError:
+        # Another process published the same group first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+
+
+def load_arrays(name, version, group, mmap_mode="r"):
+    """Return (arrays, meta) saved by save_arrays, memory-mapped by default, or None if absent."""
+    import numpy as np
+
+    group_dir = os.path.join(_model_dir(name), version, group)
+    try:
+        with open(os.path.join(group_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    arrays = {
+        key: np.load(os.path.join(group_dir, f"{key}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        for key in manifest["arrays"]
+    }
+    return arrays, manifest["meta"]
+
+
+def current_version(name, data_hash):
+    """Return the latest version of `name` if it was trained on `data_hash` with this sklearn, else None."""
+    version = latest_version(name)
+    if version is None:
+        return None
+    try:
+        manifest = read_manifest(name, version)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.warning(f"Unreadable manifest for {name} version {version}: {e}")
+        return None
+    if manifest.get("dataset_hash") != data_hash:
+        logger.info(f"{name} model {version} is stale (dataset changed), retraining")
+        return None
+    if manifest.get("sklearn_version") != sklearn_version():
+        logger.info(f"{name} model {version} was built with scikit-learn {manifest.get('sklearn_version')}, retraining")
+        return None
+    return version
+
+
+def load_if_current(name, data_hash, skip=()):
+    """Load the latest version of `name` if it is current (see current_version), else None."""
+    version = current_version(name, data_hash)
+    return None if version is None else load_artifacts(name, version, skip)
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("HERHEALTH_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+CACHE_SIZE = int(os.getenv("HERHEALTH_CACHE_SIZE", 4096))
+CACHE_TTL = float(os.getenv("HERHEALTH_CACHE_TTL", 3600))
+# Optional SQLite file shared by all workers on a node; empty disables the second tier
+CACHE_SHARED_PATH = os.getenv("HERHEALTH_CACHE_SHARED_PATH", "")
+CACHE_SHARED_SIZE = int(os.getenv("HERHEALTH_CACHE_SHARED_SIZE", 100000))
+
+_MISSING = object()
+
+
+def canonical_key(version, features):
+    # 25, 25.0 and "25" all describe the same vitals; -0.0 folds into 0.0
+    return f"{version}|" + ",".join(repr(float(x) + 0.0) for x in features)
+
+
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteCache:
+    """A cache table in a local SQLite file, so gunicorn workers can reuse each other's results."""
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path, table, max_size, ttl):
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+
+    def _connection(self):
+        # Opened on first use so importing the API never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=0.5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    f"SELECT value FROM {self.table} WHERE key = ? AND expires_at >= ?", (key, time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            # The shared tier is best effort: a locked or broken file only costs a recompute
+            self.errors += 1
+            logger.warning(f"Shared cache read failed: {e}")
+            return _MISSING
+        if row is None:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time() + self.ttl),
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    self._prune(conn)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Shared cache write failed: {e}")
+
+    def _prune(self, conn):
+        removed = conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),)).rowcount
+        removed += conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        ).rowcount
+        self.evictions += max(removed, 0)
+
+    def clear(self, keep_prefix=None):
+        try:
+            with self._lock:
+                if keep_prefix is None:
+                    self._connection().execute(f"DELETE FROM {self.table}")
+                else:
+                    self._connection().execute(
+                        f"DELETE FROM {self.table} WHERE substr(key, 1, ?) != ?", (len(keep_prefix), keep_prefix)
+                    )
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Shared cache clear failed: {e}")
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "evictions": self.evictions,
+        }
+
+
+class PredictionCache:
+    """Local LRU in front of an optional shared SQLite tier, keyed on model version and features.
+
+    Results are only reused for the model version that produced them: the first
+    lookup under a new version drops everything cached for older ones.
+    """
+
+    def __init__(self, name, max_size=CACHE_SIZE, ttl=CACHE_TTL, shared_path=CACHE_SHARED_PATH, enabled=CACHE_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.local = LRUCache(max_size, ttl)
+        self.shared = SQLiteCache(shared_path, f"{name}_predictions", CACHE_SHARED_SIZE, ttl) if shared_path else None
+        self.model_version = None
+        self.invalidations = 0
+
+    def invalidate(self, model_version=None):
+        self.local.clear()
+        if self.shared is not None and model_version is not None:
+            self.shared.clear(keep_prefix=f"{model_version}|")
+        self.model_version = model_version
+        self.invalidations += 1
+        logger.info(f"{self.name} prediction cache invalidated for model version {model_version}")
+
+    def lookup(self, model_version, features):
+        """Return the cached result for `features` under `model_version`, or None."""
+        if not self.enabled:
+            return None
+        if model_version != self.model_version:
+            self.invalidate(model_version)
+
+        key = canonical_key(model_version, features)
+        value = self.local.get(key)
+        if value is not _MISSING:
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not _MISSING:
+                value = tuple(value) if isinstance(value, list) else value
+                self.local.set(key, value)
+                return value
+        return None
+
+    def store(self, model_version, features, value):
+        # A result computed by a model that has since been replaced is not kept
+        if not self.enabled or model_version != self.model_version:
+            return
+        key = canonical_key(model_version, features)
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def get_or_compute(self, model_version, features, compute):
+        value = self.lookup(model_version, features)
+        if value is None:
+            value = compute()
+            self.store(model_version, features, value)
+        return value
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "model_version": self.model_version,
+            "invalidations": self.invalidations,
+            "local": self.local.stats(),
+            "shared": self.shared.stats() if self.shared is not None else None,
+        }
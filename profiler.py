@@ -0,0 +1,236 @@
+import collections
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+PROFILE_DIR = os.getenv("HERHEALTH_PROFILE_DIR", os.path.join(script_dir, "profiles"))
+PROFILE_MODES = ("sample", "cprofile")
+SAMPLE_INTERVAL_MS = float(os.getenv("HERHEALTH_PROFILE_INTERVAL_MS", 5))
+# Requested intervals are clamped to this range; each sample walks every thread's stack
+MIN_INTERVAL_MS = 1.0
+MAX_INTERVAL_MS = 1000.0
+# Longest session an operator can start, so a forgotten one can't run forever
+MAX_SECONDS = float(os.getenv("HERHEALTH_PROFILE_MAX_SECONDS", 600))
+MAX_STACK_DEPTH = 128
+# Never profiled in cProfile mode, so stopping a session can't end up inside it
+EXCLUDED_PREFIX = "/admin/"
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def folded_stack(frame, thread_name):
+    # Root first, as flamegraph.pl, inferno and speedscope expect
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class ProfileSession:
+    """One profiling window: a stack sampler over all threads, or cProfile over selected requests.
+
+    Sampling mode wakes every `interval_ms`, records the stack of every thread
+    and writes them in folded format (`stack count` lines). cProfile mode
+    profiles a `fraction` of the requests to `routes` (all routes if empty)
+    and writes a pstats file. cProfile covers the event loop thread only, and
+    while a profiled request awaits, other requests' work on the loop is
+    included; sampling mode also sees the inference executor's threads.
+    """
+
+    def __init__(self, mode="sample", seconds=30.0, fraction=1.0, routes=(), interval_ms=SAMPLE_INTERVAL_MS,
+                 output_dir=PROFILE_DIR):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}', expected one of: {', '.join(PROFILE_MODES)}")
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"Profile duration must be between 0 and {MAX_SECONDS:g} seconds")
+        if not 0 < fraction <= 1:
+            raise ValueError("Profiled fraction must be between 0 and 1")
+        self.mode = mode
+        self.seconds = seconds
+        self.fraction = fraction
+        self.routes = frozenset(routes)
+        self.interval = min(max(interval_ms, MIN_INTERVAL_MS), MAX_INTERVAL_MS) / 1000
+        self.output_dir = output_dir
+        self.started_at = None
+        self.path = None
+        self.samples = 0
+        self.profiled_requests = 0
+        self.capturing = False
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._profile = None
+        self._active = False
+        self._thread = None
+        self._timer = None
+        self._rng = random.Random()
+
+    def start(self):
+        self.started_at = time.time()
+        if self.mode == "sample":
+            self._stacks = collections.Counter()
+            self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._thread.start()
+        else:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self.capturing = True
+            self._timer = threading.Timer(self.seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        logger.info(f"Started {self.mode} profile for {self.seconds:g}s")
+
+    def _sample(self):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self._stacks[folded_stack(frame, names.get(ident, f"thread-{ident}"))] += 1
+            self.samples += 1
+        self._write()
+
+    # cProfile mode: ProfilingMiddleware calls begin() for each request and end() if it returned True
+    def begin(self, route):
+        if route.startswith(EXCLUDED_PREFIX) or (self.routes and route not in self.routes):
+            return False
+        if self.fraction < 1 and self._rng.random() >= self.fraction:
+            return False
+        # cProfile can only follow one request at a time in a thread
+        with self._lock:
+            if self._active or self._stop.is_set():
+                return False
+            self._active = True
+        self._profile.enable()
+        return True
+
+    def end(self):
+        self._profile.disable()
+        with self._lock:
+            self._active = False
+            self.profiled_requests += 1
+            # A stop that came in while this request was profiled left the writing to us
+            finish = self._stop.is_set() and self.path is None
+        if finish:
+            self._write()
+
+    @property
+    def running(self):
+        return self.started_at is not None and self.path is None
+
+    def stop(self):
+        """End the session early (or on schedule) and write its output.
+
+        In sampling mode this waits up to one interval for the sampler to write
+        its file, so call it from a thread, not from the event loop.
+        """
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            self.capturing = False
+            write_now = self.mode == "cprofile" and not self._active
+        if self._timer is not None:
+            self._timer.cancel()
+        if write_now:
+            self._write()
+        elif self.mode == "sample" and self._thread is not threading.current_thread():
+            # The sampler writes its file as soon as it wakes up
+            self._thread.join()
+
+    def _write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(self.started_at))
+        base = os.path.join(self.output_dir, f"{stamp}-{os.getpid()}-{self.mode}")
+        if self.mode == "sample":
+            path = base + ".folded"
+            with open(path, "w") as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        else:
+            path = base + ".prof"
+            self._profile.dump_stats(path)
+        self.path = path
+        self.capturing = False
+        self._stop.set()
+        logger.info(f"Saved {self.mode} profile to {path}")
+
+    def status(self):
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "fraction": self.fraction,
+            "interval_ms": self.interval * 1000,
+            "routes": sorted(self.routes),
+            "samples": self.samples,
+            "profiled_requests": self.profiled_requests,
+            "path": self.path,
+        }
+
+
+class Profiler:
+    """Holds the current session (at most one per worker) and lists saved profiles."""
+
+    def __init__(self, output_dir=PROFILE_DIR):
+        self.output_dir = output_dir
+        self.session = None
+        self._lock = threading.Lock()
+
+    def start(self, **options):
+        with self._lock:
+            if self.session is not None and self.session.running:
+                raise RuntimeError("A profile is already running in this worker")
+            session = ProfileSession(output_dir=self.output_dir, **options)
+            session.start()
+            self.session = session
+            return session
+
+    def stop(self):
+        session = self.session
+        if session is None or not session.running:
+            return None
+        session.stop()
+        return session
+
+    def saved(self):
+        if not os.path.isdir(self.output_dir):
+            return []
+        return sorted(name for name in os.listdir(self.output_dir) if name.endswith((".folded", ".prof")))
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "session": self.session.status() if self.session is not None else None,
+            "saved": self.saved(),
+        }
+
+
+class ProfilingMiddleware:
+    # While a cProfile session runs, profiles the requests it selects; otherwise one attribute check
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        session = self.profiler.session
+        if session is None or not session.capturing or scope["type"] != "http" or not session.begin(scope["path"]):
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.end()
@@ -1,29 +1,57 @@
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.preprocessing import MinMaxScaler, LabelEncoder
+import logging
 import os
+from collections import namedtuple
+
+import forest_engine
+import metrics
+import model_store
+
+logger = logging.getLogger(__name__)
 
 # Get the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 # Construct the path to the CSV file relative to the script's directory
 csv_path = os.path.join(script_dir, "data", "Maternal_Health_Risk_Data_Set.csv")
-df = pd.read_csv(csv_path)
 
-# Global variables
+MODEL_NAME = "risk"
+selected_features = ['Age', 'SystolicBP', 'DiastolicBP', 'BS', 'BodyTemp', 'HeartRate']
+
+PARAM_GRID = {'n_estimators': [100, 200, 300], 'max_depth': [None, 10, 20, 30], 'min_samples_split': [2, 5, 10]}
+# "grid" is the exhaustive GridSearchCV, "halving" the cached successive-halving search in tuning.py
+SEARCH_MODES = ("grid", "halving")
+RISK_SEARCH = os.getenv("HERHEALTH_RISK_SEARCH", "grid")
+
+# Everything needed to serve one model version. Replaced as a whole on reload, so a
+# prediction that picked up a bundle finishes on it even if a new one is swapped in.
+RiskModel = namedtuple("RiskModel", ["version", "scaler", "forest", "label_encoder", "compiled"])
+
+# Global variables (mirror active_model)
+active_model = None
 scaler = None
 best_rf = None
 label_encoder = None
+compiled_rf = None
+model_version = None
+
+def train_risk_model(search=RISK_SEARCH):
+    # Training-only dependencies are imported here so serving never pays for them
+    import pandas as pd
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split, GridSearchCV
+    from sklearn.preprocessing import MinMaxScaler, LabelEncoder
+    from sklearn.metrics import accuracy_score
+    import joblib
+    import tuning
+
+    if search not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{search}', expected one of: {', '.join(SEARCH_MODES)}")
 
-def initialize_risk_model():
-    global scaler, best_rf, label_encoder
     df = pd.read_csv(csv_path)
     
     label_encoder = LabelEncoder()
     df['RiskLevel'] = label_encoder.fit_transform(df['RiskLevel'])
     
-    selected_features = ['Age', 'SystolicBP', 'DiastolicBP', 'BS', 'BodyTemp', 'HeartRate']
     X = df[selected_features]
     y = df['RiskLevel']
     
@@ -32,33 +60,152 @@ def initialize_risk_model():
     scaler = MinMaxScaler()
     X_train = scaler.fit_transform(X_train)
     
-    rf = RandomForestClassifier(n_estimators=100, random_state=42)
-    param_grid = {'n_estimators': [100, 200, 300], 'max_depth': [None, 10, 20, 30], 'min_samples_split': [2, 5, 10]}
-    grid_search = GridSearchCV(rf, param_grid, cv=5, n_jobs=-1)
-    grid_search.fit(X_train, y_train)
-    global best_rf
-    best_rf = grid_search.best_estimator_
-
-def predict_risk(age, systolic_bp, diastolic_bp, bs, body_temp, heart_rate):
-    global scaler, best_rf, label_encoder
-    if best_rf is None or scaler is None or label_encoder is None:
-        raise ValueError("Risk model not initialized. Call initialize_risk_model() first.")
-    sample = np.array([[age, systolic_bp, diastolic_bp, bs, body_temp, heart_rate]])
-    sample_scaled = scaler.transform(sample)
-    prediction = best_rf.predict(sample_scaled)[0]
-    risk_label = label_encoder.inverse_transform([prediction])[0]
-    
+    # Threads rather than worker processes, so the reported CPU time covers the whole search
+    with joblib.parallel_backend("threading"):
+        if search == "halving":
+            (best_params, cv_accuracy, report), wall, cpu = tuning.timed(
+                tuning.successive_halving,
+                lambda **params: RandomForestClassifier(random_state=42, **params),
+                PARAM_GRID, X_train, y_train, model_store.dataset_hash(csv_path),
+            )
+            best_rf = RandomForestClassifier(random_state=42, **best_params).fit(X_train, y_train)
+            trees, cached_fits = report["trees"], report["cached_fits"]
+        else:
+            rf = RandomForestClassifier(n_estimators=100, random_state=42)
+            grid_search = GridSearchCV(rf, PARAM_GRID, cv=5, n_jobs=-1)
+            _, wall, cpu = tuning.timed(grid_search.fit, X_train, y_train)
+            best_rf = grid_search.best_estimator_
+            best_params, cv_accuracy = grid_search.best_params_, grid_search.best_score_
+            trees, cached_fits = sum(params["n_estimators"] for params in grid_search.cv_results_["params"]) * 5, 0
+
+    metrics = {
+        "test_accuracy": float(accuracy_score(y_test, best_rf.predict(scaler.transform(X_test)))),
+        "cv_accuracy": float(cv_accuracy),
+        "best_params": best_params,
+        "search": search,
+        "search_wall_seconds": wall,
+        "search_cpu_seconds": cpu,
+        "search_trees_fitted": trees,
+        "search_cached_fits": cached_fits,
+        "n_train": len(X_train),
+        "n_test": len(X_test),
+    }
+    return {"scaler": scaler, "forest": best_rf, "label_encoder": label_encoder}, metrics
+
+def _build_model(version, artifacts):
+    compiled, forest = forest_engine.load_for_serving(MODEL_NAME, version, artifacts)
+    return RiskModel(version, forest_engine.for_arrays(artifacts["scaler"]), forest, artifacts["label_encoder"], compiled)
+
+def load_risk_model(version=None):
+    """Load a stored version (LATEST by default) without activating it."""
+    # In shared mode the sklearn forest is only loaded if no compiled copy has been published
+    skip = ("forest",) if forest_engine.SHARED_MODELS else ()
+    artifacts, manifest = model_store.load_artifacts(MODEL_NAME, version, skip)
+    return _build_model(manifest["version"], artifacts)
+
+def activate_risk_model(bundle):
+    global active_model, scaler, best_rf, label_encoder, compiled_rf, model_version
+    active_model = bundle
+    scaler, best_rf, label_encoder, compiled_rf, model_version = (
+        bundle.scaler, bundle.forest, bundle.label_encoder, bundle.compiled, bundle.version
+    )
+
+def warm_up_risk_model(bundle):
+    # Touch both engines (and any memory-mapped pages) before the bundle takes traffic
+    samples = np.tile([30, 120, 80, 5.0, 98.6, 70], (forest_engine.COMPILED_MAX_ROWS + 1, 1))
+    predict_risk_batch(samples[:1], bundle)
+    predict_risk_batch(samples, bundle)
+
+def initialize_risk_model(force_retrain=False, search=RISK_SEARCH):
+    data_hash = model_store.dataset_hash(csv_path)
+    skip = ("forest",) if forest_engine.SHARED_MODELS else ()
+    loaded = None if force_retrain else model_store.load_if_current(MODEL_NAME, data_hash, skip)
+    if loaded is not None:
+        artifacts, manifest = loaded
+        version = manifest["version"]
+        logger.info(f"Loaded risk model version {version}")
+    else:
+        artifacts, metrics = train_risk_model(search)
+        version = model_store.save_artifacts(MODEL_NAME, artifacts, {
+            "dataset_hash": data_hash,
+            "features": selected_features,
+            "classes": [str(c) for c in artifacts["label_encoder"].classes_],
+            "metrics": metrics,
+        })
+    activate_risk_model(_build_model(version, artifacts))
+
+def prepare_risk_model():
+    # Run at startup in a child process: makes sure a current version is stored (training one if
+    # needed) and returns it for the server to load
+    version = model_store.current_version(MODEL_NAME, model_store.dataset_hash(csv_path))
+    if version is None:
+        initialize_risk_model(force_retrain=True)
+        version = model_version
+    return version
+
+def update_risk_model(cases_path, mode="grow", n_trees=None, random_state=None):
+    """Fold newly labeled cases (a CSV with the training columns) into the latest version, saved as a new one."""
+    import pandas as pd
+    import incremental
+
+    artifacts, manifest = model_store.load_artifacts(MODEL_NAME)
+    encoder = artifacts["label_encoder"]
+    forest, report = incremental.update_model(
+        artifacts["forest"], artifacts["scaler"], pd.read_csv(cases_path),
+        model_store.case_store_path(MODEL_NAME), csv_path, selected_features, "RiskLevel", encoder.transform,
+        n_trees=n_trees or incremental.UPDATE_TREES, mode=mode, random_state=random_state,
+    )
+    version = model_store.save_artifacts(MODEL_NAME, {**artifacts, "forest": forest}, {
+        # Still built from the bundled dataset, so startup keeps it instead of retraining
+        "dataset_hash": manifest["dataset_hash"],
+        "features": selected_features,
+        "classes": manifest["classes"],
+        "metrics": manifest.get("metrics", {}),
+        "parent_version": manifest["version"],
+        # Passed back as --random-state, reproduces this update
+        "random_state": report["random_state"],
+        "update": report,
+    })
+    return version, report
+
+def risk_recommendation(risk_label):
     if risk_label == 'high risk':
-        message = "You are at high risk! Please meet your doctor immediately for a checkup."
+        return "You are at high risk! Please meet your doctor immediately for a checkup."
     elif risk_label == 'mid risk':
-        message = "You are at moderate risk. It's advised to consult your doctor soon."
+        return "You are at moderate risk. It's advised to consult your doctor soon."
     else:
-        message = "You are at low risk. Maintain a healthy lifestyle and monitor regularly."
+        return "You are at low risk. Maintain a healthy lifestyle and monitor regularly."
+
+def predict_risk(age, systolic_bp, diastolic_bp, bs, body_temp, heart_rate, bundle=None):
+    bundle = bundle or active_model
+    if bundle is None:
+        raise ValueError("Risk model not initialized. Call initialize_risk_model() first.")
+    sample = np.array([[age, systolic_bp, diastolic_bp, bs, body_temp, heart_rate]])
+    prediction = forest_engine.predict(sample, bundle.compiled, bundle.forest, bundle.scaler)[0]
+    risk_label = bundle.label_encoder.classes_[prediction]
+    message = risk_recommendation(risk_label)
     
     return risk_label, message, sample
 
+def predict_risk_batch(samples, bundle=None):
+    # samples: (n, 6) array in selected_features order; one model call for the whole batch
+    bundle = bundle or active_model
+    if bundle is None:
+        raise ValueError("Risk model not initialized. Call initialize_risk_model() first.")
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, len(selected_features))
+    if len(samples) == 0:
+        return [], []
+    classes = bundle.label_encoder.classes_
+    predictions = forest_engine.predict(samples, bundle.compiled, bundle.forest, bundle.scaler)
+    with metrics.stage("label_decoding"):
+        risk_labels = classes[predictions]
+        messages = {label: risk_recommendation(label) for label in classes}
+        return list(risk_labels), [messages[label] for label in risk_labels]
+
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
     from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
     
     initialize_risk_model()
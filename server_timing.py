@@ -0,0 +1,98 @@
+import contextvars
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENABLED = os.getenv("HERHEALTH_SERVER_TIMING", "1").lower() in ("1", "true", "yes")
+# Also log one JSON line per request with its spans, for log pipelines that can't see headers
+TIMING_LOG = os.getenv("HERHEALTH_TIMING_LOG", "0").lower() in ("1", "true", "yes")
+
+# Set per request by ServerTimingMiddleware; None outside a request, so recording is a no-op there
+_current = contextvars.ContextVar("herhealth_request_timing", default=None)
+
+
+class RequestTiming:
+    __slots__ = ("started", "spans")
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.spans = []
+
+    def totals(self):
+        # Stages that ran more than once (e.g. per chunk) are summed, in first-seen order
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+
+def current():
+    return _current.get()
+
+
+def record(name, seconds):
+    timing = _current.get()
+    if timing is not None:
+        timing.spans.append((name, seconds))
+
+
+def record_since_start(name):
+    """Record the time from the start of the request until now, e.g. body reading and parsing."""
+    timing = _current.get()
+    if timing is not None:
+        timing.spans.append((name, time.perf_counter() - timing.started))
+
+
+def collect():
+    """Start a fresh span list in this context (a batch shared by several requests); returns it."""
+    timing = RequestTiming()
+    _current.set(timing)
+    return timing
+
+
+def header_value(totals, total=None):
+    entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    # Returns the stages recorded while handling a request in a Server-Timing header; stages
+    # that run after the headers went out (a streamed body) only reach the log line
+    def __init__(self, app, log=TIMING_LOG):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                value = header_value(timing.totals(), time.perf_counter() - timing.started)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", value.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if self.log:
+                logger.info(json.dumps({
+                    "event": "request_timing",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "total_ms": round((time.perf_counter() - timing.started) * 1000, 3),
+                    "spans_ms": {name: round(seconds * 1000, 3) for name, seconds in timing.totals().items()},
+                }))
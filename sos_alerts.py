@@ -0,0 +1,558 @@
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import random
+import time
+import uuid
+
+import metrics
+import sos_outbox
+
+logger = logging.getLogger(__name__)
+
+# Messages being created at once across all SOS requests in this worker
+SOS_CONCURRENCY = int(os.getenv("HERHEALTH_SOS_CONCURRENCY", 16))
+# Per-message limit on the call to Twilio, so one stuck contact can't hold up the response
+SOS_SEND_TIMEOUT = float(os.getenv("HERHEALTH_SOS_SEND_TIMEOUT", 10))
+# Public URL of /sos/status_callback that Twilio posts delivery updates to. Without one (e.g. a
+# laptop Twilio can't reach) statuses are fetched in the background instead
+SOS_CALLBACK_URL = os.getenv("HERHEALTH_SOS_CALLBACK_URL", "")
+SOS_POLL_INTERVAL = float(os.getenv("HERHEALTH_SOS_POLL_INTERVAL", 5))
+SOS_POLL_MAX_SECONDS = float(os.getenv("HERHEALTH_SOS_POLL_MAX_SECONDS", 300))
+# Alerts kept in memory for status queries; the oldest are dropped first
+SOS_STORE_SIZE = int(os.getenv("HERHEALTH_SOS_STORE_SIZE", 1000))
+# How often a watched alert is re-read from the outbox, for updates another worker received
+SOS_REFRESH_INTERVAL = float(os.getenv("HERHEALTH_SOS_REFRESH_INTERVAL", 1.0))
+# Failed sends are retried with exponential backoff (and jitter) until this many attempts
+SOS_MAX_ATTEMPTS = int(os.getenv("HERHEALTH_SOS_MAX_ATTEMPTS", 8))
+SOS_BACKOFF_BASE = float(os.getenv("HERHEALTH_SOS_BACKOFF_BASE", 1.0))
+SOS_BACKOFF_MAX = float(os.getenv("HERHEALTH_SOS_BACKOFF_MAX", 60.0))
+# Per contact: this many messages at once, then one per 60/rate seconds; later ones wait their turn
+SOS_CONTACT_BURST = int(os.getenv("HERHEALTH_SOS_CONTACT_BURST", 3))
+SOS_CONTACT_PER_MINUTE = float(os.getenv("HERHEALTH_SOS_CONTACT_PER_MINUTE", 2))
+# Repeated presses with the same idempotency key (or contacts and location) in this window are one alert
+SOS_DEDUP_SECONDS = float(os.getenv("HERHEALTH_SOS_DEDUP_SECONDS", 120))
+# How often an idle dispatcher checks the outbox for messages other workers stored
+DISPATCH_IDLE_SECONDS = 5.0
+LATENCY_SAMPLES = 10000
+
+# Twilio's message lifecycle; callbacks can arrive out of order, so a status never moves back
+STATUS_RANK = {
+    "accepted": 0, "scheduled": 0, "queued": 1, "sending": 2, "sent": 3,
+    "delivered": 4, "undelivered": 4, "failed": 4, "canceled": 4, "read": 5,
+}
+FINAL_STATUSES = frozenset(("delivered", "undelivered", "failed", "canceled", "read"))
+# Reported for a contact whose message Twilio never accepted
+SEND_FAILED = "send_failed"
+
+
+def credentials():
+    return os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"), os.getenv("TWILIO_PHONE_NUMBER")
+
+
+def alert_body(latitude, longitude):
+    maps_link = f"https://www.google.com/maps?q={latitude},{longitude}"
+    return f"EMERGENCY ALERT: Help needed at Latitude: {latitude}, Longitude: {longitude}! View location: {maps_link}"
+
+
+def is_final(status):
+    return status in FINAL_STATUSES or status == SEND_FAILED
+
+
+def dedup_key(contacts, latitude, longitude):
+    # Used when the client sends no Idempotency-Key; about 100 m of movement still counts as the same alert
+    raw = f"{sorted(contacts)}|{round(latitude, 3)}|{round(longitude, 3)}"
+    return "auto:" + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def retryable(error):
+    # Twilio rejecting the request itself (bad number, unverified sender) won't change on a retry
+    status = getattr(error, "status", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    return {"count": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+SOS_ALERT_SECONDS = metrics.Histogram(
+    "herhealth_sos_alert_seconds",
+    "Time from an SOS being stored to each of its messages being accepted by Twilio or delivered.",
+    ["outcome"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+class Alert:
+    """One SOS: a message per contact and the latest status of each."""
+
+    def __init__(self, alert_id, latitude, longitude, created_at, messages):
+        self.alert_id = alert_id
+        self.created_at = created_at
+        self.latitude = latitude
+        self.longitude = longitude
+        self.messages = messages
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    @classmethod
+    def from_stored(cls, stored):
+        return cls(stored.alert_id, stored.latitude, stored.longitude, stored.created_at, stored.messages)
+
+    @property
+    def done(self):
+        return all(is_final(message["status"]) for message in self.messages)
+
+    def _bump(self):
+        # Wakes everyone waiting on the current version, then starts a fresh event for the next
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, version, timeout):
+        """Return once the alert has changed since `version`, or after `timeout` seconds."""
+        if self.version != version or self.done:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def snapshot(self):
+        return {
+            "alert_id": self.alert_id,
+            "created_at": self.created_at,
+            "version": self.version,
+            "done": self.done,
+            "all_delivered": all(message["status"] in ("delivered", "read") for message in self.messages),
+            "messages": [dict(message) for message in self.messages],
+        }
+
+
+class AlertStore:
+    """In-memory alerts of this worker, addressable by alert id and by message SID.
+
+    The outbox is the durable record; this holds the alerts that requests are
+    watching, so status changes can wake them. Updates handled by other
+    workers only reach the outbox and are merged in with `merge`.
+    """
+
+    def __init__(self, max_alerts=SOS_STORE_SIZE):
+        self.max_alerts = max(1, max_alerts)
+        self._alerts = collections.OrderedDict()
+        self._by_sid = {}
+        # Callbacks that beat the create response back, applied when the SID is registered
+        self._early = collections.OrderedDict()
+
+    def add(self, alert):
+        self._alerts[alert.alert_id] = alert
+        for index, message in enumerate(alert.messages):
+            if message["sid"]:
+                self._by_sid[message["sid"]] = (alert, index)
+        while len(self._alerts) > self.max_alerts:
+            _, old = self._alerts.popitem(last=False)
+            for message in old.messages:
+                self._by_sid.pop(message["sid"], None)
+        return alert
+
+    def get(self, alert_id):
+        return self._alerts.get(alert_id)
+
+    def record_sent(self, alert, index, sid, status):
+        message = alert.messages[index]
+        message["sid"] = sid
+        message["status"] = status
+        message["error"] = None
+        self._by_sid[sid] = (alert, index)
+        early = self._early.pop(sid, None)
+        if early is not None:
+            self._apply(alert, index, *early)
+        alert._bump()
+
+    def record_retry(self, alert, index, error):
+        alert.messages[index]["error"] = error
+        alert._bump()
+
+    def knows(self, sid):
+        return sid in self._by_sid
+
+    def record_failed(self, alert, index, error):
+        message = alert.messages[index]
+        message["status"] = SEND_FAILED
+        message["error"] = error
+        alert._bump()
+
+    def update(self, sid, status, error_code=None):
+        """Apply a status reported for a message SID; returns the alert if it changed, else None."""
+        entry = self._by_sid.get(sid)
+        if entry is None:
+            self._early[sid] = (status, error_code)
+            while len(self._early) > self.max_alerts:
+                self._early.popitem(last=False)
+            return None
+        alert, index = entry
+        if self._apply(alert, index, status, error_code):
+            alert._bump()
+            return alert
+        return None
+
+    def merge(self, alert, stored_messages):
+        """Take newer per-message state from the outbox (written by any worker); returns whether anything changed."""
+        changed = False
+        for index, stored in enumerate(stored_messages):
+            message = alert.messages[index]
+            if stored["sid"] and not message["sid"]:
+                message["sid"] = stored["sid"]
+                self._by_sid[stored["sid"]] = (alert, index)
+                early = self._early.pop(stored["sid"], None)
+                if early is not None:
+                    self._apply(alert, index, *early)
+                changed = True
+            newer = STATUS_RANK.get(stored["status"], -1) > STATUS_RANK.get(message["status"], -1) or (
+                stored["status"] == SEND_FAILED and not is_final(message["status"])
+            )
+            if newer:
+                message["status"] = stored["status"]
+                changed = True
+            if stored["error"] != message["error"] and stored["status"] == message["status"]:
+                message["error"] = stored["error"]
+                changed = True
+        if changed:
+            alert._bump()
+        return changed
+
+    @staticmethod
+    def _apply(alert, index, status, error_code):
+        message = alert.messages[index]
+        if STATUS_RANK.get(status, -1) < STATUS_RANK.get(message["status"], -1):
+            return False
+        if status == message["status"]:
+            return False
+        message["status"] = status
+        if error_code:
+            message["error"] = f"Twilio error {error_code}"
+        return True
+
+
+class ContactRateLimiter:
+    """Token bucket per contact: `burst` messages straight away, then one every 60/`per_minute` seconds."""
+
+    def __init__(self, burst=SOS_CONTACT_BURST, per_minute=SOS_CONTACT_PER_MINUTE, max_contacts=10000):
+        self.burst = max(1, burst)
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.max_contacts = max_contacts
+        self._buckets = collections.OrderedDict()
+
+    def acquire(self, contact, now=None):
+        """Take a token for `contact`; returns 0 if it may be messaged now, else the seconds to wait."""
+        if self.interval == 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(contact, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) / self.interval)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) * self.interval
+        self._buckets[contact] = (tokens, now)
+        while len(self._buckets) > self.max_contacts:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class SOSSender:
+    """Delivers SOS alerts from the durable outbox through one long-lived async Twilio client.
+
+    `submit` only stores the alert; a background dispatcher claims due
+    messages, sends up to `concurrency` at once and retries transient
+    failures with exponential backoff. Delivery is at least once: a worker
+    that dies between Twilio accepting a message and recording it sends it
+    again after the lease. The Twilio client and its pooled aiohttp session
+    are created on first use and rebuilt only if the credentials change.
+    Delivery updates come in through `handle_callback`, or from a background
+    poller when no callback URL is configured.
+    """
+
+    def __init__(self, concurrency=SOS_CONCURRENCY, timeout=SOS_SEND_TIMEOUT, callback_url=SOS_CALLBACK_URL,
+                 poll_interval=SOS_POLL_INTERVAL, poll_max_seconds=SOS_POLL_MAX_SECONDS, store=None, outbox=None,
+                 max_attempts=SOS_MAX_ATTEMPTS, backoff_base=SOS_BACKOFF_BASE, backoff_max=SOS_BACKOFF_MAX,
+                 limiter=None, dedup_window=SOS_DEDUP_SECONDS, refresh_interval=SOS_REFRESH_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        # Long enough that a send still in progress is never claimed by another worker
+        self.lease = timeout * 3
+        self.callback_url = callback_url
+        self.poll_interval = poll_interval
+        self.poll_max_seconds = poll_max_seconds
+        self.store = store or AlertStore()
+        self.outbox = outbox or sos_outbox.Outbox()
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = limiter or ContactRateLimiter()
+        self.dedup_window = dedup_window
+        self.refresh_interval = refresh_interval
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = None
+        self._http_client = None
+        self._credentials = None
+        self._dispatcher = None
+        self._wake = asyncio.Event()
+        self._in_flight = 0
+        self._tasks = set()
+        self._pollers = {}
+        self._accepted = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._delivered = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.duplicates = 0
+        self.callbacks = 0
+
+    async def _get_client(self, account_sid, auth_token):
+        if self._client is None or self._credentials != (account_sid, auth_token):
+            from twilio.http.async_http_client import AsyncTwilioHttpClient
+            from twilio.rest import Client
+
+            await self._close_client()
+            self._http_client = AsyncTwilioHttpClient()
+            self._client = Client(account_sid, auth_token, http_client=self._http_client)
+            # Any Twilio-compatible API, e.g. the stand-in in fake_services.py for load tests
+            if os.getenv("TWILIO_API_BASE_URL"):
+                self._client.api.base_url = os.getenv("TWILIO_API_BASE_URL")
+            self._credentials = (account_sid, auth_token)
+        return self._client
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def start(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def submit(self, contacts, latitude, longitude, idempotency_key=None):
+        """Store the alert durably and hand it to the dispatcher; returns (alert, created).
+
+        A repeat of an alert stored within the dedup window returns the
+        original with created=False and sends nothing.
+        """
+        key = idempotency_key or dedup_key(contacts, latitude, longitude)
+        alert_id, created = await asyncio.to_thread(
+            self.outbox.enqueue, uuid.uuid4().hex, latitude, longitude, contacts, key, self.dedup_window
+        )
+        if created:
+            self._wake.set()
+        else:
+            self.duplicates += 1
+            logger.info(f"Duplicate SOS folded into alert {alert_id}")
+        return await self.get_alert(alert_id), created
+
+    async def get_alert(self, alert_id):
+        alert = self.store.get(alert_id)
+        if alert is None:
+            # Stored by another worker or before a restart
+            stored = await asyncio.to_thread(self.outbox.load_alert, alert_id)
+            if stored is None:
+                return None
+            alert = self.store.get(alert_id) or self.store.add(Alert.from_stored(stored))
+        return alert
+
+    async def refresh(self, alert):
+        """Merge in what other workers stored for `alert` (sends, callbacks); returns whether it changed."""
+        if alert.done:
+            return False
+        stored = await asyncio.to_thread(self.outbox.load_alert, alert.alert_id)
+        return stored is not None and self.store.merge(alert, stored.messages)
+
+    async def wait(self, alert, version, timeout):
+        """Return once `alert` has changed since `version`, here or in another worker, or after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while alert.version == version and not alert.done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            await alert.wait(version, min(remaining, self.refresh_interval))
+            if alert.version == version:
+                await self.refresh(alert)
+
+    async def _dispatch(self):
+        try:
+            await asyncio.to_thread(self.outbox.prune)
+        except Exception as e:
+            logger.warning(f"Failed to prune the SOS outbox: {e}")
+        while True:
+            try:
+                self._wake.clear()
+                capacity = self.concurrency - self._in_flight
+                if capacity <= 0 or not all(credentials()):
+                    await self._sleep(DISPATCH_IDLE_SECONDS)
+                    continue
+                messages = await asyncio.to_thread(self.outbox.claim_due, self.lease, capacity)
+                for message in messages:
+                    self._in_flight += 1
+                    self._spawn(self._deliver(message))
+                if messages:
+                    continue
+                next_due = await asyncio.to_thread(self.outbox.next_due_at)
+                delay = DISPATCH_IDLE_SECONDS if next_due is None else next_due - time.time()
+                await self._sleep(min(DISPATCH_IDLE_SECONDS, max(0.01, delay)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"SOS dispatcher error: {e}")
+                await asyncio.sleep(1)
+
+    async def _sleep(self, seconds):
+        # Cut short by a new alert or a finished send
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def _backoff(self, attempts):
+        return min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, message):
+        try:
+            alert = await self.get_alert(message.alert_id)
+            # Only a message's first try counts against its contact; retries replace a send that failed
+            wait = self.limiter.acquire(message.contact) if message.attempts == 1 else 0.0
+            if wait > 0:
+                self.rate_limited += 1
+                await asyncio.to_thread(
+                    self.outbox.reschedule, message.id, time.time() + wait, None, False
+                )
+                return
+
+            account_sid, auth_token, from_number = credentials()
+            client = await self._get_client(account_sid, auth_token)
+            options = {"status_callback": self.callback_url} if self.callback_url else {}
+            try:
+                async with self._semaphore:
+                    with metrics.stage("twilio_send"):
+                        sent = await asyncio.wait_for(client.messages.create_async(
+                            body=alert_body(alert.latitude, alert.longitude), from_=from_number, to=message.contact,
+                            **options,
+                        ), self.timeout)
+            except Exception as e:
+                await self._send_failed(message, alert, e)
+                return
+
+            self.sent += 1
+            await asyncio.to_thread(self.outbox.mark_sent, message.id, sent.sid, sent.status)
+            latency = time.time() - message.created_at
+            self._accepted.append(latency)
+            SOS_ALERT_SECONDS.observe(latency, "accepted")
+            logger.info(f"Alert queued for {message.contact}, SID: {sent.sid} ({latency * 1000:.0f} ms after the SOS)")
+            self.store.record_sent(alert, message.position, sent.sid, sent.status)
+            if not self.callback_url and alert.alert_id not in self._pollers:
+                self._pollers[alert.alert_id] = self._spawn(self._poll(client, alert))
+        except Exception as e:
+            # Left claimed; it is retried when the lease runs out
+            logger.error(f"Dispatching SOS message {message.id} failed: {e}")
+        finally:
+            self._in_flight -= 1
+            self._wake.set()
+
+    async def _send_failed(self, message, alert, e):
+        error = str(e) or type(e).__name__
+        if retryable(e) and message.attempts < self.max_attempts:
+            self.retries += 1
+            delay = self._backoff(message.attempts)
+            logger.warning(f"Alert to {message.contact} failed (attempt {message.attempts}), "
+                           f"retrying in {delay:.1f}s: {error}")
+            await asyncio.to_thread(self.outbox.reschedule, message.id, time.time() + delay, error)
+            self.store.record_retry(alert, message.position, error)
+        else:
+            self.failed += 1
+            logger.error(f"Failed to send alert to {message.contact} after {message.attempts} attempts: {error}")
+            await asyncio.to_thread(self.outbox.mark_failed, message.id, SEND_FAILED, error)
+            self.store.record_failed(alert, message.position, error)
+
+    async def _apply_status(self, sid, status, error_code=None):
+        known = self.store.knows(sid)
+        alert = self.store.update(sid, status, error_code)
+        if alert is None and known:
+            return
+        await asyncio.to_thread(self.outbox.set_status, sid, status, f"Twilio error {error_code}" if error_code else None)
+        if alert is not None and status in ("delivered", "read"):
+            latency = time.time() - alert.created_at
+            self._delivered.append(latency)
+            SOS_ALERT_SECONDS.observe(latency, "delivered")
+
+    async def handle_callback(self, params, url, signature):
+        """Apply a Twilio status callback (its form fields); raises PermissionError on a bad signature."""
+        from twilio.request_validator import RequestValidator
+
+        _, auth_token, _ = credentials()
+        if not auth_token or not RequestValidator(auth_token).validate(url, params, signature or ""):
+            raise PermissionError("Invalid Twilio signature")
+        self.callbacks += 1
+        sid, status = params.get("MessageSid"), params.get("MessageStatus")
+        if sid and status:
+            await self._apply_status(sid, status, params.get("ErrorCode"))
+
+    async def _fetch_status(self, client, message):
+        async with self._semaphore:
+            try:
+                with metrics.stage("twilio_status_fetch"):
+                    fetched = await asyncio.wait_for(client.messages(message["sid"]).fetch_async(), self.timeout)
+            except Exception as e:
+                logger.warning(f"Failed to fetch status of {message['sid']}: {e}")
+                return
+        await self._apply_status(message["sid"], fetched.status, fetched.error_code)
+
+    async def _poll(self, client, alert):
+        # Stand-in for callbacks; runs in the background, never inside a request
+        try:
+            deadline = time.monotonic() + self.poll_max_seconds
+            while not alert.done and time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                pending = [message for message in alert.messages if message["sid"] and not is_final(message["status"])]
+                await asyncio.gather(*(self._fetch_status(client, message) for message in pending))
+        finally:
+            self._pollers.pop(alert.alert_id, None)
+
+    async def _close_client(self):
+        if self._http_client is not None:
+            await self._http_client.close()
+        self._client = None
+        self._http_client = None
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in list(self._tasks):
+            task.cancel()
+        await self._close_client()
+        self.outbox.close()
+
+    async def stats(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "duplicates": self.duplicates,
+            "callbacks": self.callbacks,
+            "in_flight": self._in_flight,
+            "polling": len(self._pollers),
+            "outbox": await asyncio.to_thread(self.outbox.counts),
+            "accepted_latency": percentiles(self._accepted),
+            "delivered_latency": percentiles(self._delivered),
+        }
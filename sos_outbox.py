@@ -0,0 +1,206 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Alerts are written here before anything is sent, so a crash or a Twilio timeout can't lose one
+OUTBOX_PATH = os.getenv("HERHEALTH_SOS_OUTBOX_PATH", os.path.join(script_dir, "sos_outbox.sqlite"))
+# Finished alerts older than this are deleted when the dispatcher starts
+OUTBOX_RETENTION = float(os.getenv("HERHEALTH_SOS_OUTBOX_RETENTION", 7 * 24 * 3600))
+
+# Dispatcher states; `status` separately holds what is shown to users (Twilio's status once sent)
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+# Twilio statuses for a sent message that never reached the phone
+UNDELIVERED = ("failed", "undelivered")
+
+OutboxMessage = namedtuple("OutboxMessage", "id alert_id position contact attempts created_at")
+StoredAlert = namedtuple("StoredAlert", "alert_id latitude longitude created_at messages")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS alerts (alert_id TEXT PRIMARY KEY, idempotency_key TEXT, "
+    "latitude REAL NOT NULL, longitude REAL NOT NULL, created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS alerts_key ON alerts (idempotency_key, created_at)",
+    "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, alert_id TEXT NOT NULL, "
+    "position INTEGER NOT NULL, contact TEXT NOT NULL, state TEXT NOT NULL, status TEXT NOT NULL, sid TEXT, "
+    "error TEXT, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, lease_until REAL, "
+    "created_at REAL NOT NULL, sent_at REAL)",
+    "CREATE INDEX IF NOT EXISTS messages_due ON messages (state, next_attempt_at)",
+    "CREATE INDEX IF NOT EXISTS messages_sid ON messages (sid)",
+    "CREATE INDEX IF NOT EXISTS messages_alert ON messages (alert_id, position)",
+)
+
+
+class Outbox:
+    """SOS alerts and their per-contact messages in a local SQLite file.
+
+    Writes are committed with synchronous=FULL before the API answers. A
+    message is claimed with a lease while it is being sent, so workers sharing
+    the file never send it twice at once, and a worker that dies mid-send
+    leaves it to be retried once the lease runs out. The calls block; the
+    dispatcher runs them on a thread.
+    """
+
+    def __init__(self, path=OUTBOX_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, fn):
+        # IMMEDIATE takes the write lock up front, so check-then-write is atomic across workers
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, alert_id, latitude, longitude, contacts, idempotency_key=None, dedup_window=0.0):
+        """Store an alert; returns (alert_id, created).
+
+        A key seen within `dedup_window` returns that alert, unless every one
+        of its messages failed.
+        """
+        def write(conn):
+            now = time.time()
+            if idempotency_key:
+                # Only an alert still able to reach someone absorbs the repeat; one that failed everywhere doesn't
+                row = conn.execute(
+                    "SELECT alert_id FROM alerts WHERE idempotency_key = ? AND created_at >= ? AND alert_id IN ("
+                    "SELECT alert_id FROM messages WHERE state IN (?, ?) OR (state = ? AND status NOT IN (?, ?))) "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (idempotency_key, now - dedup_window, PENDING, SENDING, SENT, *UNDELIVERED),
+                ).fetchone()
+                if row is not None:
+                    return row[0], False
+            conn.execute(
+                "INSERT INTO alerts (alert_id, idempotency_key, latitude, longitude, created_at) VALUES (?, ?, ?, ?, ?)",
+                (alert_id, idempotency_key, latitude, longitude, now),
+            )
+            conn.executemany(
+                "INSERT INTO messages (alert_id, position, contact, state, status, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(alert_id, i, contact, PENDING, PENDING, now, now) for i, contact in enumerate(contacts)],
+            )
+            return alert_id, True
+
+        return self._transaction(write)
+
+    def claim_due(self, lease_seconds, limit):
+        """Lease up to `limit` messages that are due (or whose sender's lease ran out) and return them."""
+        def claim(conn):
+            now = time.time()
+            rows = conn.execute(
+                "SELECT id, alert_id, position, contact, attempts, created_at FROM messages "
+                "WHERE (state = ? AND next_attempt_at <= ?) OR (state = ? AND lease_until < ?) "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, now, SENDING, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE messages SET state = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [(SENDING, now + lease_seconds, row[0]) for row in rows],
+            )
+            return [OutboxMessage(row[0], row[1], row[2], row[3], row[4] + 1, row[5]) for row in rows]
+
+        return self._transaction(claim)
+
+    def next_due_at(self):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT MIN(CASE WHEN state = ? THEN next_attempt_at ELSE lease_until END) FROM messages "
+                "WHERE state IN (?, ?)",
+                (PENDING, PENDING, SENDING),
+            ).fetchone()
+        return row[0]
+
+    def mark_sent(self, message_id, sid, status):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE messages SET state = ?, sid = ?, status = ?, error = NULL, sent_at = ?, lease_until = NULL "
+                "WHERE id = ?",
+                (SENT, sid, status, time.time(), message_id),
+            )
+
+    def reschedule(self, message_id, next_attempt_at, error=None, count_attempt=True):
+        # A rate-limited message was never tried, so it gives its attempt back
+        with self._lock:
+            self._connection().execute(
+                "UPDATE messages SET state = ?, next_attempt_at = ?, error = ?, lease_until = NULL, "
+                "attempts = attempts - ? WHERE id = ?",
+                (PENDING, next_attempt_at, error, 0 if count_attempt else 1, message_id),
+            )
+
+    def mark_failed(self, message_id, status, error):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE messages SET state = ?, status = ?, error = ?, lease_until = NULL WHERE id = ?",
+                (FAILED, status, error, message_id),
+            )
+
+    def set_status(self, sid, status, error=None):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE messages SET status = ?, error = COALESCE(?, error) WHERE sid = ?", (status, error, sid)
+            )
+
+    def load_alert(self, alert_id):
+        with self._lock:
+            conn = self._connection()
+            alert = conn.execute(
+                "SELECT alert_id, latitude, longitude, created_at FROM alerts WHERE alert_id = ?", (alert_id,)
+            ).fetchone()
+            if alert is None:
+                return None
+            messages = conn.execute(
+                "SELECT contact, sid, status, error FROM messages WHERE alert_id = ? ORDER BY position", (alert_id,)
+            ).fetchall()
+        return StoredAlert(*alert, [
+            {"contact": contact, "sid": sid, "status": status, "error": error} for contact, sid, status, error in messages
+        ])
+
+    def prune(self, retention=OUTBOX_RETENTION):
+        def delete(conn):
+            cutoff = time.time() - retention
+            old = "SELECT alert_id FROM alerts WHERE created_at < ? AND alert_id NOT IN " \
+                  "(SELECT alert_id FROM messages WHERE state IN (?, ?))"
+            args = (cutoff, PENDING, SENDING)
+            conn.execute(f"DELETE FROM messages WHERE alert_id IN ({old})", args)
+            return conn.execute(f"DELETE FROM alerts WHERE alert_id IN ({old})", args).rowcount
+
+        removed = self._transaction(delete)
+        if removed:
+            logger.info(f"Pruned {removed} old SOS alerts from the outbox")
+        return removed
+
+    def counts(self):
+        with self._lock:
+            rows = self._connection().execute("SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall()
+        return {state: 0 for state in (PENDING, SENDING, SENT, FAILED)} | dict(rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,109 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import bulk_upload
+
+COLUMNS = ["a", "b"]
+
+
+async def blocks(*parts):
+    for part in parts:
+        yield part
+
+
+def parse(fmt, *parts, columns=COLUMNS, aliases=None):
+    async def run():
+        chunks = await bulk_upload.open_upload(blocks(*parts), fmt, columns, aliases=aliases)
+        return [chunk async for chunk in chunks]
+    return asyncio.run(run())
+
+
+def test_detect_format():
+    assert bulk_upload.detect_format("text/csv; charset=utf-8") == "csv"
+    assert bulk_upload.detect_format("application/x-ndjson") == "ndjson"
+    assert bulk_upload.detect_format("text/csv", "NDJSON") == "ndjson"
+    with pytest.raises(ValueError):
+        bulk_upload.detect_format(None, "xml")
+
+
+def test_csv_lines_split_across_blocks():
+    [(first_row, samples, errors)] = parse("csv", b"b,x,a\r\n2,", b"skip,1\n\n4,skip,3", b"\n5,z")
+    assert first_row == 0
+    assert samples[:2].tolist() == [[1, 2], [3, 4]]
+    assert errors[:2] == [None, None]
+    # Short row: reported, and NaN in the samples
+    assert errors[2] == "Row could not be parsed: Expected at least 3 fields, got 2"
+    assert np.isnan(samples[2]).all()
+
+
+def test_csv_header_errors_are_raised_up_front():
+    with pytest.raises(ValueError, match="Missing column: b"):
+        asyncio.run(bulk_upload.open_upload(blocks(b"a,c\n1,2\n"), "csv", COLUMNS))
+    with pytest.raises(ValueError, match="Upload is empty"):
+        asyncio.run(bulk_upload.open_upload(blocks(b"\n\n"), "csv", COLUMNS))
+
+
+def test_ndjson_rows_and_aliases():
+    [(_, samples, errors)] = parse(
+        "ndjson", b'{"a": 1, "bee": 2}\n[1, 2]\n{"a": 1}\n{"a": "nan", "b": 1}\n',
+        aliases={"bee": "b"},
+    )
+    assert samples[0].tolist() == [1, 2]
+    assert errors == [
+        None,
+        "Row could not be parsed: Expected a JSON object",
+        "Row could not be parsed: Missing field: b",
+        "Row could not be parsed: Non-finite value: nan",
+    ]
+
+
+def test_rows_are_chunked(monkeypatch):
+    monkeypatch.setattr(bulk_upload, "CHUNK_ROWS", 2)
+    chunks = parse("ndjson", b"".join(b'{"a": %d, "b": 0}\n' % i for i in range(5)))
+    assert [(first_row, len(errors)) for first_row, _, errors in chunks] == [(0, 2), (2, 2), (4, 1)]
+    assert chunks[2][1].tolist() == [[4, 0]]
+
+
+def test_overlong_line_is_rejected(monkeypatch):
+    monkeypatch.setattr(bulk_upload, "MAX_LINE_BYTES", 8)
+    with pytest.raises(ValueError, match="Line longer than 8 bytes"):
+        parse("ndjson", b'{"a": 1, ', b'"b": 2}\n')
+
+
+def test_byte_cap(monkeypatch):
+    monkeypatch.setattr(bulk_upload, "MAX_BYTES", 11)
+    with pytest.raises(bulk_upload.UploadTooLarge):
+        bulk_upload.check_size("12")
+    bulk_upload.check_size("11")
+    bulk_upload.check_size(None)
+
+    async def read(*parts):
+        return [line async for line in bulk_upload.iter_lines(blocks(*parts))]
+    assert asyncio.run(read(b"12345\n", b"6789\n")) == ["12345", "6789"]
+    with pytest.raises(bulk_upload.UploadTooLarge):
+        asyncio.run(read(b"12345\n", b"6789\n", b"0"))
+
+
+def test_spooled_relays_everything():
+    async def run():
+        return b"".join([data async for data in bulk_upload.spooled(blocks("a\n", "bc\n", "d\n"), read_size=2)])
+    assert asyncio.run(run()) == b"a\nbc\nd\n"
+
+
+def test_spooled_caps_the_unread_backlog(monkeypatch):
+    monkeypatch.setattr(bulk_upload, "MAX_BYTES", 8)
+
+    async def run():
+        received = []
+        with pytest.raises(bulk_upload.UploadTooLarge):
+            # Nothing is read until the producer has run ahead, like a client still uploading
+            stream = bulk_upload.spooled(blocks("1234\n", "5678\n", "90\n"))
+            first = await stream.__anext__()
+            received.append(first)
+            async for data in stream:
+                received.append(data)
+        return b"".join(received)
+    # Lines that fitted are still sent before the stream ends
+    assert asyncio.run(run()) == b"1234\n"
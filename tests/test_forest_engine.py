@@ -0,0 +1,103 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+import forest_engine
+
+COLUMNS = ["a", "b", "c", "d", "e"]
+
+
+def make_data(seed=0, rows=600):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(loc=[120, 80, 7, 98, 70], scale=[20, 12, 3, 1.5, 15], size=(rows, len(COLUMNS)))
+    # Rounded like real vitals, so many rows sit right on the split thresholds
+    X = np.round(X, 1)
+    y = (X[:, 0] / 40 + X[:, 2] / 3 + rng.normal(size=rows)).astype(int) % 3
+    return pd.DataFrame(X, columns=COLUMNS), y
+
+
+def fit(scaler):
+    X, y = make_data()
+    # Trained like fetus_health and risk_management: scaler fitted on the DataFrame, forest on its output
+    scaled = scaler.fit_transform(X) if scaler is not None else X.to_numpy()
+    forest = RandomForestClassifier(n_estimators=25, max_depth=12, random_state=0).fit(scaled, y)
+    return forest, scaler
+
+
+def boundary_rows(forest, scaler, base):
+    # Raw values whose scaled value lands on, or one float step either side of, every split threshold
+    rows = []
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        for feature, threshold in zip(tree.feature, tree.threshold):
+            if feature < 0:
+                continue
+            scaled = np.zeros((1, len(COLUMNS)))
+            scaled[0, feature] = threshold
+            raw = scaler.inverse_transform(scaled)[0, feature] if scaler is not None else threshold
+            for value in (np.nextafter(raw, -np.inf), raw, np.nextafter(raw, np.inf)):
+                row = base.copy()
+                row[feature] = value
+                rows.append(row)
+    return np.array(rows)
+
+
+def sklearn_proba(forest, scaler, X):
+    if scaler is not None:
+        X = scaler.transform(pd.DataFrame(X, columns=COLUMNS))
+    return forest.predict_proba(X)
+
+
+@pytest.mark.parametrize("scaler", [StandardScaler(), MinMaxScaler(), None], ids=["standard", "minmax", "none"])
+def test_compiled_forest_is_bit_exact_with_sklearn(scaler):
+    forest, scaler = fit(scaler)
+    compiled = forest_engine.compile_forest(forest, scaler)
+    X, _ = make_data(seed=1, rows=500)
+    X = X.to_numpy()
+    rows = np.vstack([X, boundary_rows(forest, scaler, np.median(X, axis=0))])
+
+    # Small chunks run every pair to max_depth, large ones prune finished traversals
+    for batch in (rows[:3], rows[:100], rows):
+        expected = sklearn_proba(forest, scaler, batch)
+        np.testing.assert_array_equal(compiled.predict_proba(batch), expected)
+        np.testing.assert_array_equal(compiled.predict(batch), forest.classes_[np.argmax(expected, axis=1)])
+
+
+def test_arrays_round_trip_scores_the_same():
+    forest, scaler = fit(StandardScaler())
+    compiled = forest_engine.compile_forest(forest, scaler)
+    restored = forest_engine.CompiledForest.from_arrays(*compiled.to_arrays())
+    X, _ = make_data(seed=2, rows=200)
+    np.testing.assert_array_equal(restored.predict_proba(X.to_numpy()), compiled.predict_proba(X.to_numpy()))
+
+
+def test_engines_agree_through_predict(monkeypatch):
+    forest, scaler = fit(StandardScaler())
+    compiled = forest_engine.compile_forest(forest, scaler)
+    X = make_data(seed=3, rows=50)[0].to_numpy()
+    monkeypatch.setattr(forest_engine, "ENGINE", "sklearn")
+    # The scaler was fitted on a DataFrame; served as arrays it must not warn about column names
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        by_sklearn = forest_engine.predict(X, compiled, forest_engine.for_arrays(forest), forest_engine.for_arrays(scaler))
+    monkeypatch.setattr(forest_engine, "ENGINE", "compiled")
+    np.testing.assert_array_equal(forest_engine.predict(X, compiled, forest, scaler), by_sklearn)
+
+
+def test_for_arrays_leaves_the_stored_estimator_alone():
+    _, scaler = fit(StandardScaler())
+    served = forest_engine.for_arrays(scaler)
+    assert not hasattr(served, "feature_names_in_")
+    assert list(scaler.feature_names_in_) == COLUMNS
+    np.testing.assert_array_equal(served.mean_, scaler.mean_)
+
+
+def test_rejects_non_finite_rows():
+    forest, scaler = fit(StandardScaler())
+    compiled = forest_engine.compile_forest(forest, scaler)
+    with pytest.raises(ValueError):
+        compiled.predict_proba(np.full((1, len(COLUMNS)), np.nan))
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder, MinMaxScaler
+
+import incremental
+import model_store
+import risk_management
+
+
+def make_data(seed, rows=300):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, 3))
+    y = (X[:, 0] + X[:, 1] > 0).astype(int) + (X[:, 2] > 1)
+    return X, y
+
+
+@pytest.fixture
+def forest():
+    return RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0).fit(*make_data(0))
+
+
+def thresholds(trees):
+    return [tree.tree_.threshold.tolist() for tree in trees]
+
+
+def test_grow_appends_trees_and_leaves_the_original(forest):
+    original = list(forest.estimators_)
+    updated = incremental.update_forest(forest, *make_data(1), n_trees=4, mode="grow", random_state=3)
+    assert updated.n_estimators == 14 and len(updated.estimators_) == 14
+    assert updated.estimators_[:10] == original
+    # Same hyperparameters as the forest being updated
+    assert all(tree.max_depth == 6 for tree in updated.estimators_[10:])
+    assert forest.n_estimators == 10 and forest.estimators_ == original
+    assert updated.predict(make_data(2)[0]).shape == (300,)
+
+
+def test_replace_drops_the_oldest_trees(forest):
+    original = list(forest.estimators_)
+    updated = incremental.update_forest(forest, *make_data(1), n_trees=4, mode="replace", random_state=3)
+    assert updated.n_estimators == 10
+    assert updated.estimators_[:6] == original[4:]
+    assert not set(map(id, updated.estimators_[6:])) & set(map(id, original))
+
+
+def test_same_random_state_gives_the_same_trees(forest):
+    X, y = make_data(1)
+    first = incremental.update_forest(forest, X, y, n_trees=4, random_state=7)
+    second = incremental.update_forest(forest, X, y, n_trees=4, random_state=7)
+    other = incremental.update_forest(forest, X, y, n_trees=4, random_state=8)
+    assert thresholds(first.estimators_[10:]) == thresholds(second.estimators_[10:])
+    assert thresholds(first.estimators_[10:]) != thresholds(other.estimators_[10:])
+
+
+def test_update_must_cover_the_forest_classes(forest):
+    X, y = make_data(1)
+    with pytest.raises(ValueError, match="covers classes"):
+        incremental.update_forest(forest, X[y == 0], y[y == 0], n_trees=2)
+    with pytest.raises(ValueError, match="Unknown update mode"):
+        incremental.update_forest(forest, X, y, n_trees=2, mode="shrink")
+
+
+def test_recent_cases_keeps_the_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, "CSV_CHUNK_ROWS", 4)
+    store = str(tmp_path / "cases.csv")
+    for start in (0, 10):
+        incremental.append_cases(store, pd.DataFrame({"a": range(start, start + 10), "b": 0}))
+    assert incremental.recent_cases(store, 7, ["a"])["a"].tolist() == list(range(13, 20))
+    assert incremental.recent_cases(str(tmp_path / "missing.csv"), 7, ["a"]).empty
+
+
+@pytest.fixture
+def risk_store(tmp_path, monkeypatch):
+    # A small risk model saved into a scratch model store, trained on the bundled dataset
+    monkeypatch.setattr(model_store, "models_dir", str(tmp_path / "models"))
+    df = pd.read_csv(risk_management.csv_path)
+    encoder = LabelEncoder().fit(df["RiskLevel"])
+    scaler = MinMaxScaler().fit(df[risk_management.selected_features])
+    forest = RandomForestClassifier(n_estimators=10, random_state=0).fit(
+        scaler.transform(df[risk_management.selected_features]), encoder.transform(df["RiskLevel"])
+    )
+    model_store.save_artifacts("risk", {"scaler": scaler, "forest": forest, "label_encoder": encoder}, {
+        "dataset_hash": "0" * 64, "classes": list(encoder.classes_),
+    })
+    cases = tmp_path / "new_cases.csv"
+    df.sample(60, random_state=1).to_csv(cases, index=False)
+    return str(cases)
+
+
+def test_update_records_its_seed_and_can_be_repeated(risk_store):
+    first, report = risk_management.update_risk_model(risk_store, n_trees=5, random_state=11)
+    manifest = model_store.read_manifest("risk", first)
+    assert manifest["random_state"] == 11 and manifest["update"]["random_state"] == 11
+    assert report["n_estimators"] == 15 and report["holdout_cases"] == 12
+
+    # The case store now holds the first batch, so repeat it from the same parent with a fresh store
+    parent = model_store.load_artifacts("risk", manifest["parent_version"])[0]
+    again, _ = incremental.update_model(
+        parent["forest"], parent["scaler"], pd.read_csv(risk_store), model_store.case_store_path("risk") + ".repeat",
+        risk_management.csv_path, risk_management.selected_features, "RiskLevel", parent["label_encoder"].transform,
+        n_trees=5, random_state=11,
+    )
+    saved = model_store.load_artifacts("risk", first)[0]["forest"]
+    assert thresholds(again.estimators_) == thresholds(saved.estimators_)
+
+
+def test_update_without_a_seed_records_the_drawn_one(risk_store):
+    version, report = risk_management.update_risk_model(risk_store, n_trees=2)
+    assert isinstance(report["random_state"], int)
+    assert model_store.read_manifest("risk", version)["random_state"] == report["random_state"]
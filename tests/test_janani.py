@@ -0,0 +1,206 @@
+import asyncio
+
+import pytest
+
+import janani
+
+
+class FakeOllama:
+    """Streams a fixed answer per question; each generation blocks until released, if asked to."""
+
+    def __init__(self, hold=False):
+        self.calls = []
+        self.hold = hold
+        self.release = {}
+
+    async def chat(self, model, messages, stream=False, keep_alive=None, options=None):
+        question = messages[-1]["content"]
+        self.calls.append(question)
+        release = self.release.setdefault(question, asyncio.Event())
+        if not self.hold:
+            release.set()
+
+        async def parts():
+            await release.wait()
+            for word in ("Answer", " to", f" {question}"):
+                yield {"message": {"content": word}, "done": False}
+            yield {"message": {"content": ""}, "done": True, "load_duration": 0}
+
+        return parts()
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install(limit=1, queue_depth=4, hold=False, cache=False):
+        client = FakeOllama(hold)
+        monkeypatch.setattr(janani, "client", lambda: client)
+        monkeypatch.setattr(janani, "gate", janani.GenerationGate(limit, queue_depth))
+        monkeypatch.setattr(janani, "answer_cache", janani.AnswerCache(enabled=cache))
+        monkeypatch.setattr(janani, "_flights", {})
+        monkeypatch.setattr(janani, "coalesced", 0)
+        monkeypatch.setattr(janani, "QUEUE_POSITION_INTERVAL", 0.01)
+        return client
+    return install
+
+
+async def settle():
+    # Lets the generation tasks reach the gate or the model
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def until(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+async def collect(flight, events):
+    async for kind, value in flight.follow():
+        events.append((kind, value))
+
+
+def test_identical_questions_in_flight_share_one_generation(fake):
+    client = fake(hold=True)
+
+    async def scenario():
+        first = asyncio.ensure_future(janani.answer("What are the signs of labor?"))
+        await settle()
+        second = asyncio.ensure_future(janani.answer("  what are the SIGNS of labor "))
+        await settle()
+        client.release["What are the signs of labor?"].set()
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(scenario())
+    assert first == second == "Answer to What are the signs of labor?"
+    assert client.calls == ["What are the signs of labor?"]
+    assert janani.coalesced == 1
+    assert janani._flights == {}
+
+
+def test_a_late_follower_gets_the_tokens_already_generated(fake):
+    client = fake(hold=True)
+
+    async def scenario():
+        flight = janani.open_answer("q")
+        early = []
+        first = asyncio.ensure_future(collect(flight, early))
+        await settle()
+        client.release["q"].set()
+        await first
+        late = []
+        await collect(flight, late)
+        return early, late
+
+    early, late = asyncio.run(scenario())
+    assert [value for kind, value in early if kind == "token"] == ["Answer", " to", " q"]
+    assert late == [("token", "Answer"), ("token", " to"), ("token", " q")]
+
+
+def test_queued_questions_see_their_place_in_line(fake):
+    client = fake(limit=1, hold=True)
+
+    def positions(events):
+        return [value for kind, value in events if kind == "queued"]
+
+    async def scenario():
+        flights = [janani.open_answer(question) for question in ("a", "b", "c")]
+        a, b, c = events = [[] for _ in flights]
+        tasks = [asyncio.ensure_future(collect(flight, log)) for flight, log in zip(flights, events)]
+        await until(lambda: positions(b) == [1] and positions(c) == [2])
+        assert janani.gate.stats()["active"] == 1 and janani.gate.stats()["queued"] == 2
+
+        client.release["a"].set()
+        await until(lambda: positions(c) == [2, 1])
+        client.release["b"].set()
+        await until(lambda: client.calls == ["a", "b", "c"])
+        client.release["c"].set()
+        await asyncio.gather(*tasks)
+        return events
+
+    a, b, c = asyncio.run(scenario())
+    assert positions(a) == []
+    assert positions(b) == [1]
+    assert positions(c) == [2, 1]
+
+
+def test_a_full_line_turns_new_questions_away(fake):
+    fake(limit=1, queue_depth=1, hold=True)
+
+    async def scenario():
+        janani.open_answer("a")
+        janani.open_answer("b")
+        await settle()
+        # Joining a question already in line is still fine
+        assert janani.open_answer("b") is janani._flights[janani.answer_cache.key("b")]
+        with pytest.raises(janani.ChatBusy):
+            janani.open_answer("c")
+        for flight in list(janani._flights.values()):
+            flight.task.cancel()
+        await settle()
+
+    asyncio.run(scenario())
+    assert janani.gate.rejected == 1
+
+
+def test_a_queued_generation_is_dropped_when_every_follower_leaves(fake):
+    client = fake(limit=1, hold=True)
+
+    async def scenario():
+        running = janani.open_answer("a")
+        running_task = asyncio.ensure_future(collect(running, []))
+        queued = janani.open_answer("b")
+        followers = [asyncio.ensure_future(collect(queued, [])) for _ in range(2)]
+        await until(lambda: janani.gate.stats()["queued"] == 1)
+        await settle()
+
+        followers[0].cancel()
+        await settle()
+        assert not queued.task.done()
+        followers[1].cancel()
+        await settle()
+        assert queued.task.cancelled()
+        assert janani.answer_cache.key("b") not in janani._flights
+        assert janani.gate.stats()["queued"] == 0
+
+        client.release["a"].set()
+        await running_task
+        return janani.gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["active"] == 0
+    assert client.calls == ["a"]
+
+
+def test_a_generation_outlives_the_client_that_started_it(fake):
+    client = fake(hold=True, cache=True)
+
+    async def scenario():
+        follower = asyncio.ensure_future(janani.answer("q"))
+        await settle()
+        follower.cancel()
+        await settle()
+        client.release["q"].set()
+        await until(lambda: not janani._flights)
+        return janani.answer_cache.lookup("q")
+
+    assert asyncio.run(scenario()) == "Answer to q"
+
+
+def test_gate_hands_slots_over_in_arrival_order():
+    gate = janani.GenerationGate(limit=2, queue_depth=10)
+    order = []
+
+    async def worker(name, hold):
+        async with gate.slot():
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario():
+        await asyncio.gather(*(worker(name, 0.01) for name in "abcdef"))
+
+    asyncio.run(scenario())
+    assert order == list("abcdef")
+    assert gate.stats()["active"] == 0 and gate.stats()["started"] == 6
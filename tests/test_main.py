@@ -0,0 +1,249 @@
+import asyncio
+import json
+
+import httpx
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+ROW = {"age": 30, "systolic_bp": 120, "diastolic_bp": 80, "bs": 7.0, "body_temp": 98.0, "heart_rate": 70}
+
+
+def fake_predict_risk_batch(samples):
+    # Stands in for the trained model: high risk from a systolic BP of 140
+    levels = ["high risk" if row[1] >= 140 else "low risk" for row in samples]
+    return levels, [f"advice for {level}" for level in levels]
+
+
+def fake_predict_fetal_health_batch(samples):
+    return ["Pathological" if row[0] >= 160 else "Normal" for row in samples]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.initializer, "require", lambda name: None)
+    monkeypatch.setattr(main, "predict_risk_batch", fake_predict_risk_batch)
+    monkeypatch.setattr(main, "predict_fetal_health_batch", fake_predict_fetal_health_batch)
+    # Without a `with` block the startup event doesn't run, so no models, outbox or Ollama
+    return TestClient(main.app)
+
+
+def test_batch_reports_bad_rows_and_scores_the_rest(client):
+    records = [ROW, {**ROW, "age": 5}, {**ROW, "bs": "high"}, {**ROW, "systolic_bp": 150}, "not a record"]
+    response = client.post("/predict_risk/batch", json={"records": records})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == 5 and body["error_count"] == 3
+    results = body["results"]
+    assert [result["index"] for result in results] == [0, 1, 2, 3, 4]
+    assert results[0]["risk_level"] == "low risk"
+    assert results[1] == {"index": 1, "error": "Age must be between 10 and 100"}
+    assert results[2]["error"].startswith("Invalid record: bs:")
+    assert results[3] == {"index": 3, "risk_level": "high risk", "recommendations": "advice for high risk"}
+    assert results[4]["error"].startswith("Invalid record:")
+
+
+def test_batch_columns_match_records(client):
+    records = [ROW, {**ROW, "systolic_bp": 150}, {**ROW, "heart_rate": 200}]
+    columns = {field: [record[field] for record in records] for field in main.HEALTH_DATA_FIELDS}
+    by_records = client.post("/predict_risk/batch", json={"records": records}).json()
+    by_columns = client.post("/predict_risk/batch", json={"columns": columns}).json()
+    assert by_columns == by_records
+    assert by_columns["results"][2]["error"] == "Heart rate must be between 40 and 180 bpm"
+
+
+def test_batch_with_no_valid_rows_skips_the_model(client, monkeypatch):
+    def require(name):
+        raise AssertionError("the model isn't needed")
+    monkeypatch.setattr(main.initializer, "require", require)
+    response = client.post("/predict_risk/batch", json={"records": [{**ROW, "age": 5}]})
+    assert response.status_code == 200
+    assert response.json()["error_count"] == 1
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"records": [ROW], "columns": {}}, "Provide exactly one of 'records' or 'columns'"),
+    ({"columns": {"age": [30]}}, "Missing columns: systolic_bp, diastolic_bp, bs, body_temp, heart_rate"),
+    ({"columns": {**{field: [1.0] for field in main.HEALTH_DATA_FIELDS}, "age": [30, 31]}},
+     "All columns must have the same length"),
+])
+def test_batch_rejects_malformed_requests(client, body, error):
+    response = client.post("/predict_risk/batch", json=body)
+    assert response.status_code == 400
+    assert response.json()["detail"] == error
+
+
+def test_batch_row_limit(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_ROWS", 2)
+    response = client.post("/predict_risk/batch", json={"records": [ROW] * 3})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Batch has 3 rows, the maximum is 2"
+
+
+def test_batch_array_keeps_failed_rows_as_nan():
+    samples, errors = main.health_batch_to_array(main.HealthDataBatch(records=[ROW, {"age": 30}]))
+    assert samples.shape == (2, len(main.HEALTH_DATA_FIELDS))
+    assert errors[0] is None and errors[1].startswith("Invalid record:")
+    assert np.isnan(samples[1]).all()
+
+
+FETAL_CSV = (
+    "baseline value,accelerations,uterine_contractions,prolongued_decelerations,"
+    "mean_value_of_short_term_variability,histogram_mean,histogram_variance,fetal_health\n"
+    "120,0.0,0.0,0.0,1.2,130,10,1\n"
+    "170,0.0,0.0,0.0,1.2,130,10,3\n"
+    "120,5,0.0,0.0,1.2,130,10,1\n"
+    "120,x,0.0,0.0,1.2,130,10,1\n"
+)
+
+
+def ndjson_lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_bulk_csv_streams_one_line_per_row(client):
+    response = client.post("/predict_fetal_health/bulk", content=FETAL_CSV, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = ndjson_lines(response)
+    assert lines[:3] == [
+        {"row": 0, "fetal_health": "Normal"},
+        {"row": 1, "fetal_health": "Pathological"},
+        {"row": 2, "error": "Accelerations must be between 0 and 1"},
+    ]
+    assert lines[3]["row"] == 3 and lines[3]["error"].startswith("Row could not be parsed:")
+
+
+def test_bulk_ndjson_accepts_api_field_names(client):
+    record = {field: 0.0 for field in main.FETAL_DATA_FIELDS}
+    rows = [{**record, "baseline_value": 120}, {**record, "baseline_value": 170}, {"baseline_value": 120}]
+    body = "".join(json.dumps(row) + "\n" for row in rows)
+    response = client.post("/predict_fetal_health/bulk", content=body)
+    lines = ndjson_lines(response)
+    assert [line.get("fetal_health") for line in lines] == ["Normal", "Pathological", None]
+    assert lines[2]["error"] == "Row could not be parsed: Missing field: accelerations"
+
+
+def test_bulk_bad_header_is_a_400(client):
+    response = client.post("/predict_fetal_health/bulk?format=csv", content="a,b\n1,2\n")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Missing column: baseline value"
+
+
+def test_bulk_upload_over_the_cap(client, monkeypatch):
+    monkeypatch.setattr(main.bulk_upload, "MAX_BYTES", 200)
+    response = client.post("/predict_fetal_health/bulk?format=csv", content=FETAL_CSV)
+    assert response.status_code == 413
+    assert response.json()["detail"] == f"Upload is {len(FETAL_CSV)} bytes, the maximum is 200"
+
+    # Without a Content-Length the upload is counted as it arrives, and cut off once it passes the cap.
+    # TestClient reads the whole body first, so this goes through httpx's ASGI transport instead.
+    async def chunked():
+        for line in FETAL_CSV.splitlines(keepends=True):
+            yield line.encode()
+
+    async def upload():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as http:
+            return await http.post("/predict_fetal_health/bulk?format=csv", content=chunked())
+    response = asyncio.run(upload())
+    assert response.status_code == 200
+    assert ndjson_lines(response) == [{"error": "Error in bulk fetal health prediction: Upload is larger than 200 bytes"}]
+
+
+@pytest.mark.parametrize("configured, sent", [(None, None), (None, "anything"), ("secret", None), ("secret", "wrong")])
+def test_admin_endpoints_need_the_configured_token(client, monkeypatch, configured, sent):
+    if configured is None:
+        monkeypatch.delenv("HERHEALTH_ADMIN_TOKEN", raising=False)
+    else:
+        monkeypatch.setenv("HERHEALTH_ADMIN_TOKEN", configured)
+    headers = {"X-Admin-Token": sent} if sent is not None else {}
+    for method, path in (("POST", "/admin/reload"), ("GET", "/admin/profile"), ("DELETE", "/admin/profile")):
+        assert client.request(method, path, headers=headers).status_code == 403
+
+
+def test_admin_reload_only_accepts_stored_versions(client, monkeypatch, tmp_path):
+    monkeypatch.setenv("HERHEALTH_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main.model_reload.model_store, "models_dir", str(tmp_path))
+    (tmp_path / "risk" / "v1").mkdir(parents=True)
+    (tmp_path / "risk" / "v1" / "manifest.json").write_text("{}")
+    headers = {"X-Admin-Token": "secret"}
+
+    for query, detail in (
+        ("version=v1", "A version can only be given together with a model"),
+        ("model=other", "Unknown model 'other', expected one of: fetal, risk"),
+        ("model=risk", "No saved versions for model 'risk'"),
+        ("model=risk&version=v2", "Unknown version 'v2' of model 'risk'"),
+        ("model=risk&version=../risk/v1", "Unknown version '../risk/v1' of model 'risk'"),
+    ):
+        response = client.post(f"/admin/reload?{query}", headers=headers)
+        assert response.status_code == 400
+        assert response.json()["detail"] == detail
+
+
+def test_admin_reload_hides_load_errors(client, monkeypatch):
+    monkeypatch.setenv("HERHEALTH_ADMIN_TOKEN", "secret")
+
+    async def reload(name, version=None):
+        raise OSError("cannot read /srv/models/risk/v1/forest.joblib")
+    monkeypatch.setattr(main.reloader, "reload", reload)
+    response = client.post("/admin/reload?model=risk", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 500
+    assert "/srv" not in response.json()["detail"]
+
+
+def test_models_not_ready_answer_a_retryable_503(client, monkeypatch):
+    def require(name):
+        raise main.model_init.ModelWarmingUp(f"The {name} model failed to initialize, retrying in 7s", retry_after=7)
+    monkeypatch.setattr(main.initializer, "require", require)
+
+    for path, body in (("/predict_risk", ROW), ("/predict_risk/batch", {"records": [ROW]})):
+        response = client.post(path, json=body)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "7"
+    response = client.post("/predict_fetal_health/bulk?format=csv", content=FETAL_CSV)
+    assert response.status_code == 503 and response.headers["Retry-After"] == "7"
+
+
+def test_ready_reports_each_model(client, monkeypatch):
+    states = {name: {**state, "state": "loading"} for name, state in main.initializer.states.items()}
+    monkeypatch.setattr(main.initializer, "states", states)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["models"]["risk"]["state"] == "loading"
+
+    for state in states.values():
+        state["state"] = "ready"
+    assert client.get("/ready").status_code == 200
+    # Liveness never waits for the models
+    assert client.get("/test").status_code == 200
+
+
+def test_metrics_count_requests_by_route_template(client):
+    client.get("/test")
+    client.get("/no/such/path")
+    client.post("/predict_risk", json={**ROW, "age": 5})
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == main.metrics.CONTENT_TYPE
+    text = response.text
+    assert 'herhealth_http_requests_total{route="/test",method="GET",status="200"}' in text
+    assert 'herhealth_http_requests_total{route="<unmatched>",method="GET",status="404"}' in text
+    assert 'herhealth_http_requests_total{route="/predict_risk",method="POST",status="400"}' in text
+    assert 'herhealth_stage_duration_seconds_count{stage="validation"}' in text
+    # Live values read from the app's objects
+    assert 'herhealth_model_ready{model="risk"}' in text
+    assert "herhealth_inference_queued 0" in text
+
+
+def test_server_timing_includes_the_batch_stages(client, monkeypatch):
+    def predict(samples):
+        # Runs in the micro-batch's context; its stages are copied to every request in the batch
+        with main.metrics.stage("forest_inference"):
+            return fake_predict_risk_batch(samples)
+    monkeypatch.setattr(main, "predict_risk_batch", predict)
+    response = client.post("/predict_risk", json={**ROW, "heart_rate": 71.25})
+    assert response.status_code == 200
+    stages = [entry.split(";")[0] for entry in response.headers["server-timing"].split(", ")]
+    assert stages == ["parsing", "validation", "forest_inference", "inference_queue", "total"]
@@ -0,0 +1,86 @@
+import re
+
+import pytest
+
+import metrics
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*",?)*\})? \S+$')
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Metrics made here stay out of the app's /metrics
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+
+
+def test_counter_and_gauge_render_with_escaped_labels():
+    counter = metrics.Counter("requests_total", "Requests handled.", ["route", "status"])
+    counter.inc("/a", "200")
+    counter.inc("/a", "200", amount=2)
+    counter.inc('say "hi"\\\n', "500")
+    gauge = metrics.Gauge("in_flight", "Requests in flight.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    gauge_float = metrics.Gauge("ratio", "A float.", ["kind"])
+    gauge_float.set(0.25, "x")
+
+    assert metrics.render() == (
+        "# HELP requests_total Requests handled.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{route="/a",status="200"} 3\n'
+        'requests_total{route="say \\"hi\\"\\\\\\n",status="500"} 1\n'
+        "# HELP in_flight Requests in flight.\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 1\n"
+        "# HELP ratio A float.\n"
+        "# TYPE ratio gauge\n"
+        'ratio{kind="x"} 0.25\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("latency_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "validation")
+
+    lines = metrics.render().splitlines()
+    assert lines[1] == "# TYPE latency_seconds histogram"
+    assert lines[2:] == [
+        # A value on a bound counts in that bucket (le is "less than or equal")
+        'latency_seconds_bucket{stage="validation",le="0.1"} 2',
+        'latency_seconds_bucket{stage="validation",le="1.0"} 3',
+        'latency_seconds_bucket{stage="validation",le="+Inf"} 4',
+        'latency_seconds_sum{stage="validation"} 3.65',
+        'latency_seconds_count{stage="validation"} 4',
+    ]
+
+
+def test_function_metrics_are_read_at_scrape_time():
+    values = {("a",): 1}
+    metrics.Gauge("live", "Read on scrape.", ["name"], function=lambda: values)
+    assert 'live{name="a"} 1' in metrics.render()
+    values[("b",)] = 2
+    assert 'live{name="b"} 2' in metrics.render()
+
+    def broken():
+        raise RuntimeError("gone")
+    metrics.Counter("broken_total", "Fails to collect.", function=broken)
+    # A failing collector leaves its metric empty instead of breaking the scrape
+    assert metrics.render().endswith("# HELP broken_total Fails to collect.\n# TYPE broken_total counter\n")
+
+
+def test_every_sample_line_is_valid_exposition_format():
+    metrics.Counter("a_total", "A.", ["x"]).inc('line\nbreak "quoted"')
+    metrics.Histogram("b_seconds", "B.").observe(0.002)
+    for line in metrics.render().splitlines():
+        assert line.startswith("# ") or SAMPLE_LINE.match(line), line
+
+
+def test_stage_records_a_duration(monkeypatch):
+    histogram = metrics.Histogram("stage_seconds", "Stages.", ["stage"])
+    monkeypatch.setattr(metrics, "STAGE_SECONDS", histogram)
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    with metrics.stage("validation"):
+        pass
+    assert 'stage_seconds_count{stage="validation"} 1' in metrics.render()
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+import micro_batch
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class Recorder:
+    """A predict_batch that records each batch and fails the ones containing a negative row."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, samples):
+        self.batches.append([row[0] for row in samples.tolist()])
+        if (samples < 0).any():
+            raise ValueError("bad row in batch")
+        return [f"result-{row[0]:g}" for row in samples.tolist()]
+
+
+def test_concurrent_requests_are_split_into_batches_of_max_size():
+    recorder = Recorder()
+    batcher = micro_batch.MicroBatcher("test", recorder, max_size=3, max_wait=0.01, enabled=True)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit([i, 0.0]) for i in range(7)))
+
+    assert run(scenario()) == [f"result-{i}" for i in range(7)]
+    assert recorder.batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert batcher.stats()["largest_batch"] == 3 and batcher.stats()["items"] == 7
+
+
+def test_a_failing_batch_only_fails_its_own_requests():
+    recorder = Recorder()
+    batcher = micro_batch.MicroBatcher("test", recorder, max_size=2, max_wait=0.01, enabled=True)
+
+    async def scenario():
+        rows = [[0, 0.0], [-1, 0.0], [2, 0.0], [3, 0.0]]
+        return await asyncio.gather(*(batcher.submit(row) for row in rows), return_exceptions=True)
+
+    first, second, third, fourth = run(scenario())
+    assert isinstance(first, ValueError) and isinstance(second, ValueError)
+    assert (third, fourth) == ("result-2", "result-3")
+
+
+def test_cancelled_requests_are_not_scored():
+    recorder = Recorder()
+    batcher = micro_batch.MicroBatcher("test", recorder, max_size=8, max_wait=0.01, enabled=True)
+
+    async def scenario():
+        tasks = [asyncio.ensure_future(batcher.submit([i, 0.0])) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks[1].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return results
+
+    results = run(scenario())
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert results[0] == "result-0" and results[2] == "result-2"
+    assert recorder.batches == [[0, 2]]
+
+
+def test_async_predict_batch_and_disabled_batching():
+    async def predict(samples):
+        await asyncio.sleep(0)
+        return [len(samples)] * len(samples)
+
+    async def scenario(enabled):
+        batcher = micro_batch.MicroBatcher("test", predict, max_size=4, max_wait=0.01, enabled=enabled)
+        return await asyncio.gather(*(batcher.submit([i]) for i in range(3)))
+
+    assert run(scenario(True)) == [3, 3, 3]
+    # Without batching every request is scored on its own
+    assert run(scenario(False)) == [1, 1, 1]
+
+
+def test_an_idle_batcher_scores_without_waiting():
+    batcher = micro_batch.MicroBatcher("test", Recorder(), max_size=8, max_wait=0.5, enabled=True)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await batcher.submit([1, 0.0])
+        return loop.time() - started
+
+    assert run(scenario()) < 0.1
+    assert batcher.stats()["last_window_ms"] == pytest.approx(0.0)
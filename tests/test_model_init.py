@@ -0,0 +1,129 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+import model_init
+
+
+class FakeModel:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.active = None
+
+    def prepare(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("dataset missing")
+        return "v1"
+
+    def load(self, version):
+        return {"version": version}
+
+    def activate(self, bundle):
+        self.active = bundle["version"]
+
+
+@pytest.fixture
+def initializer(monkeypatch):
+    initializer = model_init.ModelInitializer(timings={})
+    # Threads stand in for the spawned processes, which would need importable prepare functions
+    pool = concurrent.futures.ThreadPoolExecutor(2)
+    monkeypatch.setattr(initializer, "_get_pool", lambda: pool)
+    monkeypatch.setattr(model_init, "RETRY_BACKOFF", 10)
+    monkeypatch.setattr(model_init, "RETRY_BACKOFF_MAX", 25)
+    yield initializer
+    pool.shutdown()
+
+
+def register(initializer, model, name="risk"):
+    initializer.register(name, model.prepare, model.load, model.activate)
+
+
+async def settle(initializer):
+    await asyncio.gather(*list(initializer._tasks.values()), return_exceptions=True)
+
+
+def test_models_become_ready_in_the_background(initializer):
+    model = FakeModel()
+    register(initializer, model)
+
+    async def run():
+        initializer.start()
+        assert initializer.states["risk"]["state"] == "loading"
+        with pytest.raises(model_init.ModelWarmingUp) as warming:
+            initializer.require("risk")
+        assert warming.value.retry_after == 1
+        await settle(initializer)
+
+    asyncio.run(run())
+    initializer.require("risk")
+    assert model.active == "v1"
+    assert initializer.status()["ready"] is True
+    assert initializer.states["risk"]["version"] == "v1"
+    assert "risk_model" in initializer.timings
+
+
+def test_first_request_starts_a_lazy_model(initializer):
+    register(initializer, FakeModel())
+
+    async def run():
+        with pytest.raises(model_init.ModelWarmingUp):
+            initializer.require("risk")
+        assert initializer.states["risk"]["state"] == "loading"
+        await settle(initializer)
+
+    asyncio.run(run())
+    assert initializer.ready()
+
+
+def test_failed_model_is_retried_after_a_growing_backoff(initializer, monkeypatch):
+    model = FakeModel(failures=3)
+    register(initializer, model)
+    now = [1000.0]
+    monkeypatch.setattr(model_init.time, "time", lambda: now[0])
+
+    async def attempt():
+        initializer.start()
+        await settle(initializer)
+
+    asyncio.run(attempt())
+    state = initializer.states["risk"]
+    assert state["state"] == "failed" and state["attempts"] == 1 and state["retry_at"] == 1010
+    assert initializer.status()["ready"] is False
+
+    # During the backoff the model is reported as retryable, with the time left
+    now[0] = 1003.5
+    with pytest.raises(model_init.ModelWarmingUp) as backoff:
+        initializer.require("risk")
+    assert backoff.value.retry_after == 7
+    assert state["state"] == "failed"
+
+    async def retry():
+        with pytest.raises(model_init.ModelWarmingUp):
+            initializer.require("risk")
+        await settle(initializer)
+
+    now[0] = 1010
+    asyncio.run(retry())
+    assert state["attempts"] == 2 and state["retry_at"] == 1030
+    now[0] = 1030
+    asyncio.run(retry())
+    # Capped at RETRY_BACKOFF_MAX
+    assert state["attempts"] == 3 and state["retry_at"] == 1055
+    now[0] = 1055
+    asyncio.run(retry())
+    assert state["state"] == "ready" and state["retry_at"] is None
+
+
+def test_reload_marks_a_failed_model_ready(initializer):
+    register(initializer, FakeModel(failures=1))
+
+    async def run():
+        initializer.start()
+        await settle(initializer)
+
+    asyncio.run(run())
+    initializer.mark_ready("risk", "v2")
+    initializer.require("risk")
+    assert initializer.states["risk"]["version"] == "v2"
@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+
+import model_reload
+import model_store
+
+
+def save_version(name, version, latest=True):
+    version_dir = os.path.join(model_store.models_dir, name, version)
+    os.makedirs(version_dir)
+    with open(os.path.join(version_dir, model_store.MANIFEST_FILE), "w") as f:
+        f.write("{}")
+    if latest:
+        with open(os.path.join(model_store.models_dir, name, model_store.LATEST_FILE), "w") as f:
+            f.write(version)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_store, "models_dir", str(tmp_path))
+    return tmp_path
+
+
+class FakeModel:
+    def __init__(self, fail=False):
+        self.active = None
+        self.loaded = []
+        self.fail = fail
+
+    def load(self, version):
+        if self.fail:
+            raise OSError(f"cannot read /srv/models/{version}/forest.joblib")
+        self.loaded.append(version)
+        return {"version": version}
+
+    def warm_up(self, bundle):
+        pass
+
+    def activate(self, bundle):
+        self.active = bundle["version"]
+
+    def current(self):
+        return self.active
+
+
+def make_reloader(model):
+    reloader = model_reload.ModelReloader()
+    reloader.register("risk", model.load, model.warm_up, model.activate, model.current)
+    return reloader
+
+
+def test_reload_swaps_to_latest_and_tells_listeners(store):
+    model = FakeModel()
+    reloader = make_reloader(model)
+    swapped = []
+    reloader.add_listener(lambda name, bundle: swapped.append((name, bundle["version"])))
+    save_version("risk", "v1")
+
+    record = asyncio.run(reloader.reload("risk"))
+    assert record["version"] == "v1" and record["reloaded"] is True
+    assert model.active == "v1" and swapped == [("risk", "v1")]
+    # Already active: nothing is loaded again
+    assert asyncio.run(reloader.reload("risk"))["reloaded"] is False
+    assert model.loaded == ["v1"]
+
+
+def test_reload_a_pinned_older_version(store):
+    model = FakeModel()
+    reloader = make_reloader(model)
+    save_version("risk", "v1")
+    save_version("risk", "v2")
+    asyncio.run(reloader.reload("risk", "v1"))
+    assert model.active == "v1"
+    assert reloader.status()["models"]["risk"] == {"active_version": "v1", "latest_version": "v2", "last_error": None}
+
+
+@pytest.mark.parametrize("version", ["v9", "../fetal/v1", "/etc", ".tmp-abc"])
+def test_only_stored_versions_are_loaded(store, version):
+    model = FakeModel()
+    reloader = make_reloader(model)
+    save_version("risk", "v1")
+    save_version("fetal", "v1")
+    os.makedirs(os.path.join(str(store), "risk", ".tmp-abc"))
+    with pytest.raises(ValueError, match="Unknown version"):
+        asyncio.run(reloader.reload("risk", version))
+    assert model.loaded == []
+
+
+def test_unknown_model_and_empty_store(store):
+    reloader = make_reloader(FakeModel())
+    with pytest.raises(ValueError, match="Unknown model 'other'"):
+        asyncio.run(reloader.reload("other"))
+    with pytest.raises(ValueError, match="No saved versions for model 'risk'"):
+        asyncio.run(reloader.reload("risk"))
+
+
+def test_failed_load_keeps_the_old_version_and_hides_details(store):
+    model = FakeModel()
+    reloader = make_reloader(model)
+    save_version("risk", "v1")
+    asyncio.run(reloader.reload("risk"))
+    model.fail = True
+    save_version("risk", "v2")
+    with pytest.raises(OSError):
+        asyncio.run(reloader.reload("risk"))
+    assert model.active == "v1"
+    assert reloader.status()["models"]["risk"]["last_error"] == "v2: OSError"
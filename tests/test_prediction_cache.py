@@ -0,0 +1,63 @@
+import sqlite3
+
+import prediction_cache
+
+ROW = [30, 120, 80, 7.0, 98.0, 70]
+
+
+def make_cache(tmp_path=None, **options):
+    shared = str(tmp_path / "cache.sqlite") if tmp_path is not None else ""
+    return prediction_cache.PredictionCache("risk", max_size=100, ttl=60, shared_path=shared, enabled=True, **options)
+
+
+def test_equivalent_features_share_a_key():
+    assert prediction_cache.canonical_key("v1", [25, -0.0]) == prediction_cache.canonical_key("v1", ["25", 0.0])
+
+
+def test_hit_under_the_same_version():
+    cache = make_cache()
+    assert cache.lookup("v1", ROW) is None
+    cache.store("v1", ROW, ("low risk", "Keep it up"))
+    assert cache.lookup("v1", ROW) == ("low risk", "Keep it up")
+
+
+def test_new_model_version_drops_older_results():
+    cache = make_cache()
+    cache.lookup("v1", ROW)
+    cache.store("v1", ROW, "Normal")
+
+    assert cache.lookup("v2", ROW) is None
+    assert cache.invalidations == 2
+    assert cache.local.stats()["size"] == 0
+    # Swapping back doesn't resurrect them either
+    assert cache.lookup("v1", ROW) is None
+
+
+def test_result_from_a_replaced_model_is_not_stored():
+    cache = make_cache()
+    cache.lookup("v1", ROW)
+    cache.lookup("v2", [0] * 6)
+    # A prediction that started under v1 finishes after the swap to v2
+    cache.store("v1", ROW, "Normal")
+    assert cache.lookup("v2", ROW) is None
+    assert cache.local.stats()["size"] == 0
+
+
+def test_shared_tier_is_invalidated_across_workers(tmp_path):
+    first, second = make_cache(tmp_path), make_cache(tmp_path)
+    first.lookup("v1", ROW)
+    first.store("v1", ROW, ["high risk", "See a doctor"])
+    # Another worker finds it in the shared tier, as a tuple like the local results
+    assert second.lookup("v1", ROW) == ("high risk", "See a doctor")
+
+    # The first worker to see v2 clears everything older from the shared file
+    assert second.lookup("v2", ROW) is None
+    with sqlite3.connect(first.shared.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM risk_predictions").fetchone() == (0,)
+
+
+def test_disabled_cache_never_returns_anything():
+    cache = make_cache()
+    cache.enabled = False
+    cache.store("v1", ROW, "Normal")
+    assert cache.lookup("v1", ROW) is None
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import logging
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import server_timing
+
+
+async def handler(request):
+    server_timing.record_since_start("parsing")
+    server_timing.record("chunk", 0.002)
+    server_timing.record("chunk", 0.003)
+    return JSONResponse({"ok": True})
+
+
+async def streamed(request):
+    async def body():
+        yield "a"
+        # After the headers went out, so only the log line can carry it
+        server_timing.record("late", 0.004)
+        yield "b"
+    return StreamingResponse(body())
+
+
+def make_client(log=False):
+    app = Starlette(routes=[Route("/", handler), Route("/stream", streamed)])
+    app.add_middleware(server_timing.ServerTimingMiddleware, log=log)
+    return TestClient(app)
+
+
+def parse(header):
+    entries = {}
+    for entry in header.split(", "):
+        name, duration = entry.split(";dur=")
+        entries[name] = float(duration)
+    return entries
+
+
+def test_header_lists_stages_in_order_with_repeats_summed():
+    response = make_client().get("/")
+    entries = parse(response.headers["server-timing"])
+    assert list(entries) == ["parsing", "chunk", "total"]
+    assert entries["chunk"] == 5.0
+    assert entries["total"] >= entries["parsing"]
+
+
+def test_streamed_stages_reach_only_the_log(caplog):
+    with caplog.at_level(logging.INFO, logger="server_timing"):
+        response = make_client(log=True).get("/stream")
+    assert response.text == "ab"
+    assert list(parse(response.headers["server-timing"])) == ["total"]
+    [line] = [json.loads(record.message) for record in caplog.records if "request_timing" in record.message]
+    assert line["path"] == "/stream" and line["status"] == 200
+    assert line["spans_ms"] == {"late": 4.0}
+
+
+def test_recording_outside_a_request_is_a_no_op():
+    async def run():
+        server_timing.record("orphan", 1.0)
+        server_timing.record_since_start("orphan")
+        return server_timing.current()
+    assert asyncio.run(run()) is None
+
+
+def test_header_value_format():
+    assert server_timing.header_value({"validation": 0.0001234}, total=0.5) == "validation;dur=0.123, total;dur=500.000"
+    assert server_timing.header_value({}) == ""
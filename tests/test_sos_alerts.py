@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from twilio.request_validator import RequestValidator
+
+import main
+import sos_alerts
+import sos_outbox
+
+TOKEN = "test-auth-token"
+URL = "https://example.org/sos/status_callback"
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", TOKEN)
+    box = sos_outbox.Outbox(str(tmp_path / "outbox.sqlite"))
+    yield box
+    box.close()
+
+
+def sent_alert(outbox, alert_id="a1", sids=("SM1", "SM2")):
+    # An alert whose messages Twilio has accepted, as the dispatcher leaves it
+    outbox.enqueue(alert_id, 12.97, 77.59, [f"+1555000{i}" for i in range(len(sids))])
+    for message, sid in zip(outbox.claim_due(lease_seconds=30, limit=10), sids):
+        outbox.mark_sent(message.id, sid, "queued")
+
+
+def callback(sid, status, **extra):
+    params = {"MessageSid": sid, "MessageStatus": status, **extra}
+    return params, RequestValidator(TOKEN).compute_signature(URL, params)
+
+
+def statuses(alert):
+    return [message["status"] for message in alert.messages]
+
+
+def test_signed_callbacks_update_the_alert_and_the_outbox(outbox):
+    sent_alert(outbox)
+
+    async def run():
+        sender = sos_alerts.SOSSender(outbox=outbox)
+        alert = await sender.get_alert("a1")
+        version = alert.version
+        params, signature = callback("SM1", "delivered")
+        await sender.handle_callback(params, URL, signature)
+        assert alert.version == version + 1
+        params, signature = callback("SM2", "undelivered", ErrorCode="30003")
+        await sender.handle_callback(params, URL, signature)
+        return sender, alert
+
+    sender, alert = asyncio.run(run())
+    assert statuses(alert) == ["delivered", "undelivered"]
+    assert alert.messages[1]["error"] == "Twilio error 30003"
+    assert alert.done and not alert.snapshot()["all_delivered"]
+    assert sender.callbacks == 2
+    # Durable, so other workers and restarts see it
+    stored = outbox.load_alert("a1").messages
+    assert [message["status"] for message in stored] == ["delivered", "undelivered"]
+
+
+@pytest.mark.parametrize("forge", ["no signature", "wrong signature", "tampered status", "other url", "no token"])
+def test_forged_callbacks_are_rejected(outbox, monkeypatch, forge):
+    sent_alert(outbox)
+    params, signature = callback("SM1", "delivered")
+    url = URL
+    if forge == "no signature":
+        signature = None
+    elif forge == "wrong signature":
+        signature = RequestValidator("another-token").compute_signature(URL, params)
+    elif forge == "tampered status":
+        params["MessageStatus"] = "failed"
+    elif forge == "other url":
+        url = "https://attacker.example/sos/status_callback"
+    else:
+        monkeypatch.delenv("TWILIO_AUTH_TOKEN")
+
+    async def run():
+        sender = sos_alerts.SOSSender(outbox=outbox)
+        alert = await sender.get_alert("a1")
+        with pytest.raises(PermissionError):
+            await sender.handle_callback(params, url, signature)
+        return sender, alert
+
+    sender, alert = asyncio.run(run())
+    assert statuses(alert) == ["queued", "queued"] and sender.callbacks == 0
+
+
+def test_statuses_never_move_backwards():
+    alert = sos_alerts.Alert("a1", 0, 0, 0, [{"contact": "+1", "sid": "SM1", "status": "queued", "error": None}])
+    store = sos_alerts.AlertStore()
+    store.add(alert)
+    for status in ("delivered", "sent", "sending", "queued"):
+        store.update("SM1", status)
+    assert statuses(alert) == ["delivered"]
+    # read is the one status past delivered
+    assert store.update("SM1", "read") is alert
+    assert statuses(alert) == ["read"] and alert.version == 2
+
+
+def test_callback_before_the_sid_is_recorded_is_kept():
+    alert = sos_alerts.Alert("a1", 0, 0, 0, [{"contact": "+1", "sid": None, "status": "pending", "error": None}])
+    store = sos_alerts.AlertStore()
+    store.add(alert)
+    # Twilio's callback beat the create response back
+    assert store.update("SM1", "sent") is None
+    store.record_sent(alert, 0, "SM1", "queued")
+    assert statuses(alert) == ["sent"]
+
+
+def test_merge_takes_only_newer_state_from_other_workers():
+    alert = sos_alerts.Alert("a1", 0, 0, 0, [
+        {"contact": "+1", "sid": "SM1", "status": "delivered", "error": None},
+        {"contact": "+2", "sid": None, "status": "pending", "error": None},
+        {"contact": "+3", "sid": None, "status": "pending", "error": None},
+    ])
+    store = sos_alerts.AlertStore()
+    store.add(alert)
+    stored = [
+        {"contact": "+1", "sid": "SM1", "status": "sent", "error": None},
+        {"contact": "+2", "sid": "SM2", "status": "delivered", "error": None},
+        {"contact": "+3", "sid": None, "status": sos_alerts.SEND_FAILED, "error": "Invalid number"},
+    ]
+    assert store.merge(alert, stored) is True
+    assert statuses(alert) == ["delivered", "delivered", sos_alerts.SEND_FAILED]
+    assert alert.messages[2]["error"] == "Invalid number"
+    # The merged SID now routes callbacks handled here
+    assert store.knows("SM2")
+    assert store.merge(alert, stored) is False
+
+
+def test_status_callback_endpoint(outbox, monkeypatch):
+    sent_alert(outbox)
+    sender = sos_alerts.SOSSender(outbox=outbox, callback_url=URL)
+    monkeypatch.setattr(main, "sos_sender", sender)
+    client = TestClient(main.app)
+    params, signature = callback("SM1", "delivered")
+
+    forged = client.post("/sos/status_callback", data={**params, "MessageStatus": "failed"},
+                         headers={"X-Twilio-Signature": signature})
+    assert forged.status_code == 403
+    response = client.post("/sos/status_callback", data=params, headers={"X-Twilio-Signature": signature})
+    assert response.status_code == 204
+    assert outbox.load_alert("a1").messages[0]["status"] == "delivered"
+    # Any worker's status endpoint reads it back from the outbox
+    snapshot = client.get("/sos/status", params={"alert_id": "a1"}).json()
+    assert [message["status"] for message in snapshot["messages"]] == ["delivered", "queued"]
@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+import sos_outbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = sos_outbox.Outbox(str(tmp_path / "outbox.sqlite"))
+    yield box
+    box.close()
+
+
+def enqueue(outbox, alert_id="a1", contacts=("+15550001", "+15550002"), key="key-1", window=60.0):
+    return outbox.enqueue(alert_id, 12.97, 77.59, list(contacts), key, window)
+
+
+def test_same_key_within_window_returns_first_alert(outbox):
+    assert enqueue(outbox, "a1") == ("a1", True)
+    assert enqueue(outbox, "a2") == ("a1", False)
+    assert enqueue(outbox, "a3", key="key-2") == ("a3", True)
+    # Only the two created alerts have messages
+    assert outbox.counts()[sos_outbox.PENDING] == 4
+
+
+def test_same_key_after_window_is_a_new_alert(outbox):
+    enqueue(outbox, "a1", window=0.05)
+    time.sleep(0.1)
+    assert enqueue(outbox, "a2", window=0.05) == ("a2", True)
+
+
+def test_claim_leases_messages_until_the_lease_runs_out(outbox):
+    enqueue(outbox)
+    claimed = outbox.claim_due(lease_seconds=0.1, limit=10)
+    assert [(m.position, m.attempts) for m in claimed] == [(0, 1), (1, 1)]
+    assert outbox.claim_due(lease_seconds=0.1, limit=10) == []
+    assert outbox.counts()[sos_outbox.SENDING] == 2
+
+    # A sender that died mid-send leaves the message to be claimed again, as a new attempt
+    time.sleep(0.15)
+    reclaimed = outbox.claim_due(lease_seconds=30, limit=1)
+    assert len(reclaimed) == 1 and reclaimed[0].attempts == 2
+
+
+def test_workers_sharing_the_file_never_claim_a_message_twice(tmp_path):
+    path = str(tmp_path / "outbox.sqlite")
+    first, second = sos_outbox.Outbox(path), sos_outbox.Outbox(path)
+    try:
+        enqueue(first, contacts=[f"+1555000{i}" for i in range(6)])
+        ids = [m.id for m in first.claim_due(30, 4)] + [m.id for m in second.claim_due(30, 4)]
+        assert sorted(ids) == sorted(set(ids)) and len(ids) == 6
+    finally:
+        first.close()
+        second.close()
+
+
+def test_reschedule_delays_and_counts_attempts(outbox):
+    enqueue(outbox, contacts=["+15550001"])
+    message = outbox.claim_due(30, 10)[0]
+    due = time.time() + 60
+    outbox.reschedule(message.id, due, "timeout")
+    assert outbox.claim_due(30, 10) == []
+    assert outbox.next_due_at() == pytest.approx(due)
+    assert outbox.load_alert("a1").messages[0]["error"] == "timeout"
+
+    outbox.reschedule(message.id, time.time() - 1)
+    assert outbox.claim_due(30, 10)[0].attempts == 2
+
+
+def test_rate_limited_reschedule_gives_the_attempt_back(outbox):
+    enqueue(outbox, contacts=["+15550001"])
+    message = outbox.claim_due(30, 10)[0]
+    outbox.reschedule(message.id, time.time() - 1, None, count_attempt=False)
+    assert outbox.claim_due(30, 10)[0].attempts == 1
+
+
+def test_sent_and_failed_messages_are_not_claimed_again(outbox):
+    enqueue(outbox)
+    sent, failed = outbox.claim_due(30, 10)
+    outbox.mark_sent(sent.id, "SM1", "queued")
+    outbox.mark_failed(failed.id, "send_failed", "invalid number")
+    outbox.set_status("SM1", "delivered")
+
+    assert outbox.claim_due(0, 10) == []
+    assert outbox.next_due_at() is None
+    messages = outbox.load_alert("a1").messages
+    assert messages[0] == {"contact": "+15550001", "sid": "SM1", "status": "delivered", "error": None}
+    assert messages[1]["status"] == "send_failed" and messages[1]["error"] == "invalid number"
+
+
+def test_prune_keeps_alerts_still_being_sent(outbox):
+    enqueue(outbox, "a1", key="k1")
+    enqueue(outbox, "a2", key="k2")
+    for message in outbox.claim_due(30, 10):
+        if message.alert_id == "a1":
+            outbox.mark_sent(message.id, f"SM{message.id}", "delivered")
+    assert outbox.prune(retention=-1) == 1
+    assert outbox.load_alert("a1") is None
+    assert outbox.load_alert("a2") is not None
+
+
+def test_same_key_after_every_message_failed_is_a_new_alert(outbox):
+    enqueue(outbox, "a1")
+    first, second = outbox.claim_due(30, 10)
+    outbox.mark_failed(first.id, "send_failed", "invalid number")
+    # Still one message that may get through
+    assert enqueue(outbox, "a2") == ("a1", False)
+
+    outbox.mark_sent(second.id, "SM2", "queued")
+    outbox.set_status("SM2", "undelivered", "Twilio error 30003")
+    assert enqueue(outbox, "a3") == ("a3", True)
+    # The new alert is now the one repeats fold into
+    assert enqueue(outbox, "a4") == ("a3", False)
@@ -0,0 +1,74 @@
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import GridSearchCV
+
+import tuning
+
+PARAM_GRID = {"n_estimators": [4, 12], "max_depth": [2, 4, None], "min_samples_split": [2, 8]}
+
+
+def make_estimator(**params):
+    return RandomForestClassifier(random_state=0, **params)
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(240, 4))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + rng.normal(scale=0.5, size=240) > 0).astype(int)
+    return X, y
+
+
+@pytest.fixture(scope="module")
+def grid(data):
+    return GridSearchCV(make_estimator(), PARAM_GRID, cv=5, n_jobs=1).fit(*data)
+
+
+def stored_scores(cache):
+    with sqlite3.connect(cache.path) as conn:
+        rows = conn.execute("SELECT key, score FROM fold_scores").fetchall()
+    return {(json.dumps(json.loads(key)["params"], sort_keys=True), json.loads(key)["fold"]): score for key, score in rows}
+
+
+def test_fold_scores_match_grid_search(data, grid, tmp_path):
+    cache = tuning.FoldScoreCache(str(tmp_path / "tuning.sqlite"))
+    best_params, best_score, report = tuning.successive_halving(
+        make_estimator, PARAM_GRID, *data, "hash", cache=cache, n_jobs=1,
+    )
+
+    scores = stored_scores(cache)
+    # Every combination at the smallest size, and only the survivors grown to the larger one
+    assert report["rounds"][0]["candidates"] == 6 and report["rounds"][1]["candidates"] == 2
+    assert len(scores) == (6 + 2) * 5
+    compared = 0
+    for i, params in enumerate(grid.cv_results_["params"]):
+        for fold in range(5):
+            key = (json.dumps(params, sort_keys=True), fold)
+            if key in scores:
+                # Warm-started prefixes score exactly like separate fits
+                assert scores[key] == grid.cv_results_[f"split{fold}_test_score"][i]
+                compared += 1
+    assert compared == len(scores)
+
+    # The candidates are a subset of the grid's, so the winner can't beat it, and scores the same
+    assert best_score <= grid.best_score_
+    assert best_score == pytest.approx(
+        grid.cv_results_["mean_test_score"][grid.cv_results_["params"].index(best_params)]
+    )
+
+
+def test_second_run_is_served_from_the_cache(data, tmp_path):
+    cache = tuning.FoldScoreCache(str(tmp_path / "tuning.sqlite"))
+    first = tuning.successive_halving(make_estimator, PARAM_GRID, *data, "hash", cache=cache, n_jobs=1)
+    second = tuning.successive_halving(make_estimator, PARAM_GRID, *data, "hash", cache=cache, n_jobs=1)
+    assert second[:2] == first[:2]
+    assert second[2]["fits"] == 0 and second[2]["trees"] == 0
+    assert second[2]["cached_fits"] == first[2]["fits"]
+
+    # A different dataset shares nothing
+    third = tuning.successive_halving(make_estimator, PARAM_GRID, *data, "other", cache=cache, n_jobs=1)
+    assert third[2]["cached_fits"] == 0
@@ -0,0 +1,67 @@
+import argparse
+import logging
+import time
+
+import incremental
+import model_store
+import risk_management
+from fetus_health import initialize_fetal_model, update_fetal_model
+from risk_management import initialize_risk_model, update_risk_model
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the HerHealth models and write versioned artifacts.")
+    parser.add_argument("--model", choices=["risk", "fetal", "all"], default="all")
+    parser.add_argument("--force", action="store_true", help="Retrain even if the dataset hash is unchanged")
+    parser.add_argument("--search", choices=risk_management.SEARCH_MODES, default=risk_management.RISK_SEARCH,
+                        help="Hyperparameter search for the risk model")
+    parser.add_argument("--compare", action="store_true",
+                        help="Run both risk model searches and report their cost and accuracy; saves nothing")
+    parser.add_argument("--update", metavar="CASES_CSV",
+                        help="Add trees trained on newly labeled cases to the latest version instead of retraining")
+    parser.add_argument("--update-mode", choices=incremental.UPDATE_MODES, default="grow",
+                        help="grow: append the new trees; replace: drop as many of the oldest trees")
+    parser.add_argument("--trees", type=int, default=incremental.UPDATE_TREES, help="Trees trained per update")
+    parser.add_argument("--random-state", type=int,
+                        help="Seed for an update's holdout split, replay sample and new trees (default: drawn and recorded)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.compare:
+        compare_searches()
+        return
+    if args.update:
+        if args.model == "all":
+            parser.error("--update needs --model risk or --model fetal")
+        updater = {"fetal": update_fetal_model, "risk": update_risk_model}[args.model]
+        version, report = updater(args.update, args.update_mode, args.trees, args.random_state)
+        print(f"{args.model}: version {version} saved, update: {report}")
+        return
+    initializers = {
+        "fetal": initialize_fetal_model,
+        "risk": lambda force_retrain: initialize_risk_model(force_retrain, args.search),
+    }
+    names = list(initializers) if args.model == "all" else [args.model]
+    for name in names:
+        start = time.perf_counter()
+        initializers[name](force_retrain=args.force)
+        version = model_store.latest_version(name)
+        metrics = model_store.read_manifest(name, version).get("metrics", {})
+        print(f"{name}: version {version} ready in {time.perf_counter() - start:.2f}s, metrics: {metrics}")
+
+
+def compare_searches():
+    print(f"{'search':<8} {'wall s':>8} {'cpu s':>8} {'trees':>6} {'cached':>6} {'cv acc':>7} {'test acc':>8}  best params")
+    for search in reversed(risk_management.SEARCH_MODES):
+        _, metrics = risk_management.train_risk_model(search)
+        print(
+            f"{search:<8} {metrics['search_wall_seconds']:>8.2f} {metrics['search_cpu_seconds']:>8.2f} "
+            f"{metrics['search_trees_fitted']:>6} {metrics['search_cached_fits']:>6} {metrics['cv_accuracy']:>7.4f} "
+            f"{metrics['test_accuracy']:>8.4f}  {metrics['best_params']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import model_store
+
+logger = logging.getLogger(__name__)
+
+# Per-fold CV scores from earlier tuning runs, keyed by dataset hash and parameter set
+CACHE_PATH = os.getenv("HERHEALTH_TUNING_CACHE", os.path.join(model_store.models_dir, "tuning_cache.sqlite"))
+HALVING_FACTOR = 3
+
+
+class FoldScoreCache:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS fold_scores (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+        return self._conn
+
+    def get(self, keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT key, score FROM fold_scores WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(rows)
+        return found
+
+    def put(self, scores):
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO fold_scores (key, score) VALUES (?, ?)", scores.items())
+
+
+def _fold_key(context, params, fold):
+    return json.dumps({**context, "params": params, "fold": fold}, sort_keys=True)
+
+
+def _grow_and_score(make_estimator, params, resource, levels, X, y, train_idx, test_idx, forest=None):
+    """Fit `forest` (or grow it, warm-started) to max(levels) trees; score each tree-count prefix in `levels`.
+
+    With warm_start a forest grown from k to n trees is identical to one fitted
+    with n trees directly, so every prefix score equals a full fit's score.
+    """
+    target = max(levels)
+    if forest is None:
+        forest = make_estimator(**{**params, resource: target})
+    else:
+        forest.set_params(**{resource: target, "warm_start": True})
+    forest.fit(X[train_idx], y[train_idx])
+
+    # Accumulate tree probabilities in order and average, as the forest's own predict_proba does
+    X_test = X[test_idx].astype(np.float32)
+    proba = np.zeros((len(test_idx), forest.n_classes_))
+    scores = {}
+    for k, tree in enumerate(forest.estimators_, 1):
+        proba += tree.predict_proba(X_test, check_input=False)
+        if k in levels:
+            predicted = forest.classes_.take(np.argmax(proba / k, axis=1))
+            scores[k] = float(np.mean(predicted == y[test_idx]))
+    return forest, scores
+
+
+def successive_halving(make_estimator, param_grid, X, y, data_hash, resource="n_estimators", cv=5,
+                       factor=HALVING_FACTOR, random_state=42, cache=None, n_jobs=-1):
+    """Successive halving over `param_grid` with the forest size as the resource.
+
+    Every combination of the other parameters is scored at the smallest
+    `resource` value, the best 1/`factor` are grown (warm-started) to the next
+    value, and so on. All scores are full 5-fold CV scores on the same folds as
+    GridSearchCV, so they match its cv_results_ exactly; only combinations that
+    lose early are never grown. Fold scores are cached in `cache`, so re-tuning
+    only fits parameter sets (or datasets) it hasn't seen. Returns
+    (best_params, best_cv_score, report).
+    """
+    from joblib import Parallel, delayed
+    from sklearn.base import clone
+    from sklearn.model_selection import ParameterGrid, StratifiedKFold
+
+    X, y = np.asarray(X), np.asarray(y)
+    cache = cache if cache is not None else FoldScoreCache()
+    folds = list(StratifiedKFold(n_splits=cv).split(X, y))
+    context = {
+        "data_hash": data_hash,
+        "cv": cv,
+        "random_state": random_state,
+        "estimator": repr(clone(make_estimator())),
+        "sklearn_version": model_store.sklearn_version(),
+    }
+
+    levels = sorted(param_grid[resource])
+    combos = list(ParameterGrid({k: v for k, v in param_grid.items() if k != resource}))
+    alive = list(range(len(combos)))
+    forests = {}
+    fold_scores = {}
+    report = {"rounds": [], "fits": 0, "trees": 0, "cached_fits": 0}
+
+    for round_index, level in enumerate(levels):
+        round_levels = [lv for lv in levels if lv <= level]
+        keys = {
+            (c, lv, fold): _fold_key(context, {**combos[c], resource: lv}, fold)
+            for c in alive for lv in round_levels for fold in range(cv)
+        }
+        cached = cache.get(keys.values())
+        fold_scores.update({pair: cached[key] for pair, key in keys.items() if key in cached})
+        missing = sorted({(c, fold) for (c, lv, fold) in keys if (c, lv, fold) not in fold_scores})
+        grown = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(_grow_and_score)(
+                make_estimator, combos[c], resource, round_levels, X, y, *folds[fold], forests.get((c, fold))
+            )
+            for c, fold in missing
+        )
+        new_scores = {}
+        for (c, fold), (forest, scores) in zip(missing, grown):
+            report["trees"] += level - (len(forests[(c, fold)].estimators_) if (c, fold) in forests else 0)
+            forests[(c, fold)] = forest
+            new_scores.update({(c, lv, fold): score for lv, score in scores.items()})
+        cache.put({keys[pair]: score for pair, score in new_scores.items()})
+        fold_scores.update(new_scores)
+
+        report["rounds"].append({
+            resource: level,
+            "candidates": len(alive),
+            "fits": len(missing),
+            "cached_fits": len(alive) * cv - len(missing),
+        })
+        report["fits"] += len(missing)
+        report["cached_fits"] += len(alive) * cv - len(missing)
+
+        if round_index < len(levels) - 1:
+            means = {c: np.mean([fold_scores[(c, level, fold)] for fold in range(cv)]) for c in alive}
+            # Stable sort keeps grid order among ties, like GridSearchCV's ranking
+            alive = sorted(sorted(alive, key=lambda c: -means[c])[:max(1, math.ceil(len(alive) / factor))])
+            forests = {key: forest for key, forest in forests.items() if key[0] in alive}
+
+    # Every (combination, size) scored on all folds is a candidate, ranked in ParameterGrid order
+    candidates = list(ParameterGrid(param_grid))
+    best_params, best_score = None, -np.inf
+    for params in candidates:
+        c = combos.index({k: v for k, v in params.items() if k != resource})
+        scores = [fold_scores.get((c, params[resource], fold)) for fold in range(cv)]
+        if None not in scores and np.mean(scores) > best_score:
+            best_params, best_score = params, float(np.mean(scores))
+    return best_params, best_score, report
+
+
+def timed(fn, *args, **kwargs):
+    """Call fn and return (result, wall_seconds, cpu_seconds) for this process and its threads."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - wall, time.process_time() - cpu